@@ -0,0 +1,141 @@
+"""
+登录接口 并发压测: 事件循环中同步 bcrypt (每次新建 CryptContext) vs 数据库线程池 + bcrypt 进程池
+
+在项目根目录执行 (需要 config.py):
+    python benchmarks/bench_login.py --logins 64 --concurrency 16
+
+同时请求一个不查库的 /ping 接口, 统计登录压力下它的延迟 (事件循环是否被 bcrypt 占用)
+压测使用独立的临时 sqlite 数据库, 不会写入 config.py 中配置的数据库
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Depends, HTTPException, Form
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+from lsshu.internal.executor import run_db
+from lsshu.internal.password import PASSWORD_HASHER, password_context
+from lsshu.oauth.model import Model, ModelOAuthUsers
+from lsshu.oauth.user.crud import CRUDOAuthUser
+from lsshu.oauth.user.main import authenticate_user
+
+
+def seed(url: str, users: int):
+    """
+    建表并写入测试用户 密码 p{i} 按当前 OAUTH_BCRYPT_ROUNDS 加密
+    :param url:
+    :param users:
+    :return:
+    """
+    engine = create_engine(url)
+    Model.metadata.drop_all(engine)
+    Model.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([ModelOAuthUsers(username="u%s" % i, password=password_context(PASSWORD_HASHER.rounds).hash("p%s" % i)) for i in range(users)])
+    db.commit(), db.close()
+    engine.dispose()
+
+
+def create_app(url: str):
+    """
+    同一个登录验证 分别用 原方式 / 线程池+进程池 实现
+    :param url:
+    :return:
+    """
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    session_local = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    def dbs():
+        db = session_local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+
+    @app.post("/inline")
+    async def inline_login(username: str = Form(), password: str = Form(), db: Session = Depends(dbs)):
+        from passlib.context import CryptContext
+        user = CRUDOAuthUser.first(db=db, where=("username", username))
+        if not user or not CryptContext(schemes=['bcrypt'], deprecated='auto').verify(password, user.password):
+            raise HTTPException(status_code=400)
+        return {"id": user.id}
+
+    @app.post("/pool")
+    async def pool_login(username: str = Form(), password: str = Form(), db: Session = Depends(dbs)):
+        user = await run_db(authenticate_user, db=db, username=username, password=password)
+        return {"id": user.id}
+
+    @app.get("/ping")
+    async def ping():
+        return {"pong": True}
+
+    return app
+
+
+async def run(app, path: str, logins: int, concurrency: int, users: int) -> tuple:
+    """
+    并发登录 同时每 10ms 请求一次 /ping 统计延迟
+    :param app:
+    :param path:
+    :param logins:
+    :param concurrency:
+    :param users:
+    :return: (登录/秒, ping 中位数毫秒, ping 最大毫秒)
+    """
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    pings = []
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def one(i):
+            async with semaphore:
+                response = await client.post(path, data={"username": "u%s" % (i % users), "password": "p%s" % (i % users)})
+                assert response.status_code == 200, response.text
+
+        async def ping(done: asyncio.Event):
+            while not done.is_set():
+                # 从计划发出(10ms 后)到收到响应 事件循环被占用时 sleep 也会延后
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                await client.get("/ping")
+                pings.append((time.perf_counter() - start - 0.01) * 1000)
+
+        await one(0)  # 预热 (进程池启动)
+        done = asyncio.Event()
+        pinger = asyncio.create_task(ping(done))
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(logins)])
+        elapsed = time.perf_counter() - start
+        done.set()
+        await pinger
+    return logins / elapsed, statistics.median(pings), max(pings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    url = "sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    seed(url, args.users)
+    app = create_app(url)
+    print("bcrypt rounds=%s workers=%s concurrency=%s cpu=%s" % (PASSWORD_HASHER.rounds, PASSWORD_HASHER.workers, PASSWORD_HASHER.concurrency, os.cpu_count()))
+    for name, path in (("inline", "/inline"), ("pool", "/pool")):
+        rps, median, slowest = asyncio.run(run(app, path, args.logins, args.concurrency, args.users))
+        print("%-8s %7.1f logins/s   /ping median %7.1f ms  max %7.1f ms" % (name, rps, median, slowest))
+    PASSWORD_HASHER.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+列表接口 响应序列化压测: Schemas(data=SchemasPaginateItem(**data)) + jsonable_encoder vs schemas_response 快速路径
+
+在项目根目录执行 (需要 config.py):
+    python benchmarks/bench_response.py --users 1000 --limit 1000 --rounds 50
+
+serialize: 只计算序列化 (同一页数据 不含查询); endpoint: 完整请求 (查询 + 序列化)
+压测使用独立的临时 sqlite 数据库, 不会写入 config.py 中配置的数据库
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+from lsshu.internal.depends import model_screen_params
+from lsshu.internal.schema import Schemas, ModelScreenParams, schemas_response
+from lsshu.oauth.model import Model, ModelOAuthUsers, ModelOAuthPermissions, ModelOAuthRoles
+from lsshu.oauth.user.crud import CRUDOAuthUser
+from lsshu.oauth.user.schema import SchemasPaginateItem
+
+
+def seed(url: str, users: int):
+    """
+    建表并写入测试用户
+    :param url:
+    :param users:
+    :return:
+    """
+    engine = create_engine(url)
+    Model.metadata.drop_all(engine)
+    Model.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    permissions = [ModelOAuthPermissions(name="p%s" % i, scope="bench.p%s" % i, path="/") for i in range(10)]
+    roles = [ModelOAuthRoles(name="r%s" % i, scopes="bench", permissions=permissions[:3]) for i in range(3)]
+    db.add_all(permissions + roles)
+    db.add_all([ModelOAuthUsers(username="u%s" % i, password="-", sort=i, user_phone="1380000%04d" % i, permissions=permissions[:i % 5], roles=roles[:i % 3])
+                for i in range(users)])
+    db.commit(), db.close()
+    engine.dispose()
+
+
+def schemas_path(data: dict) -> bytes:
+    """
+    原路径: 构造 Schemas 校验, FastAPI 再 jsonable_encoder, JSONResponse 编码
+    :param data:
+    :return:
+    """
+    return JSONResponse(jsonable_encoder(Schemas(data=SchemasPaginateItem(**data)))).body
+
+
+def fast_path(data: dict) -> bytes:
+    """
+    快速路径: 预编译取值 + orjson
+    :param data:
+    :return:
+    """
+    return schemas_response(data, SchemasPaginateItem).body
+
+
+def timeit(func, data, rounds: int) -> float:
+    """
+    平均耗时 毫秒
+    :param func:
+    :param data:
+    :param rounds:
+    :return:
+    """
+    func(data)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(data)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def create_app(session_local):
+    """
+    同一个列表接口 分别用两种方式返回
+    :param session_local:
+    :return:
+    """
+
+    def dbs():
+        db = session_local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+
+    @app.get("/schemas")
+    def schemas_models(db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params)):
+        return Schemas(data=SchemasPaginateItem(**CRUDOAuthUser.paginate(db=db, screen_params=params)))
+
+    @app.get("/fast")
+    def fast_models(db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params)):
+        return schemas_response(CRUDOAuthUser.paginate(db=db, screen_params=params), SchemasPaginateItem)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=1000, help="每页条数")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    url = "sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    seed(url, args.users)
+    session_local = sessionmaker(bind=create_engine(url, connect_args={"check_same_thread": False}), autoflush=False, autocommit=False)
+
+    db = session_local()
+    data = CRUDOAuthUser.paginate(db=db, screen_params=ModelScreenParams(page=1, limit=args.limit))
+    assert json.loads(schemas_path(data)) == json.loads(fast_path(data)), "两种方式的输出不一致"
+    results = {"schemas": timeit(schemas_path, data, args.rounds), "fast": timeit(fast_path, data, args.rounds)}
+    db.close()
+    print("serialize (%s rows)" % len(data["items"]))
+    for name, ms in results.items():
+        print("  %-8s %8.2f ms  x%.1f" % (name, ms, results["schemas"] / ms))
+
+    from fastapi.testclient import TestClient
+    client = TestClient(create_app(session_local))
+    print("endpoint (limit=%s)" % args.limit)
+    endpoint = {}
+    for name in ("schemas", "fast"):
+        endpoint[name] = timeit(lambda path: client.get(path, params={"limit": args.limit}).raise_for_status(), "/%s" % name, args.rounds)
+    for name, ms in endpoint.items():
+        print("  %-8s %8.2f ms  x%.1f" % (name, ms, endpoint["schemas"] / ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from sqlalchemy.orm import Session
 
 from lsshu.internal.db import dbs
 from lsshu.internal.depends import model_screen_params, model_post_screen_params, auth_user
-from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError
+from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError, schemas_response
 from lsshu.oauth.user.schema import SchemasOAuthScopes
 
 from lsshu.demo.crud import CRUD
@@ -25,8 +25,8 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUD.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    db_model_list = await CRUD.threaded.paginate(db=db, screen_params=params)
+    return schemas_response(db_model_list, SchemasPaginateItem)
 
 
 @router.post('/{}.post'.format(name), name="get {}".format(name))
@@ -38,8 +38,8 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUD.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    db_model_list = await CRUD.threaded.paginate(db=db, screen_params=params)
+    return schemas_response(db_model_list, SchemasPaginateItem)
 
 
 @router.get('/{}.params'.format(name), name="get {}".format(name))
@@ -62,10 +62,10 @@ async def get_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthScope
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    return Schemas(data=SchemasResponse(**db_model.to_dict()))
+    return schemas_response(db_model.to_dict(), SchemasResponse)
 
 
 @router.post('/{}'.format(name), name="get {}".format(name))
@@ -77,11 +77,11 @@ async def store_model(item: SchemasStoreUpdate, db: Session = Depends(dbs),
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, where=("name", item.name))
+    db_model = await CRUD.threaded.first(db=db, where=("name", item.name))
     if db_model is not None:
         return SchemasError(message="Data Already Registered")
-    bool_model = CRUD.store(db=db, item=item)
-    return Schemas(data=SchemasResponse(**bool_model.to_dict()))
+    bool_model = await CRUD.threaded.store(db=db, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasResponse)
 
 
 @router.put("/{}/{{pk}}".format(name), name="update {}".format(name))
@@ -94,11 +94,11 @@ async def update_put_model(pk: int, item: SchemasStoreUpdate, db: Session = Depe
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUD.update(db=db, pk=pk, item=item)
-    return Schemas(data=SchemasResponse(**bool_model.to_dict()))
+    bool_model = await CRUD.threaded.update(db=db, pk=pk, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasResponse)
 
 
 @router.patch("/{}/{{pk}}".format(name), name="update {}".format(name))
@@ -111,11 +111,11 @@ async def update_patch_model(pk: int, item: SchemasStoreUpdate, db: Session = De
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUD.update(db=db, pk=pk, item=item, exclude_unset=True)
-    return Schemas(data=SchemasResponse(**bool_model.to_dict()))
+    bool_model = await CRUD.threaded.update(db=db, pk=pk, item=item, exclude_unset=True)
+    return schemas_response(bool_model.to_dict(), SchemasResponse)
 
 
 @router.delete("/{}/{{pk}}".format(name), name="delete {}".format(name))
@@ -126,7 +126,7 @@ async def delete_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthSc
     :param auth:
     :return:
     """
-    bool_model = CRUD.delete(db=db, pk=pk)
+    bool_model = await CRUD.threaded.delete(db=db, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -138,5 +138,5 @@ async def delete_models(pks: List[int], db: Session = Depends(dbs), auth: Schema
     :param auth:
     :return:
     """
-    bool_model = CRUD.delete(db=db, pks=pks)
+    bool_model = await CRUD.threaded.delete(db=db, pks=pks)
     return Schemas(data=bool_model)
@@ -0,0 +1,154 @@
+import threading
+from typing import Union
+
+try:
+    from config import DB_INDEX_ADVISOR
+except ImportError:
+    DB_INDEX_ADVISOR = False
+
+# 可走索引的操作符 等值 / 范围; like(前后 %)、or 多字段、全文搜索 不记录
+EQUALITY_OPERATORS: tuple = ("==", "=", "eq", "in", "or")
+RANGE_OPERATORS: tuple = (">", "gt", ">=", "ge", "<", "lt", "<=", "le", "between", "datebetween", "datetimebetween")
+
+
+def where_shape(where: Union[list, tuple]) -> tuple:
+    """
+    筛选条件的形状
+    :param where: [('name', '西'), ('id', '>', 1)]
+    :return: ((等值字段), (范围字段))
+    """
+    equality, ranges = set(), set()
+    for w in where or []:
+        if not w or type(w[0]) is not str:
+            continue
+        operator = "==" if len(w) == 2 else (w[1] if len(w) == 3 else None)
+        if operator in EQUALITY_OPERATORS:
+            equality.add(w[0])
+        elif operator in RANGE_OPERATORS:
+            ranges.add(w[0])
+    return tuple(sorted(equality)), tuple(sorted(ranges - equality))
+
+
+def index_columns(equality: tuple, ranges: tuple, order: tuple) -> tuple:
+    """
+    建议的复合索引字段 等值字段 + 一个范围字段 或 排序字段 (同方向)
+    :param equality:
+    :param ranges:
+    :param order: ((字段, 方向))
+    :return:
+    """
+    columns = list(equality)
+    if ranges:
+        columns.append(ranges[0])
+    elif order and len({direction for _, direction in order}) == 1:
+        columns.extend(key for key, _ in order if key not in columns)
+    return tuple(columns)
+
+
+class IndexAdvisor(object):
+    """
+    记录 CRUD 查询实际使用的 (表, 等值字段, 范围字段, 排序) 组合, 按使用次数给出复合索引建议
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def record(self, model, where: Union[list, tuple, None], order: Union[list, tuple, None] = None):
+        """
+        记录一次查询
+        :param model:
+        :param where:
+        :param order: [('id', 'desc')]
+        :return:
+        """
+        equality, ranges = where_shape(where)
+        order = tuple((o[0], o[1]) for o in (order or []) if o and type(o[0]) is str)
+        if not equality and not ranges and not order:
+            return
+        key = (model, equality, ranges, order)
+        with self.lock:
+            self.data[key] = self.data.get(key, 0) + 1
+
+    def shapes(self) -> list:
+        """
+        已记录的形状 使用次数多的在前
+        :return:
+        """
+        with self.lock:
+            items = list(self.data.items())
+        return [{"table": model.__tablename__, "equality": list(equality), "range": list(ranges), "order": [list(o) for o in order], "uses": uses}
+                for (model, equality, ranges, order), uses in sorted(items, key=lambda item: -item[1])]
+
+    def advice(self, bind, min_uses: int = 1) -> list:
+        """
+        索引建议 已被现有索引(前缀)覆盖的不返回
+        :param bind: Engine
+        :param min_uses: 最少使用次数
+        :return: [{"table", "columns", "uses", "ddl"}]
+        """
+        from sqlalchemy import inspect
+        with self.lock:
+            items = list(self.data.items())
+        advice, existing = {}, {}
+        for (model, equality, ranges, order), uses in items:
+            table = model.__tablename__
+            columns = tuple(c for c in index_columns(equality, ranges, order) if c in model.__table__.c)
+            if not columns:
+                continue
+            if table not in existing:
+                inspector = inspect(bind)
+                existing[table] = [tuple(index["column_names"]) for index in inspector.get_indexes(table)] + \
+                                  [tuple(unique["column_names"]) for unique in inspector.get_unique_constraints(table)] + \
+                                  [tuple(inspector.get_pk_constraint(table)["constrained_columns"])]
+            if any(index[:len(columns)] == columns for index in existing[table]):
+                continue
+            item = advice.setdefault((table, columns), {"table": table, "columns": list(columns), "uses": 0})
+            item["uses"] += uses
+        return [dict(item, ddl=self.ddl(bind, item["table"], item["columns"]))
+                for item in sorted(advice.values(), key=lambda item: -item["uses"]) if item["uses"] >= min_uses]
+
+    @staticmethod
+    def ddl(bind, table: str, columns: list) -> str:
+        """
+        在线建索引语句 postgresql CONCURRENTLY, mysql ALGORITHM=INPLACE LOCK=NONE
+        :param bind:
+        :param table:
+        :param columns:
+        :return:
+        """
+        quote = bind.dialect.identifier_preparer.quote
+        name = ("ix_%s_%s" % (table, "_".join(columns)))[:60]
+        names = ", ".join(quote(column) for column in columns)
+        dialect = bind.dialect.name
+        if dialect == "postgresql":
+            return "CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s)" % (quote(name), quote(table), names)
+        if dialect == "mysql":
+            return "CREATE INDEX %s ON %s (%s) ALGORITHM=INPLACE LOCK=NONE" % (quote(name), quote(table), names)
+        return "CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (quote(name), quote(table), names)
+
+    def create(self, bind, min_uses: int = 1) -> list:
+        """
+        按建议建立索引 自动提交模式执行 (CONCURRENTLY 不能在事务中)
+        :param bind: Engine
+        :param min_uses:
+        :return: 已执行的建议
+        """
+        from sqlalchemy import text
+        advice = self.advice(bind, min_uses=min_uses)
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            for item in advice:
+                connection.execute(text(item["ddl"]))
+        return advice
+
+    def clear(self):
+        """
+        清空
+        :return:
+        """
+        with self.lock:
+            self.data.clear()
+
+
+INDEX_ADVISOR = IndexAdvisor(enabled=DB_INDEX_ADVISOR)
@@ -0,0 +1,436 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    from config import DB_RESULT_CACHE
+except ImportError:
+    DB_RESULT_CACHE = False
+
+try:
+    from config import DB_RESULT_CACHE_TTL
+except ImportError:
+    DB_RESULT_CACHE_TTL = 60
+
+try:
+    from config import DB_IDENTITY_CACHE_TTL
+except ImportError:
+    DB_IDENTITY_CACHE_TTL = 0
+
+try:
+    from config import DB_IDENTITY_CACHE_SIZE
+except ImportError:
+    DB_IDENTITY_CACHE_SIZE = 10000
+
+try:
+    from config import DB_CACHE_CHANNEL
+except ImportError:
+    DB_CACHE_CHANNEL = None
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    """进程内 LRU + 过期时间 缓存 线程安全"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        获取缓存 过期返回 default
+        :param key:
+        :param default:
+        :return:
+        """
+        with self.lock:
+            item = self.data.get(key, None)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """
+        设置缓存
+        :param key:
+        :param value:
+        :param ttl: 秒 None 使用默认 0 不过期
+        :return:
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl if ttl else None)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+    def delete(self, key):
+        """
+        删除缓存
+        :param key:
+        :return:
+        """
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        """
+        清空缓存
+        :return:
+        """
+        with self.lock:
+            self.data.clear()
+
+
+# 表版本号 写入提交后自增, 缓存键带上版本号即可整表失效
+TABLE_VERSIONS: dict = {}
+_table_versions_lock = threading.Lock()
+
+
+def table_version(*tables: str) -> tuple:
+    """
+    获取表版本号
+    :param tables:
+    :return:
+    """
+    return tuple(TABLE_VERSIONS.get(table, 0) for table in tables)
+
+
+def bump_table_version(*tables: str):
+    """
+    表版本号自增
+    :param tables:
+    :return:
+    """
+    with _table_versions_lock:
+        for table in tables:
+            TABLE_VERSIONS[table] = TABLE_VERSIONS.get(table, 0) + 1
+
+
+def mark_table_changed(session: Session, *tables: str):
+    """
+    记录会话中写入的表 提交后自增版本号 (用于 Core insert/update 等不经过 flush 的写入)
+    :param session:
+    :param tables:
+    :return:
+    """
+    session = getattr(session, "sync_session", session)
+    session.info.setdefault("changed_tables", set()).update(tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _receive_after_flush(session, flush_context):
+    tables = [obj.__table__.name for obj in list(session.new) + list(session.dirty) + list(session.deleted) if hasattr(obj, "__table__")]
+    if tables:
+        mark_table_changed(session, *tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _receive_do_orm_execute(orm_execute_state):
+    if (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is not None:
+        mark_table_changed(orm_execute_state.session, orm_execute_state.bind_mapper.local_table.name)
+
+
+class ResultCache(object):
+    """
+    查询结果缓存 存储在 Redis (RedisSync), 表版本号也存 Redis 多进程共享, 写入提交后自增使缓存失效
+    Redis 不可用时 读写缓存失败只记录日志 查询回落到数据库
+    """
+
+    def __init__(self, enabled: bool = False, ttl: int = 60):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.client = None
+        self.stats_data = {}
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        """
+        延迟创建客户端
+        :return:
+        """
+        if self.client is None:
+            from lsshu.internal.redis import RedisSync
+            self.client = RedisSync()
+        return self.client
+
+    def versions(self, *tables: str) -> tuple:
+        """
+        表版本号
+        :param tables:
+        :return:
+        """
+        return self.redis.counters(*["table-version-%s" % table for table in tables])
+
+    def bump(self, *tables: str):
+        """
+        表版本号自增
+        :param tables:
+        :return:
+        """
+        try:
+            self.redis.incr(*["table-version-%s" % table for table in tables])
+        except Exception as e:
+            logger.warning("result cache bump %s failed: %s", tables, e)
+
+    def get(self, key: str, table: str = None):
+        """
+        获取缓存 统计命中
+        :param key:
+        :param table: 统计分组
+        :return: 未命中为 None
+        """
+        try:
+            value = self.redis.string(key)
+        except Exception as e:
+            logger.warning("result cache get failed: %s", e)
+            value = None
+        self.count(table, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: str, ttl: int = None):
+        """
+        设置缓存
+        :param key:
+        :param value:
+        :param ttl: None 使用默认
+        :return:
+        """
+        try:
+            self.redis.string(key, value, ttl=self.ttl if ttl is None else ttl)
+        except Exception as e:
+            logger.warning("result cache set failed: %s", e)
+
+    def count(self, table: str, name: str):
+        """
+        计数
+        :param table:
+        :param name: hits misses
+        :return:
+        """
+        with self.lock:
+            counters = self.stats_data.setdefault(table, {"hits": 0, "misses": 0})
+            counters[name] += 1
+
+    def stats(self) -> dict:
+        """
+        命中统计 {表: {"hits": 1, "misses": 1, "hit_rate": 0.5}}
+        :return:
+        """
+        with self.lock:
+            return {table: dict(counters, hit_rate=round(counters["hits"] / ((counters["hits"] + counters["misses"]) or 1), 4))
+                    for table, counters in self.stats_data.items()}
+
+
+RESULT_CACHE = ResultCache(enabled=DB_RESULT_CACHE, ttl=DB_RESULT_CACHE_TTL)
+
+# 主键查询 进程内缓存 键带表版本号 写入提交后失效
+IDENTITY_CACHE = TTLCache(maxsize=DB_IDENTITY_CACHE_SIZE, ttl=DB_IDENTITY_CACHE_TTL)
+
+
+class InvalidationChannel(object):
+    """
+    跨进程失效通道 Redis 发布/订阅 写入提交后广播表名, 其它进程收到后自增本进程的表版本号
+    """
+
+    def __init__(self, name: str):
+        import uuid
+        self.name = name
+        self.sender = uuid.uuid4().hex
+        self.client = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        """
+        延迟创建客户端
+        :return:
+        """
+        if self.client is None:
+            from lsshu.internal.redis import RedisSync
+            self.client = RedisSync()
+        return self.client
+
+    def publish(self, *tables: str):
+        """
+        广播写入的表
+        :param tables:
+        :return:
+        """
+        try:
+            self.redis.redis.publish(self.name, json.dumps({"sender": self.sender, "tables": list(tables)}))
+        except Exception as e:
+            logger.warning("cache channel publish %s failed: %s", tables, e)
+
+    def start(self):
+        """
+        启动订阅线程 重复调用无影响
+        :return:
+        """
+        with self.lock:
+            if self.thread is not None:
+                return self
+            self.thread = threading.Thread(target=self.listen, name="cache-channel", daemon=True)
+            self.thread.start()
+        return self
+
+    def listen(self):
+        """
+        订阅 断线后重连
+        :return:
+        """
+        while True:
+            try:
+                pubsub = self.redis.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.name)
+                for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data.get("sender") != self.sender:
+                        bump_table_version(*data.get("tables", []))
+            except Exception as e:
+                logger.warning("cache channel listen failed: %s", e)
+                time.sleep(1)
+
+
+CACHE_CHANNEL = InvalidationChannel(DB_CACHE_CHANNEL) if DB_CACHE_CHANNEL else None
+
+
+def _dump_value(value):
+    """
+    json 不支持的类型
+    :param value:
+    :return:
+    """
+    import base64
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    return str(value)
+
+
+def _load_value(python_type, value):
+    """
+    按字段类型还原
+    :param python_type:
+    :param value:
+    :return:
+    """
+    import base64
+    import datetime
+    if value is None or python_type is None or isinstance(value, python_type):
+        return value
+    if python_type in (datetime.datetime, datetime.date, datetime.time):
+        return python_type.fromisoformat(value)
+    if python_type is bytes:
+        return base64.b64decode(value)
+    return python_type(value)
+
+
+def dump_rows(model, rows: list, tree: dict = None) -> dict:
+    """
+    模型实例 转 紧凑结构 {"c": [字段], "r": [[值, ..., {关联: {...}}]]} 只包含已加载的字段和 tree 中已加载的关联
+    :param model:
+    :param rows:
+    :param tree: 关联树 {"roles": {"permissions": {}}}
+    :return:
+    """
+    from sqlalchemy import inspect
+    tree = tree or {}
+    mapper = model.__mapper__
+    loaded = inspect(rows[0]).dict if rows else {}
+    keys = [key for key in mapper.column_attrs.keys() if key in loaded]
+    data = []
+    for row in rows:
+        state = inspect(row).dict
+        values = [state.get(key) for key in keys]
+        if tree:
+            relations = {}
+            for name, sub in tree.items():
+                if name in state:
+                    value = state[name]
+                    children = list(value) if mapper.relationships[name].uselist else ([value] if value is not None else [])
+                    relations[name] = dump_rows(mapper.relationships[name].mapper.class_, children, sub)
+            values.append(relations)
+        data.append(values)
+    return {"c": keys, "r": data}
+
+
+def load_rows(session: Session, model, payload: dict, tree: dict = None) -> list:
+    """
+    紧凑结构 还原为 会话中的持久化实例 (merge load=False 不查询数据库) 未缓存的字段/关联 访问时按原方式加载
+    :param session:
+    :param model:
+    :param payload:
+    :param tree:
+    :return:
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.orm import make_transient_to_detached
+    from sqlalchemy.orm.attributes import set_committed_value
+    tree = tree or {}
+    mapper = model.__mapper__
+    keys = payload["c"]
+    types = []
+    for key in keys:
+        try:
+            types.append(mapper.column_attrs[key].columns[0].type.python_type)
+        except NotImplementedError:
+            types.append(None)
+    rows = []
+    for values in payload["r"]:
+        obj = mapper.class_manager.new_instance()
+        for key, python_type, value in zip(keys, types, values):
+            set_committed_value(obj, key, _load_value(python_type, value))
+        if tree:
+            for name, sub in tree.items():
+                if name in values[-1]:
+                    prop = mapper.relationships[name]
+                    children = load_rows(session, prop.mapper.class_, values[-1][name], sub)
+                    set_committed_value(obj, name, children if prop.uselist else (children[0] if children else None))
+        make_transient_to_detached(obj)
+        # 会话中已有的实例 与查询一样直接返回 不覆盖其状态
+        existing = session.identity_map.get(inspect(obj).key)
+        rows.append(existing if existing is not None else session.merge(obj, load=False))
+    return rows
+
+
+def dumps(payload) -> str:
+    """
+    紧凑 json
+    :param payload:
+    :return:
+    """
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=_dump_value)
+
+
+@event.listens_for(Session, "after_commit")
+def _receive_after_commit(session):
+    tables = session.info.pop("changed_tables", None)
+    if tables:
+        bump_table_version(*tables)
+        if RESULT_CACHE.enabled:
+            RESULT_CACHE.bump(*tables)
+        if CACHE_CHANNEL is not None:
+            CACHE_CHANNEL.publish(*tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _receive_after_rollback(session):
+    session.info.pop("changed_tables", None)
@@ -1,10 +1,195 @@
+import functools
 from typing import Union, List, Tuple
 
 from pydantic import BaseModel
-from sqlalchemy import or_
+from sqlalchemy import or_, and_, func
 from sqlalchemy.orm import Session
 
-from lsshu.internal.db import Model
+from lsshu.internal.cache import TTLCache, table_version, mark_table_changed, RESULT_CACHE, IDENTITY_CACHE, CACHE_CHANNEL, dump_rows, load_rows, dumps
+from lsshu.internal.advisor import INDEX_ADVISOR
+from lsshu.internal.db import Model, replica_read, use_primary
+from lsshu.internal.executor import ThreadedDescriptor
+from lsshu.internal.search import SEARCH_OPERATORS, search_filter
+
+try:
+    from config import DB_COUNT_CACHE_TTL
+except ImportError:
+    DB_COUNT_CACHE_TTL = 0
+
+try:
+    from config import DB_IDENTITY_CACHE_TTL
+except ImportError:
+    DB_IDENTITY_CACHE_TTL = 0
+
+# 分页总条数缓存 键带表版本号 写入提交后自动失效
+COUNT_CACHE = TTLCache(maxsize=4096, ttl=DB_COUNT_CACHE_TTL)
+
+
+def _filter_or(column, value):
+    if type(column) is tuple:
+        """(['name','content'], 'or', '西')"""
+        return or_(*[(col == value) for col in column])
+    if type(value) in [list, tuple]:
+        """('name', 'or', ['西', '西']) 等价于 IN, 不同个数的值共用同一条 SQL"""
+        return column.in_(value)
+
+
+def _filter_or_like(method):
+    def builder(column, value):
+        if type(column) is tuple:
+            """(['name','content'], 'or_like', '西')"""
+            return or_(*[getattr(col, method)("%" + value + "%") for col in column])
+        if type(value) in [list, tuple]:
+            """('name', 'or_like', ['西', '西'])"""
+            return or_(*[getattr(column, method)("%" + val + "%") for val in value])
+
+    return builder
+
+
+def _filter_between(fmt_start: str = None, fmt_end: str = None):
+    def builder(column, value):
+        if type(value) in [list, tuple] and len(value) == 2:
+            start, end = value
+            return column.between(fmt_start % start if fmt_start else start, fmt_end % end if fmt_end else end)
+
+    return builder
+
+
+def _filter_list(method):
+    def builder(column, value):
+        if type(value) in [list, tuple]:
+            return getattr(column, method)(value)
+
+    return builder
+
+
+# 操作符 => 条件构造 (column, value)
+FILTER_OPERATORS: dict = {
+    **dict.fromkeys(["==", "=", "eq"], lambda column, value: column == value),
+    **dict.fromkeys(["!=", "<>", "><", "neq", "ne"], lambda column, value: column != value),
+    **dict.fromkeys([">", "gt"], lambda column, value: column > value),
+    **dict.fromkeys([">=", "ge"], lambda column, value: column >= value),
+    **dict.fromkeys(["<", "lt"], lambda column, value: column < value),
+    **dict.fromkeys(["<=", "le"], lambda column, value: column <= value),
+    "like": lambda column, value: column.like("%" + value + "%") if value is not None else None,
+    "ilike": lambda column, value: column.ilike("%" + value + "%") if value is not None else None,
+    "or": _filter_or,
+    "or_like": _filter_or_like("like"),
+    "or_ilike": _filter_or_like("ilike"),
+    "between": _filter_between(),
+    "datebetween": _filter_between(),
+    "datetimebetween": _filter_between("%s 00:00:00", "%s 23:59:59"),
+    "in": _filter_list("in_"),
+    "notin": _filter_list("notin_"),
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def filter_builder(model, key: Union[str, tuple], operator: str):
+    """
+    按 (模型, 字段, 操作符) 缓存 已解析的字段 和 条件构造, 同形状的查询只在绑定参数上不同
+    :param model:
+    :param key: 字段 或 多字段元组
+    :param operator:
+    :return: callable(value)
+    """
+    column = tuple(getattr(model, k) for k in key) if type(key) is tuple else getattr(model, key)
+    builder = FILTER_OPERATORS.get(operator, None)
+    if builder is None:
+        """('content', 'startswith', '西') 字段自带的方法"""
+        return getattr(column, operator)
+    return functools.partial(builder, column)
+
+
+@functools.lru_cache(maxsize=1024)
+def order_builder(model, key: str, direction: str):
+    """
+    按 (模型, 字段, 方向) 缓存 排序表达式
+    :param model:
+    :param key:
+    :param direction: asc desc
+    :return:
+    """
+    return getattr(getattr(model, key), direction)()
+
+
+@functools.lru_cache(maxsize=256)
+def large_columns(model) -> tuple:
+    """
+    模型的大字段 Text/LargeBinary/JSON
+    :param model:
+    :return: (字段名)
+    """
+    from sqlalchemy import Text, LargeBinary, JSON
+    return tuple(key for key, attr in model.__mapper__.column_attrs.items() if isinstance(attr.columns[0].type, (Text, LargeBinary, JSON)))
+
+
+def window_function_supported(db) -> bool:
+    """
+    数据库是否支持 COUNT(*) OVER() 窗口函数
+    :param db: Session / AsyncSession
+    :return:
+    """
+    dialect = getattr(db, "sync_session", db).get_bind().dialect
+    if dialect.name == "sqlite":
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 25)
+    if dialect.name == "mysql":
+        version = dialect.server_version_info or ()
+        return version >= ((10, 2) if getattr(dialect, "is_mariadb", False) else (8, 0))
+    return dialect.name in ["postgresql", "mssql", "oracle"]
+
+
+def upsert_dialect(db) -> Union[str, None]:
+    """
+    数据库原生 upsert 方言 sqlite(>=3.24)/postgresql: ON CONFLICT, mysql: ON DUPLICATE KEY; 不支持返回 None
+    :param db: Session / AsyncSession
+    :return:
+    """
+    dialect = getattr(db, "sync_session", db).get_bind().dialect
+    if dialect.name == "sqlite":
+        import sqlite3
+        return "sqlite" if sqlite3.sqlite_version_info >= (3, 24) else None
+    return dialect.name if dialect.name in ["postgresql", "mysql"] else None
+
+
+def estimate_table_rows(db, table: str) -> Union[int, None]:
+    """
+    根据表统计信息估算行数 (sqlite_stat1 / information_schema / pg_class) 无统计信息返回 None
+    :param db: Session
+    :param table:
+    :return:
+    """
+    from sqlalchemy import text
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        if not db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")).scalar():
+            return None
+        stat = db.execute(text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table ORDER BY idx IS NOT NULL LIMIT 1"), {"table": table}).scalar()
+        return int(stat.split()[0]) if stat else None
+    if dialect == "mysql":
+        rows = db.execute(text("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"), {"table": table}).scalar()
+        return int(rows) if rows is not None else None
+    if dialect == "postgresql":
+        rows = db.execute(text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(quote_ident(:table))"), {"table": table}).scalar()
+        return int(rows) if rows is not None and rows >= 0 else None
+    return None
+
+
+class hybridmethod(object):
+    """
+    类调用时 每次生成独立的查询实例; 实例调用时 绑定到该实例
+    CRUD.first(db=db, pk=1) 与 CRUD.query(db).where(...).first() 互不共享查询状态
+    """
+
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            instance = owner()
+        return self.func.__get__(instance, owner)
 
 
 class BaseCRUD(object):
@@ -14,9 +199,19 @@ class BaseCRUD(object):
     params_query = None  # 查询实例
     params_relation: dict = {}  # 关联表 用于join等
     params_relationship: dict = {}  # 多对多时使用
+    params_count_cache_ttl: Union[int, None] = None  # 分页总条数缓存秒数 None 使用 DB_COUNT_CACHE_TTL 0 不缓存
+    params_estimate_total: bool = False  # 无筛选时 分页总条数是否使用表统计信息估算
+    params_result_cache_ttl: Union[int, None] = None  # all/first/count/paginate 结果缓存秒数(Redis) None 不缓存, 需开启 DB_RESULT_CACHE
+    params_identity_cache_ttl: Union[int, None] = None  # first 按主键查询 进程内缓存秒数 None 使用 DB_IDENTITY_CACHE_TTL 0 不缓存
+    params_batch_size: int = 1000  # 批量写入 每批条数
+    params_defer: Union[List[str], None] = None  # all/paginate 默认延迟加载的字段 None 不延迟; defer=True 且未设置时为大字段 Text/LargeBinary/JSON
+    params_defer_raiseload: bool = False  # 访问延迟加载的字段时 抛出异常 而不是懒加载
+    params_fields_depends: dict = {}  # fields 中非字段属性 依赖的字段 {"preview_path": ["path"]}
+    params_load: dict = {}  # 关联加载方式 {"roles": "selectin", "roles.permissions": "joined"} selectin/joined/subquery/raise/lazy/no
+    threaded = ThreadedDescriptor()  # await CRUD.threaded.first(db=db, pk=1) 在数据库线程池中执行 不阻塞事件循环
     params_action_method: list = [
-        "start", "pseudo_deletion", "query", "where", "join", "order",
-        "page", "offset", "limit", "end"
+        "start", "pseudo_deletion", "query", "fields", "load", "advise", "where", "join", "order",
+        "cursor", "page", "offset", "limit", "end"
         # "page", "offset", "limit", "clear_params", "end"
     ]
     params: dict = {
@@ -24,8 +219,26 @@ class BaseCRUD(object):
         "order": [],  # 排序
     }
 
-    @classmethod
-    def init(cls, model, db=None, pk="id"):
+    def __init__(self, db: Session = None):
+        """
+        每个实例持有自己的查询参数
+        :param db:
+        """
+        self.params = {"where": [], "order": []}
+        if db is not None:
+            self.params_db = db
+
+    @hybridmethod
+    def query(self, db: Session = None):
+        """
+        获取独立的查询构造器 CRUD.query(db).where(...).order(...).all()
+        :param db:
+        :return:
+        """
+        return self.db(db) if db is not None else self
+
+    @hybridmethod
+    def init(self, model, db=None, pk="id"):
         """
         初始化
         :param model:
@@ -33,111 +246,507 @@ class BaseCRUD(object):
         :param pk:
         :return:
         """
-        cls.params_model = model
-        cls.params_db = db
-        cls.params_pk = pk
-        return cls
+        self.params_model = model
+        self.params_db = db
+        self.params_pk = pk
+        return self
 
-    @classmethod
-    def action_clear_params(cls, name: Union[str, list, tuple, None] = None):
+    @hybridmethod
+    def action_clear_params(self, name: Union[str, list, tuple, None] = None):
         """
         清除参数条件
         :param name:
         :return:
         """
         if name and type(name) == str:
-            if name in cls.params:
-                del cls.params[name]
+            if name in self.params:
+                del self.params[name]
         elif name and (type(name) == list or type(name) == tuple):
             for n in name:
-                if n in cls.params:
-                    del cls.params[n]
+                if n in self.params:
+                    del self.params[n]
         else:
-            cls.params.clear()
-        return cls
+            self.params.clear()
+        return self
 
-    @classmethod
-    def db(cls, db):
+    @hybridmethod
+    def db(self, db):
         """
         设定 db
         :param db:
         :return:
         """
-        cls.params_db = db
-        cls.action_clear_params()
-        return cls
+        self.params_db = db
+        self.action_clear_params()
+        return self
 
-    @classmethod
-    def pseudo_deletion(cls, pseudo: bool):
+    @hybridmethod
+    def pseudo_deletion(self, pseudo: bool):
         """
         设定是否 伪删除
         :param pseudo:
         :return:
         """
-        cls._params_pseudo = pseudo
-        return cls
+        self._params_pseudo = pseudo
+        return self
 
-    @classmethod
-    def choose_pseudo_deletion(cls, choose: bool):
+    @hybridmethod
+    def choose_pseudo_deletion(self, choose: bool):
         """
         设定是否 伪删除操作 临时
         :param choose:
         :return:
         """
-        cls._params_choose_pseudo = choose
-        return cls
+        self._params_choose_pseudo = choose
+        return self
 
-    @classmethod
-    def all(cls, **kwargs):
+    @hybridmethod
+    @replica_read
+    def all(self, **kwargs):
         """
         多数据
         :param kwargs:
         :return:
         """
-        query = cls.action_params(**kwargs).action().params_query
-        return query.all()
+        key = self.action_list_params(**kwargs).action_result_key("all")
+        hit, data = self.action_result_get(key, "all")
+        if hit:
+            return data
+        query = self.action().params_query
+        return self.action_result_set(key, "all", query.all())
+
+    @hybridmethod
+    def iterate(self, batch_size: int = None, **kwargs):
+        """
+        逐条读取 不分页 服务端游标(stream_results) + yield_per 分批, 内存不随总条数增长; 不使用结果缓存
+        :param batch_size: 每批条数 默认 params_batch_size
+        :param kwargs:
+        :return: 生成器
+        """
+        self.action_list_params(**kwargs).action_clear_params(('page', 'offset', 'limit', 'cursor'))
+        query = self.action().params_query
+        yield from query.yield_per(batch_size or self.params_batch_size)
 
-    @classmethod
-    def count(cls, **kwargs) -> int:
+    @hybridmethod
+    def chunks(self, batch_size: int = None, **kwargs):
+        """
+        分批读取 不分页 每批一个列表 (iterate 的分批版本) 用于流式响应
+        :param batch_size: 每批条数 默认 params_batch_size
+        :param kwargs:
+        :return: 生成器 [模型]
+        """
+        batch_size = batch_size or self.params_batch_size
+        rows = []
+        for row in self.iterate(batch_size=batch_size, **kwargs):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    @hybridmethod
+    @replica_read
+    def count(self, **kwargs) -> int:
         """
         多数据
         :param kwargs:
         :return:
         """
-        data = cls.action_params(**kwargs).action().params_query.count()
-        return data
+        key = self.action_params(**kwargs).action_result_key("count")
+        hit, data = self.action_result_get(key, "count")
+        if hit:
+            return data
+        data = self.action().params_query.count()
+        return self.action_result_set(key, "count", data)
 
-    @classmethod
-    def first(cls, **kwargs):
+    @hybridmethod
+    @replica_read
+    def first(self, **kwargs):
         """
         单条数据
         :param kwargs:
         :return:
         """
-        data = cls.action_params(**kwargs).action().params_query.first()
-        return data
+        identity_key = self.action_params(**kwargs).action_identity_key()
+        hit, data = self.action_identity_get(identity_key)
+        if hit:
+            return data
+        key = self.action_result_key("first")
+        hit, data = self.action_result_get(key, "first")
+        if not hit:
+            data = self.action_result_set(key, "first", self.action().params_query.first())
+        return self.action_identity_set(identity_key, data)
 
-    @classmethod
-    def paginate(cls, **kwargs):
+    @hybridmethod
+    @replica_read
+    def paginate(self, **kwargs):
         """
         分页 操作
+        with_total=True 时 数据库支持窗口函数且无 joined 加载/join 一对多关联 则用 COUNT(*) OVER() 一条语句取得数据和总条数
+        with_total=False 时 不统计总条数 多取一条判断 has_more
+        cursor 不为 None 时 按 order + 主键 游标分页 ('' 为第一页), 返回 next_cursor
+        fields 只加载指定字段, 未指定时 延迟加载 params_defer 中的字段
+        总条数按 params_count_cache_ttl 缓存; estimate_total=True 且无筛选时 使用表统计信息估算
+        params_result_cache_ttl/cache 开启时 整个分页结果缓存到 Redis
+        :param kwargs:
+        :return:
+        """
+        key = self.action_list_params(**kwargs).action_result_key("paginate")
+        hit, data = self.action_result_get(key, "paginate")
+        if hit:
+            return data
+        return self.action_result_set(key, "paginate", self.action_paginate(**kwargs))
+
+    @hybridmethod
+    def action_paginate(self, **kwargs):
+        """
+        分页 查询 参数已处理到 params
         :param kwargs:
         :return:
         """
         import math
-        items = cls.action_params(**kwargs).action().params_query.all()
-        limit = cls.params.get('limit', 0)
-        total = cls.action_params(**kwargs).action_clear_params(('limit', 'page', 'offset')).action().params_query.count()
-        pages = math.ceil(total / limit) if type(total) is int and type(limit) is int and limit != 0 else 1
+        total, total_exact, total_key = self.action_total()
+        window = self.action_total_window()
+        query = self.action().params_query
+        limit, offset = self.params.get('limit', 0), self.action_paginate_offset()
+        with_total, keyset = self.params.get('with_total', True), self.params.get('cursor', None) is not None
+        if keyset or not with_total:
+            items = query.limit(limit + 1).all() if limit else query.all()
+            result = self.action_paginate_result(items=items, total=None, limit=limit, offset=offset)
+            if with_total:
+                if total is None:
+                    total = self.action_params(**kwargs).action_clear_params(('limit', 'page', 'offset', 'cursor')).action().params_query.count()
+                    self.action_cache_total(total_key, total)
+                result.update({"total": total, "pages": math.ceil(total / limit) if limit else 1, "total_exact": total_exact})
+            return result
+        if total is not None:
+            items = query.all()
+        elif window and window_function_supported(self.params_db):
+            rows = query.add_columns(func.count().over().label("paginate_total")).all()
+            items = [row[0] for row in rows]
+            total = rows[0][-1] if rows else (0 if not offset else None)
+            self.action_cache_total(total_key, total)
+        else:
+            items = query.all()
+        if total is None:
+            total = self.action_params(**kwargs).action_clear_params(('limit', 'page', 'offset')).action().params_query.count()
+            self.action_cache_total(total_key, total)
+        return dict(self.action_paginate_result(items=items, total=total, limit=limit, offset=offset), total_exact=total_exact)
+
+    @hybridmethod
+    def cache(self, cache: Union[int, bool, None]):
+        """
+        本次查询结果缓存秒数 True 使用 DB_RESULT_CACHE_TTL, False/0 不缓存
+        :param cache:
+        :return:
+        """
+        self.params.update({"cache": cache})
+        return self
+
+    @hybridmethod
+    def action_result_ttl(self) -> Union[int, bool]:
+        """
+        本次查询结果缓存秒数 True 为 DB_RESULT_CACHE_TTL, 0 不缓存
+        :return:
+        """
+        ttl = self.params.get('cache', None)
+        ttl = self.params_result_cache_ttl if ttl is None else ttl
+        return ttl if RESULT_CACHE.enabled and ttl else 0
+
+    @hybridmethod
+    def action_result_tree(self) -> dict:
+        """
+        随结果缓存的关联树 params_load 中预加载的关联
+        :return: {"roles": {"permissions": {}}}
+        """
+        tree = {}
+        for path, strategy in self.action_load_map().items():
+            if strategy.replace("load", "") in ["raise", "lazy", "no"]:
+                continue
+            node = tree
+            for name in path.split("."):
+                node = node.setdefault(name, {})
+        return tree
+
+    @hybridmethod
+    def action_result_tables(self) -> list:
+        """
+        结果依赖的表 模型 + join + 随结果缓存的关联(含中间表)
+        :return:
+        """
+        tables = {self.params_model.__tablename__}
+        tables.update(self.params_relation[j[0]].__tablename__ for j in (self.params.get('join', None) or []) if j and j[0] in self.params_relation)
+
+        def relation_tables(model, tree):
+            for name, sub in tree.items():
+                prop = model.__mapper__.relationships[name]
+                tables.update([prop.mapper.local_table.name] + ([prop.secondary.name] if prop.secondary is not None else []))
+                relation_tables(prop.mapper.class_, sub)
+
+        relation_tables(self.params_model, self.action_result_tree())
+        return sorted(tables)
+
+    @hybridmethod
+    def action_result_key(self, method: str) -> Union[str, None]:
+        """
+        结果缓存键 CRUD类 + 方法 + 参数 + 相关表版本号, 需在 action() 之前调用
+        :param method: all first count paginate
+        :return: None 为不缓存
+        """
+        import hashlib
+        import json
+        if not self.action_result_ttl():
+            return None
+        tables = self.action_result_tables()
+        try:
+            versions = RESULT_CACHE.versions(*tables)
+        except Exception:
+            return None
+        params = json.dumps({key: value for key, value in self.params.items() if key != "cache"}, sort_keys=True, default=str)
+        digest = hashlib.sha1(("%s.%s|%s|%s|%s" % (type(self).__module__, type(self).__qualname__, method, params, versions)).encode()).hexdigest()
+        return "crud-%s-%s-%s" % (self.params_model.__tablename__, method, digest)
+
+    @hybridmethod
+    def action_result_get(self, key: Union[str, None], method: str):
+        """
+        读取结果缓存 还原为会话中的模型实例
+        :param key:
+        :param method:
+        :return: (是否命中, 结果)
+        """
+        import json
+        if not key:
+            return False, None
+        value = RESULT_CACHE.get(key, table=self.params_model.__tablename__)
+        if value is None:
+            return False, None
+        data, tree = json.loads(value), self.action_result_tree()
+        if method == "count":
+            return True, data
+        if method == "paginate":
+            return True, dict(data, items=load_rows(self.params_db, self.params_model, data["items"], tree))
+        rows = load_rows(self.params_db, self.params_model, data, tree)
+        return True, (rows if method == "all" else (rows[0] if rows else None))
+
+    @hybridmethod
+    def action_identity_ttl(self) -> int:
+        """
+        主键查询 进程内缓存秒数
+        :return: 0 不缓存
+        """
+        ttl = self.params.get('cache', None)
+        if ttl is False or ttl == 0:
+            return 0
+        ttl = self.params_identity_cache_ttl if self.params_identity_cache_ttl is not None else DB_IDENTITY_CACHE_TTL
+        return ttl or 0
+
+    @hybridmethod
+    def action_identity_key(self) -> Union[tuple, None]:
+        """
+        主键查询缓存键 仅 where 只有主键等于 且无 join 时, 键带相关表的进程内版本号, 需在 action() 之前调用
+        :return: None 为不缓存
+        """
+        where = self.params.get('where', None) or []
+        if not self.action_identity_ttl() or len(where) != 1 or self.params.get('join', None):
+            return None
+        where = tuple(where[0])
+        if not (len(where) == 2 and where[0] == self.params_pk or len(where) == 3 and where[0] == self.params_pk and where[1] == "=="):
+            return None
+        if CACHE_CHANNEL is not None:
+            CACHE_CHANNEL.start()
+        tables = self.action_result_tables()
+        session = getattr(self.params_db, "sync_session", self.params_db)
+        if set(tables) & getattr(session, "info", {}).get("changed_tables", set()):  # 本会话有未提交的写入
+            return None
+        params = dumps({key: value for key, value in self.params.items() if key not in ("where", "cache")})
+        pseudo = (getattr(self, "_params_pseudo", None), getattr(self, "_params_choose_pseudo", None))
+        return type(self), str(where[-1]), params, pseudo, tuple(tables), table_version(*tables)
+
+    @hybridmethod
+    def action_identity_get(self, key: Union[tuple, None]):
+        """
+        读取主键查询缓存 还原为会话中的模型实例
+        :param key:
+        :return: (是否命中, 结果)
+        """
+        import json
+        if not key:
+            return False, None
+        value = IDENTITY_CACHE.get(key)
+        if value is None:
+            return False, None
+        rows = load_rows(self.params_db, self.params_model, json.loads(value), self.action_result_tree())
+        return True, (rows[0] if rows else None)
+
+    @hybridmethod
+    def action_identity_set(self, key: Union[tuple, None], data):
+        """
+        写入主键查询缓存 未找到也缓存
+        :param key:
+        :param data:
+        :return: data
+        """
+        if not key:
+            return data
+        try:
+            value = dumps(dump_rows(self.params_model, [data] if data is not None else [], self.action_result_tree()))
+            IDENTITY_CACHE.set(key, value, ttl=self.action_identity_ttl())
+        except (TypeError, ValueError):
+            pass
+        return data
+
+    @hybridmethod
+    def action_result_set(self, key: Union[str, None], method: str, data):
+        """
+        写入结果缓存 模型实例按字段值紧凑存储 不 pickle
+        :param key:
+        :param method:
+        :param data:
+        :return: data
+        """
+        if not key:
+            return data
+        ttl, tree = self.action_result_ttl(), self.action_result_tree()
+        try:
+            if method == "count":
+                value = data
+            elif method == "paginate":
+                value = dict(data, items=dump_rows(self.params_model, data["items"], tree))
+            else:
+                value = dump_rows(self.params_model, data if method == "all" else ([data] if data is not None else []), tree)
+            RESULT_CACHE.set(key, dumps(value), ttl=None if ttl is True else ttl)
+        except (TypeError, ValueError):
+            pass
+        return data
+
+    @hybridmethod
+    def estimate_total(self, estimate: bool):
+        """
+        无筛选时 分页总条数是否使用表统计信息估算
+        :param estimate:
+        :return:
+        """
+        self.params.update({"estimate_total": estimate})
+        return self
+
+    @hybridmethod
+    def action_total_estimable(self) -> bool:
+        """
+        是否可以估算总条数 需在 action() 之前调用
+        :return:
+        """
+        return bool(self.params.get('with_total', True) and self.params.get('estimate_total', self.params_estimate_total)
+                    and not self.params.get('where', None) and not self.params.get('join', None))
+
+    @hybridmethod
+    def action_total_window(self) -> bool:
+        """
+        是否可以用 COUNT(*) OVER() 取总条数 需在 action() 之前调用
+        joined 预加载 或 join 一对多/多对多 关联时 窗口函数统计的是关联后的行数 需单独 count()
+        :return:
+        """
+        mapper = self.params_model.__mapper__
+        load = self.action_load_map()
+        for path, strategy in load.items():
+            if strategy.replace("load", "") != "joined":
+                continue
+            model = self.params_model
+            for name in path.split("."):
+                prop = getattr(model, name).property
+                if prop.uselist:
+                    return False
+                model = prop.mapper.class_
+        if any(prop.lazy == "joined" and prop.uselist and key not in load for key, prop in mapper.relationships.items()):
+            return False
+        for j in self.params.get('join', None) or []:
+            join_model = self.params_relation.get(j[0], None) if j else None
+            if join_model:
+                props = [prop for prop in mapper.relationships if prop.mapper.class_ is join_model]
+                if not props or any(prop.uselist for prop in props):
+                    return False
+        return True
+
+    @hybridmethod
+    def action_total_key(self):
+        """
+        总条数缓存键 模型 + 筛选条件 + 相关表版本号, 需在 action() 之前调用
+        :return: None 为不缓存
+        """
+        ttl = self.params_count_cache_ttl if self.params_count_cache_ttl is not None else DB_COUNT_CACHE_TTL
+        if not ttl or not self.params.get('with_total', True):
+            return None
+        where, join = self.params.get('where', None) or [], self.params.get('join', None) or []
+        tables = [self.params_model.__tablename__] + [self.params_relation[j[0]].__tablename__ for j in join if j and j[0] in self.params_relation]
+        return self.params_model.__tablename__, repr(where), repr(join), table_version(*tables)
+
+    @hybridmethod
+    def action_total(self):
+        """
+        从估算或缓存获取总条数 需在 action() 之前调用
+        :return: (total, total_exact, total_key)
+        """
+        if self.action_total_estimable():
+            total = estimate_table_rows(self.params_db, self.params_model.__tablename__)
+            if total is not None:
+                return total, False, None
+        key = self.action_total_key()
+        return (COUNT_CACHE.get(key) if key else None), True, key
+
+    @hybridmethod
+    def action_cache_total(self, key, total: Union[int, None]):
+        """
+        缓存总条数
+        :param key:
+        :param total:
+        :return:
+        """
+        if key and total is not None:
+            COUNT_CACHE.set(key, total, ttl=self.params_count_cache_ttl)
+        return total
+
+    @hybridmethod
+    def action_paginate_offset(self) -> int:
+        """
+        当前分页的偏移量
+        :return:
+        """
+        page = self.params.get('page', None)
+        limit = self.params.get('limit', None)
+        if bool(page) and type(page) is int and bool(limit):
+            return (page - 1) * limit
+        return self.params.get('offset', None) or 0
+
+    @hybridmethod
+    def action_paginate_result(self, items: list, total: Union[int, None], limit: int, offset: int):
+        """
+        分页返回
+        :param items:
+        :param total: None 为未统计总条数 此时 items 多取了一条
+        :param limit:
+        :param offset:
+        :return:
+        """
+        import math
+        if total is None:
+            has_more = bool(limit) and len(items) > limit
+            items = items[:limit] if limit else items
+            pages = None
+        else:
+            has_more = offset + len(items) < total
+            pages = math.ceil(total / limit) if type(total) is int and type(limit) is int and limit != 0 else 1
+        keyset = self.params.get('cursor', None) is not None
         return {
             "items": items,  # 当前页的数据列表
             "pages": pages,  # 总页数
             "total": total,  # 总条数
             "limit": limit,  # 页条数
+            "has_more": has_more,  # 是否还有下一页
+            "next_cursor": self.action_cursor_encode(items[-1]) if keyset and has_more and items else None,  # 下一页游标
         }
 
-    @classmethod
-    def store(cls, db: Session, item: BaseModel, **kwargs):
+    @hybridmethod
+    def store(self, db: Session, item: BaseModel, **kwargs):
         """
         创建模型数据
         :param db:
@@ -145,422 +754,1004 @@ class BaseCRUD(object):
         :param kwargs:
         :return:
         """
-        cls.action_params(db=db, **kwargs)
+        self.action_params(db=db, **kwargs)
         # 处理关联
         import copy
         _item = copy.deepcopy(item)
-        if type(cls.params_relationship) is dict:
-            for relation in cls.params_relationship:
+        if type(self.params_relationship) is dict:
+            for relation in self.params_relationship:
                 if hasattr(item, relation) and bool(getattr(item, relation)):
                     delattr(item, relation)
         # 创建实例
-        db_item = cls.params_model(**kwargs, **item.dict(exclude_unset=True))
+        db_item = self.params_model(**kwargs, **item.dict(exclude_unset=True))
         # 添加关联
-        if type(cls.params_relationship) is dict:
-            for (relation, relation_class) in cls.params_relationship.items():
+        if type(self.params_relationship) is dict:
+            for (relation, relation_class) in self.params_relationship.items():
                 if hasattr(_item, relation) and bool(getattr(_item, relation)):
                     _relation = BaseCRUD.all(model=relation_class, db=db, where=(
                         "id", 'in_', getattr(_item, relation)))
                     setattr(db_item, relation, _relation)
 
-        cls.params_db.add(db_item)
-        cls.params_db.commit()
-        cls.params_db.refresh(db_item)
+        self.params_db.add(db_item)
+        self.params_db.commit()
+        self.params_db.refresh(db_item)
         return db_item
 
-    @classmethod
-    def update(cls, **kwargs):
+    @hybridmethod
+    def store_many(self, db: Session, items: List[BaseModel], batch_size: int = None, return_ids: bool = False, **kwargs):
+        """
+        批量创建模型数据 一个事务
+        无关联且不需要返回 id 时 按 batch_size 分批 executemany INSERT;
+        否则分批 add_all + flush, 关联 id 每个关联只用一次 IN 查询, 关联表由 flush 批量写入
+        树模型(sqlalchemy_mptt)需要逐条计算 lft/rgt 只能走 flush
+        :param db:
+        :param items:
+        :param batch_size:
+        :param return_ids: 返回新建的主键列表
+        :param kwargs: 每条数据共同的字段值
+        :return: 主键列表 或 创建条数
+        """
+        self.action_params(db=db)
+        batch_size = batch_size or self.params_batch_size
+        rows, relations = self.action_store_many_rows(items, **kwargs)
+        relation_objects = {}
+        for relation, relation_ids in relations.items():
+            ids = {pk for pks in relation_ids for pk in pks}
+            relation_class = self.params_relationship[relation]
+            relation_objects[relation] = {getattr(obj, "id"): obj for obj in BaseCRUD.all(db=db, model=relation_class, where=("id", 'in_', list(ids)))} if ids else {}
+        try:
+            ids = []
+            if return_ids or relations or self.action_nested_sets():
+                for start in range(0, len(rows), batch_size):
+                    db_items = [self.params_model(**row) for row in rows[start:start + batch_size]]
+                    for relation, relation_ids in relations.items():
+                        for db_item, pks in zip(db_items, relation_ids[start:start + batch_size]):
+                            if pks:
+                                setattr(db_item, relation, [relation_objects[relation][pk] for pk in pks if pk in relation_objects[relation]])
+                    self.params_db.add_all(db_items)
+                    self.params_db.flush()
+                    ids.extend(getattr(db_item, self.params_pk) for db_item in db_items)
+            else:
+                from sqlalchemy import insert
+                for group in self.action_store_many_groups(rows):
+                    for start in range(0, len(group), batch_size):
+                        self.params_db.execute(insert(self.params_model), group[start:start + batch_size])
+            self.params_db.commit()
+        except Exception:
+            self.params_db.rollback()
+            raise
+        return ids if return_ids else len(rows)
+
+    @hybridmethod
+    def action_store_many_rows(self, items: List[BaseModel], **kwargs):
+        """
+        批量创建数据 拆分为 字段值 和 关联 id
+        :param items:
+        :param kwargs:
+        :return: ([row], {relation: [[id]]})
+        """
+        rows, relations = [], {}
+        relationship = self.params_relationship if type(self.params_relationship) is dict else {}
+        for index, item in enumerate(items):
+            row = {**kwargs, **item.dict(exclude_unset=True)}
+            for relation in relationship:
+                pks = row.pop(relation, None)
+                if pks:
+                    relations.setdefault(relation, [[] for _ in items])[index] = list(pks)
+            rows.append(row)
+        return rows, relations
+
+    @hybridmethod
+    def action_store_many_groups(self, rows: List[dict]) -> List[List[dict]]:
+        """
+        按字段集合分组 executemany 要求每条数据字段一致, 未设置的字段由字段默认值填充
+        :param rows:
+        :return:
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        return list(groups.values())
+
+    @hybridmethod
+    def action_nested_sets(self) -> bool:
+        """
+        是否树模型
+        :return:
+        """
+        from sqlalchemy_mptt.mixins import BaseNestedSets
+        return issubclass(self.params_model, BaseNestedSets)
+
+    @hybridmethod
+    def update(self, **kwargs):
         """
         更新模型数据
         :param kwargs:
         :return:
         """
-        item = cls._update_relationship(**kwargs)
+        item = self._update_relationship(**kwargs)
         exclude_unset = kwargs.get('exclude_unset', False)
-        cls.action_params(**kwargs).action().params_query.update(
-            item.dict(exclude_unset=exclude_unset)), cls.params_db.commit(), cls.params_db.close()
-        return cls.first(**kwargs)
+        self.action_params(**kwargs).action().params_query.update(
+            item.dict(exclude_unset=exclude_unset)), self.params_db.commit(), self.params_db.close()
+        return self.first(**kwargs)
+
+    @hybridmethod
+    def update_many(self, db: Session, items: List[Tuple[int, BaseModel]], exclude_unset: bool = True, batch_size: int = None):
+        """
+        按主键批量更新 每条数据的值可以不同, 一个事务
+        相同字段集合的数据 一条 UPDATE ... WHERE id = :pk executemany;
+        多对多关联字段 按关联表批量增删 (不加载关联对象)
+        不触发 ORM 事件: 树模型的 parent_id 请使用 move_inside/move_after
+        :param db:
+        :param items: [(pk, item)]
+        :param exclude_unset:
+        :param batch_size:
+        :return: 处理条数
+        """
+        self.action_params(db=db)
+        relationship = self.params_relationship if type(self.params_relationship) is dict else {}
+        rows, relations = [], {}
+        for pk, item in items:
+            values = item.dict(exclude_unset=exclude_unset)
+            for relation in relationship:
+                if relation in values:
+                    pks = values.pop(relation)
+                    relations.setdefault(relation, {})[pk] = list(pks or [])
+            rows.append((pk, values))
+        try:
+            self.action_update_rows(rows, batch_size=batch_size)
+            for relation, mapping in relations.items():
+                self.action_sync_relationship(relation, mapping)
+            mark_table_changed(self.params_db, self.params_model.__tablename__)
+            self.params_db.commit()
+        except Exception:
+            self.params_db.rollback()
+            raise
+        return len(items)
+
+    @hybridmethod
+    def action_update_rows(self, rows: List[Tuple[int, dict]], batch_size: int = None):
+        """
+        按主键批量更新 相同字段集合一条 UPDATE ... WHERE id = :pk executemany; 不提交
+        :param rows: [(pk, {字段: 值})]
+        :param batch_size:
+        :return:
+        """
+        from sqlalchemy import update, bindparam
+        batch_size = batch_size or self.params_batch_size
+        mapper = self.params_model.__mapper__
+        pk_column = mapper.column_attrs[self.params_pk].columns[0]
+        groups = {}
+        for pk, values in rows:
+            if values:
+                groups.setdefault(tuple(sorted(values)), []).append({"b_pk": pk, **{"b_%s" % key: value for key, value in values.items()}})
+        for keys, group in groups.items():
+            statement = update(self.params_model.__table__).where(pk_column == bindparam("b_pk")).values(
+                {mapper.column_attrs[key].columns[0]: bindparam("b_%s" % key) for key in keys})
+            for start in range(0, len(group), batch_size):
+                self.params_db.execute(statement, group[start:start + batch_size])
+        return self
+
+    @hybridmethod
+    def upsert_many(self, db: Session, items: List[BaseModel], keys: Union[str, List[str], Tuple[str]], update: bool = True, batch_size: int = None, **kwargs) -> dict:
+        """
+        批量 插入或更新 按唯一键 keys 判断冲突, 一个事务
+        sqlite/postgresql: INSERT ... ON CONFLICT DO UPDATE/NOTHING, mysql: INSERT ... ON DUPLICATE KEY UPDATE, 每批一条 executemany;
+        keys 不是唯一键/数据库不支持/树模型子节点(需要计算 lft/rgt) 时: 一次 IN 查询 + 批量 UPDATE + flush 创建
+        已存在的树节点不会移动 请使用 move_inside/move_after
+        :param db:
+        :param items:
+        :param keys: 唯一键 如 "username" / ("name", "parent_id")
+        :param update: False 已存在时不更新 (find_or_store)
+        :param batch_size:
+        :param kwargs: 每条数据共同的字段值
+        :return: {唯一键值: 主键}
+        """
+        self.action_params(db=db)
+        batch_size = batch_size or self.params_batch_size
+        keys = (keys,) if type(keys) is str else tuple(keys)
+        rows, relations = self.action_store_many_rows(items, **kwargs)
+        dialect = self.action_upsert_dialect(keys)
+        nested = self.action_nested_sets()
+        required = self.action_upsert_required()
+        native, fallback = [], []
+        for index, row in enumerate(rows):
+            # 数据库先检查 NOT NULL 再判断冲突, 缺少必填字段的只能先查再更新
+            related = any(relation_ids[index] for relation_ids in relations.values())
+            if dialect and required.issubset(row) and not (nested and row.get("parent_id") is not None) and (update or not related):
+                native.append(index)
+            else:
+                fallback.append(index)
+        try:
+            ids = self.action_upsert_ids(keys, [rows[index] for index in fallback], batch_size=batch_size)
+            created = [index for index in fallback if self.action_upsert_key(keys, rows[index]) not in ids]
+            if update:
+                # 树节点 不在这里移动
+                protected = {"parent_id", "left", "right", "level", "tree_id"} if nested else set()
+                self.action_update_rows([(ids[self.action_upsert_key(keys, rows[index])], {key: value for key, value in rows[index].items() if key not in protected})
+                                         for index in fallback if index not in created], batch_size=batch_size)
+            for start in range(0, len(created), batch_size):
+                db_items = [self.params_model(**rows[index]) for index in created[start:start + batch_size]]
+                self.params_db.add_all(db_items)
+                self.params_db.flush()
+                ids.update({self.action_upsert_key(keys, rows[index]): getattr(db_item, self.params_pk) for index, db_item in zip(created[start:start + batch_size], db_items)})
+            if native:
+                self.action_upsert_native(dialect, keys, [rows[index] for index in native], update=update, batch_size=batch_size)
+                ids.update(self.action_upsert_ids(keys, [rows[index] for index in native], batch_size=batch_size))
+            for relation, relation_ids in relations.items():
+                self.action_sync_relationship(relation, {
+                    ids[self.action_upsert_key(keys, row)]: pks for index, (row, pks) in enumerate(zip(rows, relation_ids)) if pks and (update or index in created)})
+            mark_table_changed(self.params_db, self.params_model.__tablename__)
+            self.params_db.commit()
+        except Exception:
+            self.params_db.rollback()
+            raise
+        return ids
+
+    @hybridmethod
+    def action_upsert_dialect(self, keys: Tuple[str]) -> Union[str, None]:
+        """
+        能否原生 upsert: 数据库支持 且 keys 为主键/唯一约束/唯一索引
+        :param keys:
+        :return: 方言 或 None
+        """
+        from sqlalchemy import UniqueConstraint
+        table = self.params_model.__table__
+        mapper = self.params_model.__mapper__
+        if any(key not in mapper.column_attrs for key in keys):
+            return None
+        names = {mapper.column_attrs[key].columns[0].name for key in keys}
+        uniques = [{column.name for column in table.primary_key}]
+        uniques.extend({column.name for column in constraint.columns} for constraint in table.constraints if isinstance(constraint, UniqueConstraint))
+        uniques.extend({column.name for column in index.columns} for index in table.indexes if index.unique)
+        uniques.extend({column.name} for column in table.columns if column.unique)
+        return upsert_dialect(self.params_db) if names in uniques else None
 
-    @classmethod
-    def _update_relationship(cls, db: Session, item: BaseModel, **kwargs):
+    @hybridmethod
+    def action_upsert_required(self) -> set:
+        """
+        插入时必须提供的字段: NOT NULL 且没有默认值 (不含自增主键 树模型字段)
+        :return:
+        """
+        names = {"left", "right", "level", "tree_id"} if self.action_nested_sets() else set()
+        return {key for key, attr in self.params_model.__mapper__.column_attrs.items() if key not in names and not any(
+            column.nullable or column.default is not None or column.server_default is not None or column.autoincrement is True or (
+                column.primary_key and column.autoincrement == "auto") for column in attr.columns)}
+
+    @hybridmethod
+    def action_upsert_key(self, keys: Tuple[str], row: dict):
+        """
+        唯一键值 单个键返回值 多个键返回元组
+        :param keys:
+        :param row:
+        :return:
+        """
+        return row.get(keys[0]) if len(keys) == 1 else tuple(row.get(key) for key in keys)
+
+    @hybridmethod
+    def action_upsert_ids(self, keys: Tuple[str], rows: List[dict], batch_size: int = None) -> dict:
+        """
+        按唯一键查询已存在的主键
+        :param keys:
+        :param rows:
+        :param batch_size:
+        :return: {唯一键值: 主键}
+        """
+        from sqlalchemy import select, tuple_
+        batch_size = batch_size or self.params_batch_size
+        values = list({self.action_upsert_key(keys, row) for row in rows})
+        columns = [getattr(self.params_model, key) for key in keys]
+        column = columns[0] if len(columns) == 1 else tuple_(*columns)
+        ids = {}
+        for start in range(0, len(values), batch_size):
+            result = self.params_db.execute(select(getattr(self.params_model, self.params_pk), *columns).where(column.in_(values[start:start + batch_size])))
+            ids.update({(row[1] if len(keys) == 1 else tuple(row[1:])): row[0] for row in result})
+        return ids
+
+    @hybridmethod
+    def action_upsert_native(self, dialect: str, keys: Tuple[str], rows: List[dict], update: bool = True, batch_size: int = None):
+        """
+        原生 upsert 相同字段集合 每批一条 executemany; 不提交
+        树模型根节点 直接写入 lft=1 rgt=2, tree_id 顺序分配 (与 sqlalchemy_mptt 新建根节点一致)
+        :param dialect: sqlite/postgresql/mysql
+        :param keys:
+        :param rows:
+        :param update:
+        :param batch_size:
+        :return:
+        """
+        import importlib
+        from sqlalchemy import select
+        batch_size = batch_size or self.params_batch_size
+        mapper = self.params_model.__mapper__
+        table = self.params_model.__table__
+        insert = importlib.import_module("sqlalchemy.dialects.%s" % dialect).insert
+        protected = {mapper.column_attrs[key].columns[0].name for key in keys + (self.params_pk,)}
+        if self.action_nested_sets():
+            model = self.params_model
+            tree_id = self.params_db.execute(select(func.max(model.tree_id))).scalar() or 0
+            rows = [{**row, "left": 1, "right": 2, "level": model.get_default_level(), "tree_id": tree_id + index + 1} for index, row in enumerate(rows)]
+            protected.update(getattr(model, name).property.columns[0].name for name in ("left", "right", "level", "tree_id", "parent_id"))
+        rows = [{mapper.column_attrs[key].columns[0].name: value for key, value in row.items()} for row in rows]
+        for group in self.action_store_many_groups(rows):
+            statement = insert(table)
+            excluded = statement.inserted if dialect == "mysql" else statement.excluded
+            values = {name: excluded[name] for name in group[0] if name not in protected}
+            if update and values:
+                for column in table.columns:
+                    if column.onupdate is not None and column.name not in values and not column.onupdate.is_sequence:
+                        values[column.name] = column.onupdate.arg(None) if column.onupdate.is_callable else column.onupdate.arg
+            if dialect == "mysql":
+                pk_column = mapper.column_attrs[self.params_pk].columns[0]
+                statement = statement.on_duplicate_key_update(values if update and values else {pk_column.name: pk_column})
+            elif update and values:
+                statement = statement.on_conflict_do_update(index_elements=[mapper.column_attrs[key].columns[0] for key in keys], set_=values)
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=[mapper.column_attrs[key].columns[0] for key in keys])
+            for start in range(0, len(group), batch_size):
+                self.params_db.execute(statement, group[start:start + batch_size])
+        return self
+
+    @hybridmethod
+    def action_sync_relationship(self, relation: str, mapping: dict):
+        """
+        多对多关联 按差集同步到关联表: 一次查询现有关联, 一次批量 DELETE, 一次批量 INSERT; 不提交
+        :param relation: 关联名 如 permissions
+        :param mapping: {pk: [关联id]}
+        :return:
+        """
+        from sqlalchemy import select, bindparam
+        from sqlalchemy.orm.util import identity_key
+        if not mapping:
+            return self
+        prop = self.params_model.__mapper__.relationships[relation]
+        secondary = prop.secondary
+        owner, target = prop.synchronize_pairs[0][1], prop.secondary_synchronize_pairs[0][1]
+        target_pk = prop.secondary_synchronize_pairs[0][0]
+        ids = {pk for pks in mapping.values() for pk in pks}
+        valid = set(self.params_db.execute(select(target_pk).where(target_pk.in_(list(ids)))).scalars().all()) if ids else set()
+        existing = {}
+        for owner_id, target_id in self.params_db.execute(select(owner, target).where(owner.in_(list(mapping)))).all():
+            existing.setdefault(owner_id, set()).add(target_id)
+        inserts, removes = [], []
+        for pk, pks in mapping.items():
+            wanted, current = set(pks) & valid, existing.get(pk, set())
+            inserts.extend({owner.name: pk, target.name: _pk} for _pk in sorted(wanted - current))
+            removes.extend({"b_owner": pk, "b_target": _pk} for _pk in sorted(current - wanted))
+        if removes:
+            self.params_db.execute(secondary.delete().where(owner == bindparam("b_owner"), target == bindparam("b_target")), removes)
+        if inserts:
+            self.params_db.execute(secondary.insert(), inserts)
+        if removes or inserts:
+            mark_table_changed(self.params_db, secondary.name, self.params_model.__tablename__)
+        # 会话中已加载的集合 已过期
+        for pk in mapping:
+            obj = self.params_db.identity_map.get(identity_key(self.params_model, pk))
+            if obj is not None:
+                self.params_db.expire(obj, [relation])
+        return self
+
+    @hybridmethod
+    def _update_relationship(self, db: Session, item: BaseModel, **kwargs):
         """
         更新处理关联 多对多
+        只查询匹配数据的主键, 按差集批量增删关联表 不加载关联对象
         :param db:
         :param item:
         :return:
         """
-        if type(cls.params_relationship) is dict:
-            for (relation, relation_class) in cls.params_relationship.items():
-                _obj = cls.first(db=db, **kwargs)
-                if hasattr(item, relation) and bool(getattr(item, relation)):
-                    _relation = BaseCRUD.all(db=db, model=relation_class, where=(
-                        "id", 'in_', getattr(item, relation)))
-                    setattr(_obj, relation, _relation)
-                    db.add(_obj), db.commit(), db.close()
-                elif hasattr(item, relation) and relation in item.dict(exclude_unset=True):
-                    [getattr(_obj, relation).remove(rela) for rela in getattr(_obj, relation)]
-                delattr(item, relation)
+        if type(self.params_relationship) is dict:
+            values = item.dict(exclude_unset=True)
+            relations = {relation: list(getattr(item, relation) or []) for relation in self.params_relationship
+                         if hasattr(item, relation) and (bool(getattr(item, relation)) or relation in values)}
+            if relations:
+                query = type(self)().action_params(db=db, **kwargs).action().params_query
+                pks = [row[0] for row in query.with_entities(getattr(self.params_model, self.params_pk)).all()]
+                for relation, ids in relations.items():
+                    self.action_params(db=db).action_sync_relationship(relation, {pk: ids for pk in pks})
+            for relation in self.params_relationship:
+                if hasattr(item, relation):
+                    delattr(item, relation)
         return item
 
-    @classmethod
-    def delete(cls, **kwargs):
+    @hybridmethod
+    def delete(self, **kwargs):
         """
         删除多模型数据
         :param kwargs:
         :return:
         """
-        query = cls.action_params(**kwargs).action().params_query
+        query = self.action_params(**kwargs).action().params_query
         response = query.delete()
-        cls.params_db.commit(), cls.params_db.close()
+        self.params_db.commit(), self.params_db.close()
         return response
 
-    @classmethod
-    def action_query(cls):
+    @hybridmethod
+    def action_query(self):
         """
         获取查询实例
         :return:
         """
-        cls.params_query = cls.params_db.query(cls.params_model)
-        return cls
+        self.params_query = self.params_db.query(self.params_model).execution_options(crud="%s.%s" % (type(self).__module__, type(self).__qualname__))
+        return self
 
-    @classmethod
-    def pk(cls, pk: int):
+    @hybridmethod
+    def pk(self, pk: int):
         """
         设定查询 主键
         :param pk:
         :return:
         """
-        cls.where(cls.params_pk, pk)
-        return cls
+        self.where(self.params_pk, pk)
+        return self
 
-    @classmethod
-    def pks(cls, pks: Union[List[int], Tuple[int]]):
+    @hybridmethod
+    def pks(self, pks: Union[List[int], Tuple[int]]):
         """
         设定查询 多主键
         :param pks:
         :return:
         """
         pks = list(pks) if type(pks) == tuple else pks
-        cls.where(cls.params_pk, 'in_', pks)
-        return cls
+        self.where(self.params_pk, 'in_', pks)
+        return self
 
-    @classmethod
-    def model(cls, model):
+    @hybridmethod
+    def model(self, model):
         """
         设定 操作模型
         :param model:
         :return:
         """
-        cls.params_model = model
-        return cls
+        self.params_model = model
+        return self
 
-    @classmethod
-    def where(cls, where: Union[List[tuple], List[list], Tuple[tuple], Tuple[list], list, tuple, str], *args):
+    @hybridmethod
+    def where(self, where: Union[List[tuple], List[list], Tuple[tuple], Tuple[list], list, tuple, str], *args):
         """
         添加查询 条件
         :param where:
         :return:
         """
         if bool(where):
-            _where = cls.params.get('where', [])
+            _where = self.params.get('where', [])
             if (type(where) == list or type(where) == tuple) and (type(where[0]) == list or type(where[0]) == tuple):
                 _where.extend(where)
             elif (type(where) == list or type(where) == tuple) and type(where[0]) == str:
                 _where.append(where)
             elif type(where) == str:
                 _where.append((where, *args))
-            cls.params.update({"where": _where})
-        return cls
+            self.params.update({"where": _where})
+        return self
 
-    @classmethod
-    def action_where(cls):
+    @hybridmethod
+    def action_advise(self):
+        """
+        记录查询使用的 筛选/排序 形状 用于索引建议 (DB_INDEX_ADVISOR)
+        :return:
+        """
+        if INDEX_ADVISOR.enabled:
+            INDEX_ADVISOR.record(self.params_model, self.params.get('where', None), self.params.get('order', None))
+            for j in self.params.get('join', None) or []:
+                if j and j[0] in self.params_relation:
+                    INDEX_ADVISOR.record(self.params_relation[j[0]], j[1])
+        return self
+
+    @hybridmethod
+    def action_where(self):
         """
         过滤模型数据条件
         :return:
         """
-        where = cls.params.get('where', None)
+        where = self.params.get('where', None)
         if where and (type(where) == tuple or type(where) == list):  # 设置过滤 like
             for w in where:
-                cls.filter_where(where=w) if w else None
-        cls.params.update({"where": []})
-        return cls
+                self.filter_where(where=w) if w else None
+        self.params.update({"where": []})
+        return self
 
-    @classmethod
-    def join(cls, join: Union[list, tuple, None] = None):
+    @hybridmethod
+    def join(self, join: Union[list, tuple, None] = None):
         """
         join=[('sale', [('status', True)], 'join')]
         :param join:
         :return:
         """
         if bool(join):
-            _join = cls.params.get('join', [])
+            _join = self.params.get('join', [])
             if (type(join) == list or type(join) == tuple) and (type(join[0]) == list or type(join[0]) == tuple):
                 _join.extend(join)
             elif (type(join) == list or type(join) == tuple) and type(join[0]) == str:
                 _join.append(join)
-            cls.params.update({"join": _join})
-        return cls
+            self.params.update({"join": _join})
+        return self
 
-    @classmethod
-    def action_join(cls):
+    @hybridmethod
+    def action_join(self):
         """
         过滤模型数据条件
         :return:
         """
-        join = cls.params.get('join', None)
+        join = self.params.get('join', None)
         if join and (type(join) == tuple or type(join) == list):  # 设置过滤 like
             for j in join:
                 if j:
-                    join_model = cls.params_relation.get(j[0], None)
+                    join_model = self.params_relation.get(j[0], None)
                     if join_model:
-                        cls.params_query = getattr(cls.params_query, j[2] if len(j) == 3 and j[2] else 'join')(join_model)
+                        self.params_query = getattr(self.params_query, j[2] if len(j) == 3 and j[2] else 'join')(join_model)
                         for w in j[1]:
-                            cls.filter_where(where=w, model=join_model) if join_model else None
-        cls.params.update({"join": []})
-        return cls
+                            self.filter_where(where=w, model=join_model) if join_model else None
+        self.params.update({"join": []})
+        return self
 
-    @classmethod
-    def filter_where(cls, where: Union[list, tuple, None] = None, model=None):
+    @hybridmethod
+    def filter_where(self, where: Union[list, tuple, None] = None, model=None):
         """
         过滤数据条件
         :param where:
         :param model:
         :return:
         """
-        query = cls.params_query
-        params_model = cls.params_model if not model else model
+        query = self.params_query
+        params_model = self.params_model if not model else model
         if bool(where) and (type(where) == tuple or type(where) == list):
             if len(where) == 2 and (type(where[0]) is list or type(where[0]) is tuple) and where[1] == "or":
                 """([('content',"==", '东'),('content','==', '西')], 'or')"""
-                _filters = [cls.filter_item(params_model, fil) for fil in where[0]]
+                _filters = [self.filter_item(params_model, fil) for fil in where[0]]
                 query = query.filter(or_(*_filters))
             else:
-                query = query.filter(cls.filter_item(params_model, where))
-        cls.params_query = query
-        return cls
+                query = query.filter(self.filter_item(params_model, where))
+        self.params_query = query
+        return self
 
-    @classmethod
-    def filter_item(cls, model, where):
+    @hybridmethod
+    def filter_item(self, model, where):
+        """
+        单个过滤条件 ('content', '西') / ('content', '==', '西') / (['name','content'], 'or', '西')
+        全文搜索 ('content', 'match', '关键词') / (['name','content'], 'search', '关键词1 关键词2') 字段需在模型 __searchable__ 中
+        :param model:
+        :param where:
+        :return:
+        """
         if len(where) == 2:
-            """('content', '西')"""
             if type(where[0]) is str:
-                return getattr(model, where[0]) == where[1]
+                return filter_builder(model, where[0], "==")(where[1])
         elif len(where) == 3:
-            if where[1] == "==" or where[1] == "=" or where[1] == "eq":
-                """('content', '==', '西')"""
-                return getattr(model, where[0]) == where[2]
-            elif where[1] == "!=" or where[1] == "<>" or where[1] == "><" or where[1] == "neq" or where[1] == "ne":
-                """('content', '!=', '西')"""
-                return getattr(model, where[0]) != where[2]
-            elif where[1] == ">" or where[1] == "gt":
-                """('content', '>', '西')"""
-                return getattr(model, where[0]) > where[2]
-            elif where[1] == ">=" or where[1] == "ge":
-                """('content', '>=', '西')"""
-                return getattr(model, where[0]) >= where[2]
-            elif where[1] == "<" or where[1] == "lt":
-                """('content', '<', '西')"""
-                return getattr(model, where[0]) < where[2]
-            elif where[1] == "<=" or where[1] == "le":
-                """('content', '<=', '西')"""
-                return getattr(model, where[0]) <= where[2]
-            elif where[1] in ["like", "ilike"]:
-                if not where[2] is None:
-                    """('content', 'like', '西')"""
-                    return getattr(getattr(model, where[0]), where[1])("%" + where[2] + "%")
-            elif where[1] in ["or"]:
-                if type(where[0]) == tuple or type(where[0]) == list:
-                    """(['name','content'], 'or', '西')"""
-                    _filters = [(getattr(model, fil) == where[2]) for fil in where[0]]
-                    return or_(*_filters)
-
-                if type(where[0]) == str and (type(where[2]) == tuple or type(where[2]) == list):
-                    """('name', 'or', ['西', '西'])"""
-                    _filters = [(getattr(model, where[0]) == fil) for fil in where[2]]
-                    return or_(*_filters)
-            elif where[1] in ["or_like", "or_ilike"]:
-                if type(where[0]) == tuple or type(where[0]) == list:
-                    """(['name','content'], 'or_like', '西')"""
-                    _filters = [(getattr(getattr(model, fil), where[1][3:])("%" + where[2] + "%")) for
-                                fil in
-                                where[0]]
-                    return or_(*_filters)
-                if type(where[0]) == str and (type(where[2]) == tuple or type(where[2]) == list):
-                    """('name', 'or_like', ['西', '西'])"""
-                    _filters = [(getattr(getattr(model, where[0]), where[1][3:])("%" + fil + "%")) for
-                                fil in
-                                where[2]]
-                    return or_(*_filters)
-            elif where[1] in ["between"] and type(where[2]) in [list, tuple] and len(where[2]) == 2:
-                return getattr(getattr(model, where[0]), where[1])(where[2][0], where[2][1])
-            elif where[1] in ["datebetween"] and type(where[2]) in [list, tuple] and len(where[2]) == 2:
-                return getattr(getattr(model, where[0]), 'between')(where[2][0], where[2][1])
-            elif where[1] in ["datetimebetween"] and type(where[2]) in [list, tuple] and len(where[2]) == 2:
-                return getattr(getattr(model, where[0]), 'between')("%s 00:00:00" % where[2][0], "%s 23:59:59" % where[2][1])
-            elif where[1] in ["in"] and type(where[2]) in [list, tuple]:
-                return getattr(getattr(model, where[0]), "in_")(where[2])
-            elif where[1] in ["notin"] and type(where[2]) in [list, tuple]:
-                return getattr(getattr(model, where[0]), "notin_")(where[2])
-            else:
-                return getattr(getattr(model, where[0]), where[1])(where[2])
+            key = tuple(where[0]) if type(where[0]) in [list, tuple] else where[0]
+            if where[1] in SEARCH_OPERATORS:
+                return search_filter(self.params_db, model, key, where[2])
+            return filter_builder(model, key, where[1])(where[2])
         return
 
-    @classmethod
-    def order(cls, order: Union[List[tuple], List[list], Tuple[tuple], Tuple[list], list, tuple]):
+    @hybridmethod
+    def fields(self, fields: Union[List[str], Tuple[str], str, None]):
+        """
+        只加载的字段 ["id", "name"] / "id,name"; 关联/属性 不影响加载的字段
+        :param fields:
+        :return:
+        """
+        if bool(fields):
+            self.params.update({"fields": [field.strip() for field in fields.split(",")] if type(fields) is str else list(fields)})
+        return self
+
+    @hybridmethod
+    def defer(self, defer: Union[bool, List[str]]):
+        """
+        延迟加载的字段 True 为 params_defer(未设置时为大字段), False 不延迟
+        :param defer:
+        :return:
+        """
+        self.params.update({"defer": defer})
+        return self
+
+    @hybridmethod
+    def action_fields(self):
+        """
+        处理 fields 到 load_only, 未设置 fields 时 延迟加载 defer 字段
+        :return:
+        """
+        from sqlalchemy.orm import load_only, defer
+        mapper = self.params_model.__mapper__
+        fields, deferred = self.params.get('fields', None), self.params.get('defer', False)
+        if fields:
+            names = {name for field in fields for name in self.params_fields_depends.get(field, [field])}
+            # 排序字段 游标分页需要
+            names.update(attr_item[0] for attr_item in (self.params.get('order', None) or []) if type(attr_item[0]) is str)
+            columns = [getattr(self.params_model, name) for name in mapper.column_attrs.keys() if name in names]
+            if columns:
+                self.params_query = self.params_query.options(load_only(*columns))
+        elif deferred:
+            names = deferred if type(deferred) is list else (self.params_defer if self.params_defer is not None else large_columns(self.params_model))
+            columns = [getattr(self.params_model, name) for name in names if name in mapper.column_attrs]
+            if columns:
+                self.params_query = self.params_query.options(*[defer(column, raiseload=self.params_defer_raiseload) for column in columns])
+        return self
+
+    @hybridmethod
+    def load(self, load: Union[dict, None]):
+        """
+        本次查询的关联加载方式 覆盖 params_load, 值为 None 不处理该关联
+        :param load: {"permissions": "selectin", "roles": "raise"}
+        :return:
+        """
+        if bool(load):
+            self.params.update({"load": {**(self.params.get('load', None) or {}), **load}})
+        return self
+
+    @hybridmethod
+    def action_load_map(self) -> dict:
+        """
+        本次查询的关联加载方式 设置了 fields 时 未请求的关联 raiseload (序列化时视为未设置)
+        :return: {关联路径: 加载方式}
+        """
+        load = {**self.params_load, **(self.params.get('load', None) or {})}
+        fields = self.params.get('fields', None)
+        if fields:
+            load.update({path: "raise" for path, strategy in load.items() if strategy and path.split(".")[0] not in fields})
+        return {path: strategy for path, strategy in load.items() if strategy}
+
+    @hybridmethod
+    def action_load(self):
+        """
+        处理关联加载方式到查询 selectinload/joinedload/raiseload ...
+        :return:
+        """
+        from sqlalchemy import orm
+        options = []
+        for path, strategy in self.action_load_map().items():
+            strategy = strategy[:-4] if strategy.endswith("load") else strategy
+            loader, model = orm, self.params_model
+            for name in path.split("."):
+                attr = getattr(model, name)
+                loader = getattr(loader, "%sload" % strategy)(attr)
+                model = attr.property.mapper.class_
+            options.append(loader)
+        if options:
+            self.params_query = self.params_query.options(*options)
+        return self
+
+    @hybridmethod
+    def order(self, order: Union[List[tuple], List[list], Tuple[tuple], Tuple[list], list, tuple]):
         """
         排序
         :param order:
         :return:
         """
         if bool(order):
-            _order = cls.params.get('order', [])
+            _order = self.params.get('order', [])
             if type(order[0]) == list or type(order[0]) == tuple:
                 _order.extend(order)
             elif type(order[0]) == str:
                 _order.append(order)
-            cls.params.update({"order": _order})
-        return cls
+            self.params.update({"order": _order})
+        return self
 
-    @classmethod
-    def action_order(cls):
+    @hybridmethod
+    def action_order(self):
         """
         处理排序到查询
         :return:
         """
-        query = cls.params_query
-        orders = cls.params.get('order', [])
+        query = self.params_query
+        orders = self.params.get('order', [])
         if bool(orders):
             if orders and (type(orders) == tuple or type(orders) == list):  # 设置排序
                 for attr_item in orders:
-                    query = query.order_by(getattr(getattr(cls.params_model, attr_item[0]), attr_item[1])())
-        cls.params_query = query
-        return cls
+                    query = query.order_by(order_builder(self.params_model, attr_item[0], attr_item[1]))
+        self.params_query = query
+        return self
+
+    @hybridmethod
+    def cursor(self, cursor: Union[str, None]):
+        """
+        设置游标 '' 为第一页
+        :param cursor:
+        :return:
+        """
+        self.params.update({"cursor": cursor})
+        return self
+
+    @hybridmethod
+    def action_cursor_columns(self) -> list:
+        """
+        游标排序字段 order + 主键
+        :return: [(name, direction)]
+        """
+        columns = [(attr_item[0], attr_item[1]) for attr_item in (self.params.get('order', None) or [])]
+        if self.params_pk not in [name for name, _ in columns]:
+            columns.append((self.params_pk, "asc"))
+        return columns
+
+    @hybridmethod
+    def action_cursor_encode(self, item) -> str:
+        """
+        根据最后一条数据 生成游标
+        :param item:
+        :return:
+        """
+        import base64
+        import json
+        values = [getattr(item, name) for name, _ in self.action_cursor_columns()]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('utf-8')
+
+    @hybridmethod
+    def action_cursor_decode(self, cursor: str, columns: list) -> list:
+        """
+        解析游标
+        :param cursor:
+        :param columns:
+        :return:
+        """
+        import base64
+        import json
+        from datetime import datetime, date
+        from fastapi import HTTPException, status
+        invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+        except (ValueError, TypeError):
+            raise invalid
+        if type(values) is not list or len(values) != len(columns):
+            raise invalid
+        for index, (name, _) in enumerate(columns):
+            try:
+                python_type = getattr(self.params_model, name).type.python_type
+            except (AttributeError, NotImplementedError):
+                continue
+            if python_type in [datetime, date] and type(values[index]) is str:
+                try:
+                    values[index] = python_type.fromisoformat(values[index])
+                except ValueError:
+                    raise invalid
+        return values
+
+    @hybridmethod
+    def action_cursor_nullable(self, name: str) -> bool:
+        """
+        游标排序字段 是否可为 NULL
+        :param name:
+        :return:
+        """
+        column = getattr(self.params_model, name)
+        return bool(getattr(getattr(column, "expression", None), "nullable", False))
 
-    @classmethod
-    def page(cls, page: int):
+    @hybridmethod
+    def action_cursor(self):
+        """
+        处理游标到查询 (a > :a) OR (a = :a AND id > :id) 代替 OFFSET
+        :return:
+        """
+        cursor = self.params.get('cursor', None)
+        if cursor is None:
+            return self
+        query = self.params_query
+        columns = self.action_cursor_columns()
+        nullable = [name for name, _ in columns if self.action_cursor_nullable(name)]
+        if nullable:
+            # 可为 NULL 的字段 NULL 统一排在最后 (各数据库默认位置不同)
+            query = query.order_by(None)
+            for name, direction in columns:
+                if name in nullable:
+                    query = query.order_by(getattr(self.params_model, name).is_(None))
+                query = query.order_by(order_builder(self.params_model, name, direction))
+        elif self.params_pk not in [attr_item[0] for attr_item in (self.params.get('order', None) or [])]:
+            query = query.order_by(order_builder(self.params_model, self.params_pk, "asc"))
+        if cursor:
+            values = self.action_cursor_decode(cursor, columns)
+            conditions = []
+            for index, (name, direction) in enumerate(columns):
+                column = getattr(self.params_model, name)
+                if values[index] is None:
+                    continue  # NULL 排在最后 同一字段中没有更后的值
+                after = column < values[index] if direction == "desc" else column > values[index]
+                if name in nullable:
+                    after = or_(after, column.is_(None))
+                equals = [getattr(self.params_model, _name).is_(None) if values[_index] is None else getattr(self.params_model, _name) == values[_index]
+                          for _index, (_name, _) in enumerate(columns[:index])]
+                conditions.append(and_(*equals, after))
+            query = query.filter(or_(*conditions))
+        limit = self.params.get('limit', None)
+        if bool(limit):
+            query = query.limit(limit)
+        self.params.update({"page": None, "offset": None})
+        self.params_query = query
+        return self
+
+    @hybridmethod
+    def page(self, page: int):
         """
         设置page页
         :param page:
         :return:
         """
-        cls.params.update({"page": page})
-        return cls
+        self.params.update({"page": page})
+        return self
 
-    @classmethod
-    def action_page(cls):
+    @hybridmethod
+    def with_total(self, with_total: bool):
+        """
+        分页时是否统计总条数
+        :param with_total:
+        :return:
+        """
+        self.params.update({"with_total": with_total})
+        return self
+
+    @hybridmethod
+    def action_page(self):
         """
         处理分页到查询
         :return:
         """
-        query = cls.params_query
-        page = cls.params.get('page', None)
-        limit = cls.params.get('limit', None)
+        query = self.params_query
+        page = self.params.get('page', None)
+        limit = self.params.get('limit', None)
         if bool(page) and type(page) is int and bool(limit):
             offset = (page - 1) * limit
             query = query.offset(offset)
 
-        cls.params_query = query
-        return cls
+        self.params_query = query
+        return self
 
-    @classmethod
-    def offset(cls, offset: int):
+    @hybridmethod
+    def offset(self, offset: int):
         """
         :param offset:
         :return:
         """
-        cls.params.update({"offset": offset})
-        return cls
+        self.params.update({"offset": offset})
+        return self
 
-    @classmethod
-    def action_offset(cls):
+    @hybridmethod
+    def action_offset(self):
         """
         :return:
         """
-        query = cls.params_query
-        offset = cls.params.get('offset', None)
-        limit = cls.params.get('limit', None)
+        query = self.params_query
+        offset = self.params.get('offset', None)
+        limit = self.params.get('limit', None)
         if bool(offset) and bool(limit):
             query = query.offset(offset)
-        cls.params_query = query
-        return cls
+        self.params_query = query
+        return self
 
-    @classmethod
-    def limit(cls, limit: int):
+    @hybridmethod
+    def limit(self, limit: int):
         """
         :param limit:
         :return:
         """
-        cls.params.update({"limit": limit})
-        return cls
+        self.params.update({"limit": limit})
+        return self
 
-    @classmethod
-    def action_limit(cls):
+    @hybridmethod
+    def action_limit(self):
         """
         :return:
         """
-        query = cls.params_query
-        limit = cls.params.get('limit', None)
-        offset = cls.params.get('offset', None)
-        page = cls.params.get('page', None)
+        query = self.params_query
+        limit = self.params.get('limit', None)
+        offset = self.params.get('offset', None)
+        page = self.params.get('page', None)
         if bool(limit) and (bool(offset) or bool(page)):
             query = query.limit(limit)
-        cls.params_query = query
-        return cls
+        self.params_query = query
+        return self
 
-    @classmethod
-    def action(cls):
+    @hybridmethod
+    def action(self):
         """处理查询参数 params 到 query"""
-        [(getattr(cls, "action_%s" % action)() if hasattr(cls, "action_%s" % action) else None) for action in
-         cls.params_action_method]
-        return cls
+        [(getattr(self, "action_%s" % action)() if hasattr(self, "action_%s" % action) else None) for action in
+         self.params_action_method]
+        return self
 
-    @classmethod
-    def screen_params(cls, params: BaseModel):
-        cls.action_params(**params.dict())
-        return cls
+    @hybridmethod
+    def screen_params(self, params: BaseModel):
+        self.action_params(**params.dict())
+        return self
 
-    @classmethod
-    def action_params(cls, **kwargs):
+    @hybridmethod
+    def action_params(self, **kwargs):
         """
         处理kwargs 参数到 params
         :param kwargs:
         :return:
         """
-        [(getattr(cls, params)(params_value) if hasattr(cls, params) else None) for params, params_value in
+        [(getattr(self, params)(params_value) if hasattr(self, params) else None) for params, params_value in
          kwargs.items()]
-        return cls
+        return self
+
+    @hybridmethod
+    def action_list_params(self, **kwargs):
+        """
+        处理kwargs 参数到 params, 多数据查询 设置了 params_defer 且未指定 defer 时 延迟加载 params_defer
+        :param kwargs:
+        :return:
+        """
+        self.action_params(**kwargs)
+        if self.params_defer:
+            self.params.setdefault("defer", True)
+        return self
 
-    @classmethod
-    def update_or_store_model(cls, **kwargs):
+    @hybridmethod
+    def update_or_store_model(self, **kwargs):
         """
         更新或者创建
+        where 为唯一键等值条件时 原生 upsert 一条语句完成
         :param kwargs:
         :return:
         """
-        instance = cls.first(**kwargs)
+        use_primary(kwargs['db'])
+        keys = self.action_upsert_where(**kwargs)
+        if keys:
+            self.upsert_many(db=kwargs['db'], items=[kwargs['item']], keys=tuple(keys), **keys)
+            return self.first(**kwargs)
+        instance = self.first(**kwargs)
         if instance:
             if "where" in kwargs:
                 del kwargs['where']
-            return cls.update(**kwargs, pk=getattr(instance, cls.params_pk), exclude_unset=True)
+            return self.update(**kwargs, pk=getattr(instance, self.params_pk), exclude_unset=True)
         else:
             del kwargs['where']
-            return cls.store(**kwargs)
+            return self.store(**kwargs)
 
-    @classmethod
-    def find_or_store_model(cls, **kwargs):
+    @hybridmethod
+    def find_or_store_model(self, **kwargs):
         """
         查找或者创建
-        """
-        instance = cls.first(**kwargs)
+        where 为唯一键等值条件时 原生 INSERT ... ON CONFLICT DO NOTHING
+        """
+        use_primary(kwargs['db'])
+        keys = self.action_upsert_where(update=False, **kwargs)
+        if keys:
+            self.upsert_many(db=kwargs['db'], items=[kwargs['item']], keys=tuple(keys), update=False, **keys)
+            return self.first(**kwargs)
+        instance = self.first(**kwargs)
         if not instance:
             del kwargs['where']
-            return cls.store(**kwargs)
+            return self.store(**kwargs)
         return instance
 
+    @hybridmethod
+    def action_upsert_where(self, db: Session = None, where=None, item: BaseModel = None, update: bool = True, **kwargs) -> Union[dict, None]:
+        """
+        where 是否可以走原生 upsert: 只有等值条件 且为唯一键; 树模型子节点/find 带关联 不走原生
+        :param db:
+        :param where: ('username', 'admin') / [('name', '==', 'a'), ('parent_id', 1)]
+        :param item:
+        :param update:
+        :param kwargs:
+        :return: {键: 值} 或 None
+        """
+        if db is None or item is None or not where or kwargs:
+            return None
+        conditions = [where] if type(where[0]) is str else where
+        keys = {}
+        for condition in conditions:
+            if type(condition) not in [list, tuple] or type(condition[0]) is not str:
+                return None
+            if len(condition) == 2:
+                keys[condition[0]] = condition[1]
+            elif len(condition) == 3 and condition[1] in ["==", "="]:
+                keys[condition[0]] = condition[2]
+            else:
+                return None
+        self.action_params(db=db)
+        values = {**keys, **item.dict(exclude_unset=True)}
+        if any(values[key] != value for key, value in keys.items()):
+            return None
+        if self.action_nested_sets() and values.get("parent_id") is not None:
+            return None
+        relationship = self.params_relationship if type(self.params_relationship) is dict else {}
+        if not update and any(values.get(relation) for relation in relationship):
+            return None
+        return keys if self.action_upsert_dialect(tuple(keys)) else None
+
 
 class CRUDTree(BaseCRUD):
-    @classmethod
-    def move_inside(cls, db: Session, inside_id: int, **kwargs):
+    @hybridmethod
+    def move_inside(self, db: Session, inside_id: int, **kwargs):
         """
         移动到 inside_id 下
         :param db:
@@ -568,11 +1759,11 @@ class CRUDTree(BaseCRUD):
         :param kwargs:
         :return:
         """
-        node = cls.first(db=db, **kwargs)
+        node = self.first(db=use_primary(db), **kwargs)
         return node.move_inside(inside_id)
 
-    @classmethod
-    def move_after(cls, db: Session, after_id: int, **kwargs):
+    @hybridmethod
+    def move_after(self, db: Session, after_id: int, **kwargs):
         """
         移动到 after_id 后
         :param db:
@@ -580,11 +1771,12 @@ class CRUDTree(BaseCRUD):
         :param kwargs:
         :return:
         """
-        node = cls.first(db=db, **kwargs)
+        node = self.first(db=use_primary(db), **kwargs)
         return node.move_after(after_id)
 
-    @classmethod
-    def get_tree(cls, db: Session, json=False, json_fields=None, query=None):
+    @hybridmethod
+    @replica_read
+    def get_tree(self, db: Session, json=False, json_fields=None, query=None):
         """
         获取树
         :param db:
@@ -602,5 +1794,5 @@ class CRUDTree(BaseCRUD):
             _node = copy.deepcopy(node)
             return {"id": _node.id, "label": _node.name, "node": _node}
 
-        return cls.params_model.get_tree(session=db, json=json, json_fields=json_fields_fun if json is True and not json_fields else json_fields,
+        return self.params_model.get_tree(session=db, json=json, json_fields=json_fields_fun if json is True and not json_fields else json_fields,
                                          query=query if query else query_fun)
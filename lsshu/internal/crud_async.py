@@ -0,0 +1,284 @@
+from pydantic import BaseModel
+from sqlalchemy import select, func, update as sa_update, delete as sa_delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from lsshu.internal.crud import BaseCRUD, hybridmethod, window_function_supported, estimate_table_rows, COUNT_CACHE
+
+
+class AsyncBaseCRUD(BaseCRUD):
+    """
+    基于 AsyncSession 的 BaseCRUD
+    where/order/join/page 等参数与 BaseCRUD 相同, 查询方法需要 await
+    await CRUD.paginate(db=db, screen_params=params)
+    """
+    params_db = AsyncSession  # db实例
+    params_defer_raiseload = True  # 异步会话不能懒加载 访问 defer 的字段时抛出 InvalidRequestError 而不是 MissingGreenlet
+
+    @hybridmethod
+    def action_query(self):
+        """
+        获取查询实例
+        :return:
+        """
+        self.params_query = select(self.params_model).execution_options(crud="%s.%s" % (type(self).__module__, type(self).__qualname__))
+        return self
+
+    @hybridmethod
+    def action_options(self):
+        """
+        异步会话不能懒加载 params_load 未指定的多对多关联统一 selectinload
+        :return:
+        """
+        if type(self.params_relationship) is dict:
+            load = self.action_load_map()
+            return [selectinload(getattr(self.params_model, relation)) for relation in self.params_relationship if hasattr(self.params_model, relation) and relation not in load]
+        return []
+
+    @hybridmethod
+    async def all(self, **kwargs):
+        """
+        多数据
+        :param kwargs:
+        :return:
+        """
+        query = self.action_list_params(**kwargs).action().params_query
+        result = await self.params_db.execute(query.options(*self.action_options()))
+        return result.scalars().unique().all()
+
+    @hybridmethod
+    async def count(self, **kwargs) -> int:
+        """
+        多数据
+        :param kwargs:
+        :return:
+        """
+        query = self.action_params(**kwargs).action().params_query
+        return await self.params_db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+
+    @hybridmethod
+    async def first(self, **kwargs):
+        """
+        单条数据
+        :param kwargs:
+        :return:
+        """
+        query = self.action_params(**kwargs).action().params_query
+        result = await self.params_db.execute(query.options(*self.action_options()).limit(1))
+        return result.scalars().first()
+
+    @hybridmethod
+    async def paginate(self, **kwargs):
+        """
+        分页 操作 与 BaseCRUD.paginate 相同
+        :param kwargs:
+        :return:
+        """
+        import math
+        total, total_exact, total_key = await self.action_list_params(**kwargs).action_total()
+        window = self.action_total_window()
+        query = self.action().params_query.options(*self.action_options())
+        limit, offset = self.params.get('limit', 0), self.action_paginate_offset()
+        with_total, keyset = self.params.get('with_total', True), self.params.get('cursor', None) is not None
+        if keyset or not with_total:
+            result = await self.params_db.execute(query.limit(limit + 1) if limit else query)
+            result = self.action_paginate_result(items=result.scalars().unique().all(), total=None, limit=limit, offset=offset)
+            if with_total:
+                if total is None:
+                    total = await self.action_params(**kwargs).action_clear_params(('limit', 'page', 'offset', 'cursor')).count()
+                    self.action_cache_total(total_key, total)
+                result.update({"total": total, "pages": math.ceil(total / limit) if limit else 1, "total_exact": total_exact})
+            return result
+        if total is not None:
+            result = await self.params_db.execute(query)
+            items = result.scalars().unique().all()
+        elif window and window_function_supported(self.params_db):
+            result = await self.params_db.execute(query.add_columns(func.count().over().label("paginate_total")))
+            rows = result.unique().all()
+            items = [row[0] for row in rows]
+            total = rows[0][-1] if rows else (0 if not offset else None)
+            self.action_cache_total(total_key, total)
+        else:
+            result = await self.params_db.execute(query)
+            items = result.scalars().unique().all()
+        if total is None:
+            total = await self.action_params(**kwargs).action_clear_params(('limit', 'page', 'offset')).count()
+            self.action_cache_total(total_key, total)
+        return dict(self.action_paginate_result(items=items, total=total, limit=limit, offset=offset), total_exact=total_exact)
+
+    @hybridmethod
+    async def action_total(self):
+        """
+        从估算或缓存获取总条数 需在 action() 之前调用
+        :return: (total, total_exact, total_key)
+        """
+        if self.action_total_estimable():
+            table = self.params_model.__tablename__
+            total = await self.params_db.run_sync(lambda session: estimate_table_rows(session, table))
+            if total is not None:
+                return total, False, None
+        key = self.action_total_key()
+        return (COUNT_CACHE.get(key) if key else None), True, key
+
+    @hybridmethod
+    async def store(self, db: AsyncSession, item: BaseModel, **kwargs):
+        """
+        创建模型数据
+        :param db:
+        :param item:
+        :param kwargs:
+        :return:
+        """
+        self.action_params(db=db, **kwargs)
+        # 处理关联
+        import copy
+        _item = copy.deepcopy(item)
+        if type(self.params_relationship) is dict:
+            for relation in self.params_relationship:
+                if hasattr(item, relation) and bool(getattr(item, relation)):
+                    delattr(item, relation)
+        # 创建实例
+        db_item = self.params_model(**kwargs, **item.dict(exclude_unset=True))
+        # 添加关联
+        if type(self.params_relationship) is dict:
+            for (relation, relation_class) in self.params_relationship.items():
+                if hasattr(_item, relation) and bool(getattr(_item, relation)):
+                    _relation = await AsyncBaseCRUD.all(model=relation_class, db=db, where=(
+                        "id", 'in_', getattr(_item, relation)))
+                    setattr(db_item, relation, _relation)
+
+        self.params_db.add(db_item)
+        await self.params_db.commit()
+        # refresh 会把关联重置为懒加载 这里重新查询以 selectinload 关联
+        return await self.first(db=db, pk=getattr(db_item, self.params_pk))
+
+    @hybridmethod
+    async def update(self, **kwargs):
+        """
+        更新模型数据
+        :param kwargs:
+        :return:
+        """
+        item = await self._update_relationship(**kwargs)
+        exclude_unset = kwargs.get('exclude_unset', False)
+        values = item.dict(exclude_unset=exclude_unset)
+        query = self.action_params(**kwargs).action().params_query
+        if values:
+            await self.params_db.execute(sa_update(self.params_model).where(query.whereclause).values(**values).execution_options(synchronize_session="fetch"))
+        await self.params_db.commit()
+        return await self.first(**kwargs)
+
+    @hybridmethod
+    async def _update_relationship(self, db: AsyncSession, item: BaseModel, **kwargs):
+        """
+        更新处理关联 多对多 与 BaseCRUD._update_relationship 相同, 关联表增删在 run_sync 中执行
+        :param db:
+        :param item:
+        :return:
+        """
+        if type(self.params_relationship) is dict:
+            values = item.dict(exclude_unset=True)
+            relations = {relation: list(getattr(item, relation) or []) for relation in self.params_relationship
+                         if hasattr(item, relation) and (bool(getattr(item, relation)) or relation in values)}
+            if relations:
+                query = type(self)().action_params(db=db, **kwargs).action().params_query
+                result = await db.execute(query.with_only_columns(getattr(self.params_model, self.params_pk)))
+                pks = result.scalars().all()
+                await db.run_sync(lambda session: [type(self)().action_params(db=session).action_sync_relationship(
+                    relation, {pk: ids for pk in pks}) for relation, ids in relations.items()])
+            for relation in self.params_relationship:
+                if hasattr(item, relation):
+                    delattr(item, relation)
+        return item
+
+    @hybridmethod
+    async def delete(self, **kwargs):
+        """
+        删除多模型数据
+        :param kwargs:
+        :return:
+        """
+        query = self.action_params(**kwargs).action().params_query
+        result = await self.params_db.execute(sa_delete(self.params_model).where(query.whereclause).execution_options(synchronize_session="fetch"))
+        await self.params_db.commit()
+        return result.rowcount
+
+    @hybridmethod
+    async def update_or_store_model(self, **kwargs):
+        """
+        更新或者创建
+        :param kwargs:
+        :return:
+        """
+        instance = await self.first(**kwargs)
+        if instance:
+            if "where" in kwargs:
+                del kwargs['where']
+            return await self.update(**kwargs, pk=getattr(instance, self.params_pk), exclude_unset=True)
+        else:
+            del kwargs['where']
+            return await self.store(**kwargs)
+
+    @hybridmethod
+    async def find_or_store_model(self, **kwargs):
+        """
+        查找或者创建
+        """
+        instance = await self.first(**kwargs)
+        if not instance:
+            del kwargs['where']
+            return await self.store(**kwargs)
+        return instance
+
+
+class AsyncCRUDTree(AsyncBaseCRUD):
+    """
+    get_tree 由 sqlalchemy_mptt 在同步会话中查询, 通过 AsyncSession.run_sync 执行
+    """
+
+    @hybridmethod
+    async def move_inside(self, db: AsyncSession, inside_id: int, **kwargs):
+        """
+        移动到 inside_id 下
+        :param db:
+        :param inside_id:
+        :param kwargs:
+        :return:
+        """
+        node = await self.first(db=db, **kwargs)
+        return node.move_inside(inside_id)
+
+    @hybridmethod
+    async def move_after(self, db: AsyncSession, after_id: int, **kwargs):
+        """
+        移动到 after_id 后
+        :param db:
+        :param after_id:
+        :param kwargs:
+        :return:
+        """
+        node = await self.first(db=db, **kwargs)
+        return node.move_after(after_id)
+
+    @hybridmethod
+    async def get_tree(self, db: AsyncSession, json=False, json_fields=None, query=None):
+        """
+        获取树
+        :param db:
+        :param json:
+        :param json_fields:
+        :param query:
+        :return:
+        """
+
+        def query_fun(nodes):
+            return nodes
+
+        def json_fields_fun(node):
+            import copy
+            _node = copy.deepcopy(node)
+            return {"id": _node.id, "label": _node.name, "node": _node}
+
+        return await db.run_sync(lambda session: self.params_model.get_tree(
+            session=session, json=json, json_fields=json_fields_fun if json is True and not json_fields else json_fields,
+            query=query if query else query_fun))
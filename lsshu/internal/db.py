@@ -1,22 +1,147 @@
+import functools
+import itertools
+import random
+import threading
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Union
 
-from sqlalchemy import create_engine, Column, Integer, TIMESTAMP, or_
+from sqlalchemy import create_engine, Column, Integer, TIMESTAMP, or_, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql import Select
 
 from config import DB_SQLALCHEMY_DATABASE_URL, DB_ENGINE_KWARGS, DB_SESSION_MAKER_KWARGS
 
+try:
+    from config import DB_REPLICA_DATABASE_URLS
+except ImportError:
+    DB_REPLICA_DATABASE_URLS = []
+
+try:
+    from config import DB_REPLICA_ENGINE_KWARGS
+except ImportError:
+    DB_REPLICA_ENGINE_KWARGS = None
+
+try:
+    from config import DB_REPLICA_POLICY
+except ImportError:
+    DB_REPLICA_POLICY = "round_robin"
+
 Engine = create_engine(
     DB_SQLALCHEMY_DATABASE_URL,
     **DB_ENGINE_KWARGS
 )
 
-SessionLocal = sessionmaker(bind=Engine, **DB_SESSION_MAKER_KWARGS)
+# 只读副本
+ReplicaEngines = [create_engine(url, **(DB_REPLICA_ENGINE_KWARGS if DB_REPLICA_ENGINE_KWARGS is not None else DB_ENGINE_KWARGS))
+                  for url in DB_REPLICA_DATABASE_URLS or []]
+
+# 当前上下文中的查询 是否可以走只读副本 (CRUD 读方法中为 True)
+REPLICA_READ: ContextVar = ContextVar("replica_read", default=False)
+
+
+class ReplicaBalancer(object):
+    """
+    只读副本 负载均衡 round_robin 轮询 / random 随机 / least_connections 已借出连接最少
+    """
+
+    def __init__(self, engines: list, policy: str = "round_robin"):
+        self.engines = engines
+        self.policy = policy
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def choose(self):
+        """
+        选择副本 没有副本时 None
+        :return:
+        """
+        if not self.engines:
+            return None
+        if self.policy == "random":
+            return random.choice(self.engines)
+        if self.policy == "least_connections":
+            return min(self.engines, key=lambda engine: engine.pool.checkedout() if hasattr(engine.pool, "checkedout") else 0)
+        with self.lock:
+            return self.engines[next(self.counter) % len(self.engines)]
+
+
+REPLICA_BALANCER = ReplicaBalancer(ReplicaEngines, policy=DB_REPLICA_POLICY)
+
+
+class RoutingSession(Session):
+    """
+    读写分离会话 CRUD 读方法(all/first/count/paginate/get_tree) 的 SELECT 走只读副本, 其它语句走主库;
+    会话中发生过写入(flush/insert/update/delete)后 本会话(请求)的读取都走主库 避免读到副本延迟前的数据;
+    同一会话只使用一个副本
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or (clause is not None and getattr(clause, "is_dml", False)):
+            self.info["primary"] = True
+        elif REPLICA_READ.get() and isinstance(clause, Select) and not self.info.get("primary") and REPLICA_BALANCER.engines:
+            if "replica" not in self.info:
+                self.info["replica"] = REPLICA_BALANCER.choose()
+            return self.info["replica"]
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+def use_primary(session):
+    """
+    本会话之后的读取都走主库 (即将写入时 先读后写的数据需要来自主库)
+    :param session: Session / AsyncSession
+    :return:
+    """
+    getattr(session, "sync_session", session).info["primary"] = True
+    return session
+
+
+def replica_read(func):
+    """
+    装饰器 函数中的查询可走只读副本
+    :param func:
+    :return:
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = REPLICA_READ.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            REPLICA_READ.reset(token)
+
+    return wrapper
+
+
+SessionLocal = sessionmaker(bind=Engine, class_=RoutingSession, **DB_SESSION_MAKER_KWARGS)
 # 创建基本映射类
 Base = declarative_base(bind=Engine, name='Model')
 
 
+@event.listens_for(Base.metadata, "after_create")
+def _receive_after_create(target, connection, tables=(), **kwargs):
+    """建表后 为声明了 __searchable__ 的模型建立全文索引"""
+    from lsshu.internal.search import searchable_columns, create_search_index
+    tables = {t.name for t in tables}
+    for mapper in Base.registry.mappers:
+        if mapper.local_table.name in tables and searchable_columns(mapper.class_):
+            create_search_index(connection, mapper.class_, rebuild=False)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _receive_before_drop(target, connection, tables=(), **kwargs):
+    """删表前 删除 sqlite FTS5 影子表"""
+    from sqlalchemy import text
+    from lsshu.internal.search import searchable_columns, search_table_name, _SEARCH_INDEXES
+    tables = {t.name for t in tables}
+    for mapper in Base.registry.mappers:
+        if mapper.local_table.name in tables and searchable_columns(mapper.class_) and connection.dialect.name == "sqlite":
+            connection.execute(text('DROP TABLE IF EXISTS "%s"' % search_table_name(mapper.class_)))
+            _SEARCH_INDEXES.pop((str(connection.engine.url), mapper.local_table.name), None)
+
+
 def dbs():
     """
     实例 sessionmaker
@@ -35,10 +160,62 @@ class Model(Base):
     created_at = Column(TIMESTAMP, nullable=True, default=datetime.now, comment="创建日期")
     updated_at = Column(TIMESTAMP, nullable=True, default=datetime.now, onupdate=datetime.now, comment="更新日期")
 
+    @classmethod
+    def dict_accessors(cls) -> tuple:
+        """
+        to_dict 的取值信息 每个类计算一次(映射配置完成时) 缓存在类上
+        :return: ((字段名, 属性名), ...), (property 名, ...)
+        """
+        accessors = cls.__dict__.get("_dict_accessors", None)
+        if accessors is None:
+            from sqlalchemy import inspect
+            mapper = inspect(cls)
+            keys = {column: key for key, column in mapper.columns.items()}
+            columns = tuple((c.name, keys.get(c, c.name)) for c in cls.__table__.columns)
+            properties = tuple(name for name, obj in vars(cls).items() if isinstance(obj, property))
+            accessors = cls._dict_accessors = (columns, properties)
+        return accessors
+
     def to_dict(self):
         """
         ORM转dict
         :return:
         """
-        columns = [c.name for c in self.__table__.columns] + [name for name, obj in vars(self.__class__).items() if isinstance(obj, property)]
-        return {key: getattr(self, key, None) for key in columns}
+        columns, properties = self.dict_accessors()
+        data = {name: getattr(self, key, None) for name, key in columns}
+        data.update({name: getattr(self, name, None) for name in properties})
+        return data
+
+    @classmethod
+    def to_dicts(cls, rows: list, fields: Union[list, tuple, None] = None) -> list:
+        """
+        批量 ORM转dict 未加载(load_only/defer)的字段不输出 不触发懒加载, 已过期(提交后)的字段刷新
+        :param rows:
+        :param fields: 只输出的字段/属性
+        :return:
+        """
+        columns, properties = cls.dict_accessors()
+        if fields:
+            columns = tuple((name, key) for name, key in columns if name in fields)
+            properties = tuple(name for name in properties if name in fields)
+        items = []
+        for row in rows:
+            values = row.__dict__
+            state = values.get("_sa_instance_state", None)
+            expired = state.expired_attributes if state is not None else ()
+            item = {}
+            for name, key in columns:
+                if key in values:
+                    item[name] = values[key]
+                elif key in expired:
+                    item[name] = getattr(row, key, None)
+            for name in properties:
+                item[name] = getattr(row, name, None)
+            items.append(item)
+        return items
+
+
+@event.listens_for(Model, "mapper_configured", propagate=True)
+def _receive_mapper_configured(mapper, cls):
+    """映射配置完成 预先计算 to_dict 的取值信息"""
+    cls.dict_accessors()
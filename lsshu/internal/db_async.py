@@ -0,0 +1,58 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from config import DB_SQLALCHEMY_DATABASE_URL, DB_ENGINE_KWARGS, DB_SESSION_MAKER_KWARGS
+
+# 同步驱动 对应的 异步驱动
+ASYNC_DRIVERS: dict = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str):
+    """
+    同步数据库链接 转 异步数据库链接
+    :param url: sqlite:///db.sqlite3
+    :return: sqlite+aiosqlite:///db.sqlite3
+    """
+    _url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(_url.drivername, _url.drivername)
+    return str(_url.set(drivername=drivername))
+
+
+try:
+    from config import DB_SQLALCHEMY_ASYNC_DATABASE_URL
+except ImportError:
+    DB_SQLALCHEMY_ASYNC_DATABASE_URL = async_database_url(DB_SQLALCHEMY_DATABASE_URL)
+
+try:
+    from config import DB_ASYNC_ENGINE_KWARGS
+except ImportError:
+    DB_ASYNC_ENGINE_KWARGS = DB_ENGINE_KWARGS
+
+AsyncEngine = create_async_engine(
+    DB_SQLALCHEMY_ASYNC_DATABASE_URL,
+    **DB_ASYNC_ENGINE_KWARGS
+)
+
+# 异步会话不能在 commit 后隐式刷新过期属性 所以固定 expire_on_commit=False
+AsyncSessionLocal = sessionmaker(bind=AsyncEngine, class_=AsyncSession, **{**DB_SESSION_MAKER_KWARGS, "expire_on_commit": False})
+
+
+async def async_dbs():
+    """
+    实例 AsyncSession
+    :return:
+    """
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
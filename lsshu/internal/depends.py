@@ -13,14 +13,16 @@ from lsshu.oauth.user.crud import CRUDOAuthUser
 from lsshu.oauth.user.schema import SchemasOAuthUser, SchemasOAuthScopes
 
 
-def model_screen_params(page: Optional[int] = 1, limit: Optional[int] = 25, quest_data: Optional[str] = None):
+def model_screen_params(page: Optional[int] = 1, limit: Optional[int] = 25, quest_data: Optional[str] = None, with_total: Optional[bool] = True,
+                        cursor: Optional[str] = None, estimate_total: Optional[bool] = False, fields: Optional[str] = None, stream: Optional[bool] = False):
     """列表筛选参数"""
     order, where = [], []
     if bool(quest_data):
         quest_data = json.loads(quest_data) if quest_data else None
         [order.extend(list(s.items())) for s in quest_data['sort']] if 'sort' in quest_data else None
         where = [(w['key'], w['condition'], w['value']) for w in quest_data['where']] if 'where' in quest_data else None
-    return ModelScreenParams(page=page, limit=limit, order=order, where=where)
+    return ModelScreenParams(page=page, limit=limit, order=order, where=where, with_total=with_total, cursor=cursor,
+                             estimate_total=estimate_total, fields=fields.split(",") if fields else None, stream=stream)
 
 
 def model_post_screen_params(data: ModelScreenParams = None):
@@ -76,5 +78,5 @@ async def auth_user(auth: SchemasOAuthUser = Security(current_user_security, sco
     :param db:
     :return:
     """
-    user = CRUDOAuthUser.first(db=db, pk=auth.user_id)
+    user = await CRUDOAuthUser.threaded.first(db=db, pk=auth.user_id)
     return SchemasOAuthScopes(user=user, scopes=auth.scopes)
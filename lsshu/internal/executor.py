@@ -0,0 +1,170 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lsshu.internal.db import Engine
+
+try:
+    from config import DB_THREAD_POOL_SIZE
+except ImportError:
+    DB_THREAD_POOL_SIZE = 0
+
+
+def engine_pool_size(engine) -> int:
+    """
+    连接池可同时使用的连接数 pool_size + max_overflow; 不限制的连接池(NullPool 等) 为 None
+    :param engine:
+    :return:
+    """
+    pool = engine.pool
+    if not hasattr(pool, "size"):
+        return None
+    overflow = getattr(pool, "_max_overflow", 0)
+    return pool.size() + (overflow if overflow > 0 else 0)
+
+
+class DBExecutor(object):
+    """
+    数据库线程池 同步 CRUD 在 async 路由中执行时不阻塞事件循环
+    线程数 DB_THREAD_POOL_SIZE, 0 为 Engine 连接池大小(pool_size + max_overflow), 线程多于连接只会等待连接
+    """
+
+    def __init__(self, size: int = 0, engine=None):
+        self.size = size
+        self.engine = engine
+        self.pool = None
+        self.lock = threading.Lock()
+        self.stats_data = {"submitted": 0, "completed": 0, "failed": 0, "running": 0, "wait_ms": 0.0, "run_ms": 0.0, "max_wait_ms": 0.0}
+
+    @property
+    def max_workers(self) -> int:
+        """
+        线程数
+        :return:
+        """
+        return self.size or (engine_pool_size(self.engine) if self.engine is not None else None) or min(32, (os.cpu_count() or 1) + 4)
+
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        延迟创建线程池
+        :return:
+        """
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        return self.pool
+
+    def call(self, func, submitted: float):
+        """
+        线程中执行 统计等待与执行时间
+        :param func:
+        :param submitted:
+        :return:
+        """
+        started = time.perf_counter()
+        with self.lock:
+            self.stats_data["running"] += 1
+            self.stats_data["wait_ms"] += (started - submitted) * 1000
+            self.stats_data["max_wait_ms"] = max(self.stats_data["max_wait_ms"], (started - submitted) * 1000)
+        failed = True
+        try:
+            result = func()
+            failed = False
+            return result
+        finally:
+            with self.lock:
+                self.stats_data["running"] -= 1
+                self.stats_data["completed" if not failed else "failed"] += 1
+                self.stats_data["run_ms"] += (time.perf_counter() - started) * 1000
+
+    async def run(self, func, *args, **kwargs):
+        """
+        在线程池中执行 func(*args, **kwargs) 复制当前 contextvars (请求 SQL 统计等)
+        :param func:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        context = contextvars.copy_context()
+        with self.lock:
+            self.stats_data["submitted"] += 1
+        call = functools.partial(self.call, functools.partial(context.run, func, *args, **kwargs), time.perf_counter())
+        return await asyncio.get_running_loop().run_in_executor(self.executor(), call)
+
+    def stats(self) -> dict:
+        """
+        {"max_workers", "submitted", "completed", "failed", "running", "queued", "avg_wait_ms", "max_wait_ms", "avg_run_ms", "engine_pool"}
+        :return:
+        """
+        with self.lock:
+            data = dict(self.stats_data)
+        done = (data["completed"] + data["failed"]) or 1
+        return {
+            "max_workers": self.max_workers,
+            "submitted": data["submitted"],
+            "completed": data["completed"],
+            "failed": data["failed"],
+            "running": data["running"],
+            "queued": data["submitted"] - data["completed"] - data["failed"] - data["running"],
+            "avg_wait_ms": round(data["wait_ms"] / done, 3),
+            "max_wait_ms": round(data["max_wait_ms"], 3),
+            "avg_run_ms": round(data["run_ms"] / done, 3),
+            "engine_pool": self.engine.pool.status() if self.engine is not None else None,
+        }
+
+
+DB_EXECUTOR = DBExecutor(size=DB_THREAD_POOL_SIZE, engine=Engine)
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    在数据库线程池中执行同步函数 await run_db(func, *args, **kwargs)
+    :param func:
+    :param args:
+    :param kwargs:
+    :return:
+    """
+    return await DB_EXECUTOR.run(func, *args, **kwargs)
+
+
+def db_thread(func):
+    """
+    装饰器 同步函数 改为在数据库线程池中执行的协程
+    :param func:
+    :return:
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await DB_EXECUTOR.run(func, *args, **kwargs)
+
+    return wrapper
+
+
+class ThreadedCRUD(object):
+    """CRUD 方法 在数据库线程池中执行 await CRUD.threaded.first(db=db, pk=1)"""
+
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        method = getattr(self.target, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await DB_EXECUTOR.run(method, *args, **kwargs)
+
+        return call
+
+
+class ThreadedDescriptor(object):
+    """描述符 类或实例上访问 返回 ThreadedCRUD"""
+
+    def __get__(self, instance, owner):
+        return ThreadedCRUD(instance if instance is not None else owner)
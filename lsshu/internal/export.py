@@ -0,0 +1,126 @@
+from typing import List, Type
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from lsshu.internal.schema import ModelScreenParams, schemas_fields
+
+# 导出格式 => 媒体类型
+EXPORT_MEDIA_TYPES: dict = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_columns(crud, schema: Type[BaseModel], fields: List[str] = None) -> list:
+    """
+    导出的字段 响应模型字段中 模型的字段/属性, 关联不导出
+    :param crud:
+    :param schema:
+    :param fields:
+    :return: [(字段, 标题)]
+    """
+    model = crud.params_model
+    columns = model.__table__.columns
+    return [(name, (columns[name].comment if name in columns and columns[name].comment else name))
+            for name in schemas_fields(schema, fields) if name not in model.__mapper__.relationships and hasattr(model, name)]
+
+
+def export_value(value, dates: bool = False):
+    """
+    单元格的值
+    :param value:
+    :param dates: 保留日期类型 (xlsx)
+    :return:
+    """
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, "isoformat"):
+        if dates:
+            return value
+        return value.isoformat(sep=" ") if hasattr(value, "hour") and hasattr(value, "date") else value.isoformat()
+    return str(value)
+
+
+def export_rows(crud, db, params: ModelScreenParams, columns: list):
+    """
+    按筛选条件 分批读取 只加载导出的字段, 每批用 Model.to_dicts 转换 (未加载的字段不触发懒加载)
+    :param crud:
+    :param db:
+    :param params:
+    :param columns:
+    :return: 生成器 [原始值]
+    """
+    names = [name for name, _ in columns]
+    for rows in crud.chunks(db=db, screen_params=params, fields=names):
+        for item in crud.params_model.to_dicts(rows, fields=names):
+            yield [item.get(name, None) for name in names]
+
+
+def export_csv(rows, columns: list, chunk: int = 500):
+    """
+    csv 分块输出 带 BOM (Excel 识别 utf-8)
+    :param rows:
+    :param columns:
+    :param chunk: 每块行数
+    :return: 生成器 bytes
+    """
+    import csv
+    import io
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for _, title in columns])
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    buffer.seek(0), buffer.truncate()
+    for i, row in enumerate(rows, 1):
+        writer.writerow([export_value(value) for value in row])
+        if i % chunk == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0), buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def export_xlsx(rows, columns: list, chunk: int = 1024 * 64):
+    """
+    xlsx 只写模式 逐行写入临时文件 完成后分块输出 (xlsx 为 zip 需写完才能输出)
+    :param rows:
+    :param columns:
+    :param chunk: 每块字节
+    :return: 生成器 bytes
+    """
+    import tempfile
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([title for _, title in columns])
+    for row in rows:
+        sheet.append([export_value(value, dates=True) for value in row])
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while True:
+            data = file.read(chunk)
+            if not data:
+                break
+            yield data
+
+
+def export_response(crud, db, params: ModelScreenParams, schema: Type[BaseModel], filename: str, fmt: str = "xlsx") -> StreamingResponse:
+    """
+    导出 流式响应 使用当前筛选条件(不分页)
+    :param crud: CRUD 类
+    :param db:
+    :param params: 筛选参数
+    :param schema: 响应模型 决定导出的字段
+    :param filename: 文件名 不含扩展名
+    :param fmt: xlsx csv
+    :return:
+    """
+    from urllib.parse import quote
+    fmt = fmt if fmt in EXPORT_MEDIA_TYPES else "xlsx"
+    columns = export_columns(crud, schema, params.fields)
+    rows = export_rows(crud, db, params, columns)
+    content = export_csv(rows, columns) if fmt == "csv" else export_xlsx(rows, columns)
+    headers = {"Content-Disposition": "attachment; filename*=utf-8''%s.%s" % (quote(filename), fmt)}
+    return StreamingResponse(content, media_type=EXPORT_MEDIA_TYPES[fmt], headers=headers)
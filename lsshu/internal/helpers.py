@@ -5,10 +5,18 @@ def token_verify_password(plain_password: str, hashed_password: str):
     :param hashed_password: hash 密码
     :return: bool
     """
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+    return token_verify_password_and_update(plain_password=plain_password, hashed_password=hashed_password)[0]
 
-    return False if not hashed_password else pwd_context.verify(plain_password, hashed_password)
+
+def token_verify_password_and_update(plain_password: str, hashed_password: str):
+    """
+    验证 oauth token密码 bcrypt cost(OAUTH_BCRYPT_ROUNDS) 变更时 同时返回新的 hash 用于登录时重新加密
+    :param plain_password: 明文密码
+    :param hashed_password: hash 密码
+    :return: (bool, 新 hash 或 None)
+    """
+    from lsshu.internal.password import PASSWORD_HASHER
+    return PASSWORD_HASHER.verify_and_update(plain_password, hashed_password)
 
 
 def token_get_password_hash(password: str):
@@ -17,9 +25,18 @@ def token_get_password_hash(password: str):
     :param password: 加密密码
     :return: hash
     """
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
-    return pwd_context.hash(password)
+    from lsshu.internal.password import PASSWORD_HASHER
+    return PASSWORD_HASHER.hash(password)
+
+
+def token_get_password_hashes(passwords: list) -> list:
+    """
+    批量给 oauth user 加密 进程池并行
+    :param passwords: 加密密码
+    :return: 按顺序的 hash
+    """
+    from lsshu.internal.password import PASSWORD_HASHER
+    return PASSWORD_HASHER.hash_many(passwords)
 
 
 def token_access_token(data: dict, key: str, algorithm: str, expires_delta):
@@ -111,32 +128,26 @@ def checkPermissionOrStore(permissions: list, db=None, parent_pk: int = None):
     if not db:
         from lsshu.internal.db import SessionLocal
         db = SessionLocal()
+    # 同一层级 一次 upsert, 已存在的不更新
+    parents = CRUDOAuthPermission.upsert_many(db=db, keys="scope", update=False, items=[SchemasOAuthPermissionStoreUpdate(
+        name=permission.get('name'), scope=permission.get('scope'), parent_id=parent_pk, is_menu=permission.get('is_menu', True),
+        is_action=permission.get('is_action', True), icon=permission.get('icon', None)
+    ) for permission in permissions])
+    actions = []
     for permission in permissions:
         _scope = permission.get('scope')
         _name = permission.get('name')
-        _action = permission.get('action', [])
         _children = permission.get('children', None)
-        _is_menu = permission.get('is_menu', True)
-        _is_action = permission.get('is_action', True)
-        icon = permission.get('icon', None)
-        parent = CRUDOAuthPermission.find_or_store_model(
-            db=db, where=('scope', _scope), item=SchemasOAuthPermissionStoreUpdate(
-                name=_name, scope=_scope, parent_id=parent_pk, is_menu=_is_menu, is_action=_is_action, icon=icon
-            )
-        )
         if _children:
-            checkPermissionOrStore(_children, db=db, parent_pk=parent.id)
+            checkPermissionOrStore(_children, db=db, parent_pk=parents[_scope])
         else:
-            for action in (ACTION_ITEMS + _action):
-                scope = "%s.%s" % (_scope, action.get('scope'))
-                name = "%s %s" % (_name, action.get('name'))
-                is_menu = action.get('is_menu', False)
-                is_action = action.get('is_action', True)
-                CRUDOAuthPermission.find_or_store_model(
-                    db=db, where=('scope', scope), item=SchemasOAuthPermissionStoreUpdate(
-                        name=name, scope=scope, parent_id=parent.id, is_menu=is_menu, is_action=is_action
-                    )
-                )
+            for action in (ACTION_ITEMS + permission.get('action', [])):
+                actions.append(SchemasOAuthPermissionStoreUpdate(
+                    name="%s %s" % (_name, action.get('name')), scope="%s.%s" % (_scope, action.get('scope')), parent_id=parents[_scope],
+                    is_menu=action.get('is_menu', False), is_action=action.get('is_action', True)
+                ))
+    if actions:
+        CRUDOAuthPermission.upsert_many(db=db, keys="scope", update=False, items=actions)
 
 
 def init_user_and_password(users: dict):
@@ -148,5 +159,6 @@ def init_user_and_password(users: dict):
     from lsshu.oauth.user.crud import CRUDOAuthUser, SchemasOAuthUserStoreUpdate
     from lsshu.internal.db import SessionLocal
     db = SessionLocal()
-    return [CRUDOAuthUser.update_or_store_model(db=db, where=('username', username), item=SchemasOAuthUserStoreUpdate(username=username, password=password))
-            for username, password in users.items()]
+    CRUDOAuthUser.upsert_many(db=db, keys="username", items=[SchemasOAuthUserStoreUpdate(username=username, password=password)
+                                                             for username, password in users.items()])
+    return CRUDOAuthUser.all(db=db, where=("username", "in_", list(users)))
@@ -23,6 +23,7 @@ class _ModelOAuthRoles(Model, BaseNestedSets):
 class _ModelOAuthPermissions(Model, BaseNestedSets):
     """ 权限 """
     __abstract__ = True
+    __searchable__ = ("name", "scope")  # 全文搜索字段 where ('name', 'match', '关键词')
     name = Column(String(15), nullable=False, comment="名称")
     icon = Column(String(20), nullable=True, comment="ICO")
     scope = Column(String(50), nullable=False, unique=True, comment="Scope")
@@ -34,6 +35,7 @@ class _ModelOAuthPermissions(Model, BaseNestedSets):
 class _ModelOAuthAnnexes(Model):
     """ 附件 """
     __abstract__ = True
+    __searchable__ = ("filename",)  # 全文搜索字段
     filename = Column(String(50), nullable=False, comment="文件名")
     content_type = Column(String(100), nullable=False, comment="类型")
     path = Column(String(100), nullable=True, comment="路径")
@@ -0,0 +1,177 @@
+import atexit
+import functools
+import os
+import threading
+
+try:
+    from config import OAUTH_BCRYPT_ROUNDS
+except ImportError:
+    OAUTH_BCRYPT_ROUNDS = 12
+
+try:
+    from config import OAUTH_PASSWORD_WORKERS
+except ImportError:
+    OAUTH_PASSWORD_WORKERS = 0
+
+try:
+    from config import OAUTH_PASSWORD_CONCURRENCY
+except ImportError:
+    OAUTH_PASSWORD_CONCURRENCY = 0
+
+
+@functools.lru_cache(maxsize=None)
+def password_context(rounds: int = OAUTH_BCRYPT_ROUNDS):
+    """
+    密码加密上下文 每个进程按 rounds 只创建一次
+    :param rounds: bcrypt cost
+    :return: CryptContext
+    """
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=rounds)
+
+
+def password_hash(password: str, rounds: int = OAUTH_BCRYPT_ROUNDS) -> str:
+    """
+    加密 (在进程池中执行)
+    :param password:
+    :param rounds:
+    :return:
+    """
+    return password_context(rounds).hash(password)
+
+
+def password_verify_and_update(plain_password: str, hashed_password: str, rounds: int = OAUTH_BCRYPT_ROUNDS) -> tuple:
+    """
+    验证 hash 的 cost 与当前配置不一致时 同时返回新的 hash (在进程池中执行)
+    :param plain_password:
+    :param hashed_password:
+    :param rounds:
+    :return: (是否通过, 新 hash 或 None)
+    """
+    return password_context(rounds).verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher(object):
+    """
+    bcrypt 加密/验证 在进程池中执行 不占用 GIL 与事件循环;
+    进程数 OAUTH_PASSWORD_WORKERS (0 为 CPU 核数), 同时进行的 加密/验证 不超过 OAUTH_PASSWORD_CONCURRENCY (0 为进程数的 2 倍) 超出的等待
+    """
+
+    def __init__(self, workers: int = 0, concurrency: int = 0, rounds: int = 12):
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = concurrency or self.workers * 2
+        self.rounds = rounds
+        self.semaphore = threading.BoundedSemaphore(self.concurrency)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def executor(self):
+        """
+        延迟创建进程池 使用 forkserver(不支持时 spawn) 启动子进程: 服务进程中已有线程(线程池/事件循环/连接池锁), fork 不安全;
+        子进程会重新导入入口模块 直接运行的脚本需要 if __name__ == '__main__' 保护
+        :return:
+        """
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        return self.pool
+
+    def submit(self, func, *args):
+        """
+        提交到进程池 并等待结果; 进程池损坏时 重建后重试一次
+        :param func:
+        :param args:
+        :return:
+        """
+        return self.submit_many(func, [args])[0]
+
+    def submit_many(self, func, args_list: list) -> list:
+        """
+        批量提交到进程池 全部提交后再等待结果, 进程池中的进程并行执行; 进程池损坏时 重建后重试一次
+        :param func:
+        :param args_list: [(参数, ...)]
+        :return: 按顺序的结果
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        pool = self.executor()
+        try:
+            return self.gather(pool, func, args_list)
+        except BrokenProcessPool:
+            self.discard(pool)
+            return self.gather(self.executor(), func, args_list)
+
+    def gather(self, pool, func, args_list: list) -> list:
+        """
+        逐个提交 同时进行的不超过 concurrency, 完成后释放
+        :param pool:
+        :param func:
+        :param args_list:
+        :return:
+        """
+        futures = []
+        for args in args_list:
+            self.semaphore.acquire()
+            try:
+                future = pool.submit(func, *args)
+            except BaseException:
+                self.semaphore.release()
+                raise
+            future.add_done_callback(lambda _: self.semaphore.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def discard(self, pool):
+        """
+        关闭损坏的进程池 下次使用时重建
+        :param pool:
+        :return:
+        """
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password: str) -> str:
+        """
+        加密
+        :param password:
+        :return:
+        """
+        return self.submit(password_hash, password, self.rounds)
+
+    def hash_many(self, passwords: list) -> list:
+        """
+        批量加密 全部提交到进程池后再取结果
+        :param passwords:
+        :return: 按顺序的 hash
+        """
+        return self.submit_many(password_hash, [(password, self.rounds) for password in passwords])
+
+    def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple:
+        """
+        验证 cost 变更时返回新的 hash
+        :param plain_password:
+        :param hashed_password:
+        :return: (是否通过, 新 hash 或 None)
+        """
+        if not hashed_password:
+            return False, None
+        return self.submit(password_verify_and_update, plain_password, hashed_password, self.rounds)
+
+    def shutdown(self):
+        """
+        关闭进程池
+        :return:
+        """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+PASSWORD_HASHER = PasswordHasher(workers=OAUTH_PASSWORD_WORKERS, concurrency=OAUTH_PASSWORD_CONCURRENCY, rounds=OAUTH_BCRYPT_ROUNDS)
+atexit.register(PASSWORD_HASHER.shutdown)
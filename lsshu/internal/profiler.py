@@ -0,0 +1,364 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from typing import Union
+
+from sqlalchemy import event
+
+from lsshu.internal.db import Engine, ReplicaEngines
+
+try:
+    from config import DB_QUERY_BUDGET
+except ImportError:
+    DB_QUERY_BUDGET = 0
+
+try:
+    from config import DB_QUERY_BUDGET_STRICT
+except ImportError:
+    DB_QUERY_BUDGET_STRICT = False
+
+try:
+    from config import DB_QUERY_REPEAT
+except ImportError:
+    DB_QUERY_REPEAT = 5
+
+try:
+    from config import DB_SLOW_QUERY_MS
+except ImportError:
+    DB_SLOW_QUERY_MS = 0
+
+try:
+    from config import DB_SLOW_QUERY_SIZE
+except ImportError:
+    DB_SLOW_QUERY_SIZE = 200
+
+try:
+    from config import DB_SLOW_QUERY_EXPLAIN
+except ImportError:
+    DB_SLOW_QUERY_EXPLAIN = True
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的 SQL 统计 由 SQLProfilerMiddleware 设置
+REQUEST_STATS: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """请求 SQL 条数超过预算 (严格模式)"""
+
+
+class RequestStats(object):
+    """单个请求的 SQL 统计"""
+
+    def __init__(self, budget: int = DB_QUERY_BUDGET, scope: dict = None):
+        self.budget = budget
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = (0.0, None)
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def record(self, statement: str, duration: float):
+        """
+        记录一条语句
+        :param statement:
+        :param duration: 秒
+        :return:
+        """
+        with self.lock:
+            self.duration += duration
+            self.shapes[statement] = self.shapes.get(statement, 0) + 1
+            if duration > self.slowest[0]:
+                self.slowest = (duration, statement)
+
+    def repeated(self) -> dict:
+        """
+        重复执行的相同语句 (N+1)
+        :return: {语句: 次数}
+        """
+        return {statement: count for statement, count in self.shapes.items() if count >= DB_QUERY_REPEAT} if DB_QUERY_REPEAT else {}
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing 响应头
+        :return:
+        """
+        return 'db;dur=%.2f;desc="%d queries"' % (self.duration * 1000, self.count)
+
+
+class RouteStats(object):
+    """按路由汇总的 SQL 统计"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def add(self, route: str, stats: RequestStats):
+        """
+        汇总一个请求
+        :param route:
+        :param stats:
+        :return:
+        """
+        repeated = stats.repeated()
+        with self.lock:
+            item = self.data.setdefault(route, {"requests": 0, "queries": 0, "max_queries": 0, "time_ms": 0.0, "max_time_ms": 0.0,
+                                                "slowest_ms": 0.0, "slowest": None, "over_budget": 0, "repeated": {}})
+            item["requests"] += 1
+            item["queries"] += stats.count
+            item["max_queries"] = max(item["max_queries"], stats.count)
+            item["time_ms"] += stats.duration * 1000
+            item["max_time_ms"] = max(item["max_time_ms"], stats.duration * 1000)
+            if stats.slowest[0] * 1000 > item["slowest_ms"]:
+                item["slowest_ms"], item["slowest"] = stats.slowest[0] * 1000, stats.slowest[1]
+            if stats.budget and stats.count > stats.budget:
+                item["over_budget"] += 1
+            for statement, count in repeated.items():
+                item["repeated"][statement] = max(item["repeated"].get(statement, 0), count)
+
+    def stats(self) -> dict:
+        """
+        {路由: {"requests", "avg_queries", "max_queries", "avg_time_ms", "max_time_ms", "slowest", "over_budget", "repeated"}}
+        :return:
+        """
+        with self.lock:
+            return {route: {
+                "requests": item["requests"],
+                "avg_queries": round(item["queries"] / item["requests"], 2),
+                "max_queries": item["max_queries"],
+                "avg_time_ms": round(item["time_ms"] / item["requests"], 3),
+                "max_time_ms": round(item["max_time_ms"], 3),
+                "slowest": {"ms": round(item["slowest_ms"], 3), "sql": item["slowest"]},
+                "over_budget": item["over_budget"],
+                "repeated": dict(item["repeated"]),
+            } for route, item in self.data.items()}
+
+    def clear(self):
+        """
+        清空
+        :return:
+        """
+        with self.lock:
+            self.data.clear()
+
+
+ROUTE_STATS = RouteStats()
+
+
+def parameters_shape(parameters):
+    """
+    绑定参数的形状 只保留类型 不记录值
+    :param parameters:
+    :return: {"name": "str"} / ["int", "str"]
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return {"executemany": len(parameters), "row": parameters_shape(parameters[0])}
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def explain(conn, statement: str, parameters) -> list:
+    """
+    执行计划 sqlite EXPLAIN QUERY PLAN, 其它 EXPLAIN; 使用原始连接 不触发事件 只解释 SELECT
+    :param conn:
+    :param statement:
+    :param parameters:
+    :return: [行]
+    """
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [" | ".join(str(value) for value in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return ["EXPLAIN failed: %s" % e]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog(object):
+    """慢查询 环形缓冲 保留最近 maxlen 条"""
+
+    def __init__(self, maxlen: int = 200):
+        import collections
+        self.data = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    def add(self, conn, statement: str, parameters, context, duration: float):
+        """
+        记录慢查询
+        :param conn:
+        :param statement:
+        :param parameters:
+        :param context:
+        :param duration: 秒
+        :return:
+        """
+        stats = REQUEST_STATS.get()
+        executemany = bool(context is not None and context.executemany)
+        # 服务端游标(stream_results/yield_per) 结果尚未读完 同一连接上再执行 EXPLAIN 会打断结果 (mysql SSCursor)
+        streaming = bool(context is not None and context.execution_options.get("stream_results", False))
+        item = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "ms": round(duration * 1000, 3),
+            "sql": statement,
+            "parameters": parameters_shape(parameters),
+            "route": route_name(stats.scope) if stats is not None and stats.scope is not None else None,
+            "crud": context.execution_options.get("crud", None) if context is not None else None,
+            "explain": explain(conn, statement, parameters) if DB_SLOW_QUERY_EXPLAIN and not executemany and not streaming else [],
+        }
+        with self.lock:
+            self.data.append(item)
+        logger.warning("slow query %.1fms %s [%s]: %s", item["ms"], item["route"], item["crud"], statement)
+
+    def items(self, limit: int = None) -> list:
+        """
+        最近的慢查询 新的在前
+        :param limit:
+        :return:
+        """
+        with self.lock:
+            items = list(reversed(self.data))
+        return items[:limit] if limit else items
+
+    def clear(self):
+        """
+        清空
+        :return:
+        """
+        with self.lock:
+            self.data.clear()
+
+
+SLOW_QUERY_LOG = SlowQueryLog(maxlen=DB_SLOW_QUERY_SIZE)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = REQUEST_STATS.get()
+    if stats is not None:
+        with stats.lock:
+            stats.count += 1
+            count = stats.count
+        if DB_QUERY_BUDGET_STRICT and stats.budget and count > stats.budget:
+            raise QueryBudgetExceeded("query budget %d exceeded: %s" % (stats.budget, statement))
+    elif not DB_SLOW_QUERY_MS:
+        return
+    conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not conn.info.get("profiler_start"):
+        return
+    duration = time.perf_counter() - conn.info["profiler_start"].pop()
+    stats = REQUEST_STATS.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    if DB_SLOW_QUERY_MS and duration * 1000 >= DB_SLOW_QUERY_MS:
+        SLOW_QUERY_LOG.add(conn, statement, parameters, context, duration)
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("profiler_start"):
+        context.connection.info["profiler_start"].pop()
+
+
+def instrument_engine(engine):
+    """
+    注册 SQL 统计事件 异步引擎传 AsyncEngine.sync_engine
+    :param engine:
+    :return:
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+instrument_engine(Engine)
+for _engine in ReplicaEngines:
+    instrument_engine(_engine)
+
+
+def query_budget(budget: int):
+    """
+    路由 SQL 条数预算 dependencies=[Depends(query_budget(10))]
+    :param budget:
+    :return:
+    """
+
+    def dependency():
+        stats = REQUEST_STATS.get()
+        if stats is not None:
+            stats.budget = budget
+
+    return dependency
+
+
+@functools.lru_cache(maxsize=1024)
+def route_path(app, endpoint, method: str) -> Union[str, None]:
+    """
+    路由的路径 按 (应用, 视图函数, 请求方法) 缓存
+    :param app:
+    :param endpoint:
+    :param method:
+    :return: /api/Oauth.users/{pk} 未找到为 None
+    """
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        if getattr(route, "endpoint", None) is endpoint and method in (getattr(route, "methods", None) or [method]):
+            return route.path
+    return None
+
+
+def route_name(scope: dict) -> str:
+    """
+    请求对应的路由 GET /api/Oauth.users/{pk}
+    :param scope:
+    :return:
+    """
+    endpoint, app = scope.get("endpoint", None), scope.get("app", None)
+    path = route_path(app, endpoint, scope["method"]) if endpoint is not None and app is not None else None
+    return "%s %s" % (scope["method"], path or scope["path"])
+
+
+class SQLProfilerMiddleware(object):
+    """
+    请求 SQL 统计 app.add_middleware(SQLProfilerMiddleware)
+    响应头 Server-Timing: db;dur=毫秒;desc="条数 queries", 按路由汇总到 ROUTE_STATS
+    超过 DB_QUERY_BUDGET 记录日志, DB_QUERY_BUDGET_STRICT 时超出的语句抛出 QueryBudgetExceeded
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope=scope)
+        token = REQUEST_STATS.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", stats.server_timing().encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_STATS.reset(token)
+            route = route_name(scope)
+            ROUTE_STATS.add(route, stats)
+            if stats.budget and stats.count > stats.budget:
+                logger.warning("%s ran %d queries (budget %d)", route, stats.count, stats.budget)
+            for statement, count in stats.repeated().items():
+                logger.warning("%s repeated %d times (N+1): %s", route, count, statement)
+
@@ -1,5 +1,9 @@
-import aioredis
 import pickle
+
+try:
+    import aioredis
+except (ImportError, TypeError):  # aioredis 2.0 在 python 3.11 导入失败, 使用 redis-py 自带的 asyncio 客户端
+    from redis import asyncio as aioredis
 from typing import Optional, Union, List, Tuple
 from fastapi import FastAPI
 
@@ -179,6 +183,68 @@ class Redis(object):
         await self.pool.disconnect()
 
 
+class RedisSync(object):
+    """
+    同步客户端 (redis-py) 供同步代码使用 如 BaseCRUD 结果缓存, 与 Redis 共用 REDIS_CONFIG 和键规则
+    """
+    key_prefix = None
+    redis = None
+
+    def __init__(self):
+        import redis
+        self.redis = redis.Redis.from_url(**REDIS_CONFIG)
+
+    def __key(self, key, _type):
+        """
+        前缀键
+        :param key:
+        :param _type:
+        :return:
+        """
+        return "%s-%s-%s" % (self.key_prefix, _type, key)
+
+    def string(self, key: str, value=None, ttl: int = None, default=None):
+        """
+        设置字符串 或者 获取字符串
+        :param key:
+        :param value:
+        :param ttl: 过期秒数
+        :param default:
+        :return:
+        """
+        if value is not None:
+            return self.redis.set(self.__key(key, "string"), value, ex=ttl or None)
+        value = self.redis.get(self.__key(key, "string"))
+        return default if value is None else value
+
+    def incr(self, *keys: str):
+        """
+        计数器自增 一次往返
+        :param keys:
+        :return:
+        """
+        pipeline = self.redis.pipeline(transaction=False)
+        [pipeline.incr(self.__key(key, "counter")) for key in keys]
+        return pipeline.execute()
+
+    def counters(self, *keys: str) -> tuple:
+        """
+        获取计数器 不存在为 0
+        :param keys:
+        :return:
+        """
+        return tuple(int(value or 0) for value in self.redis.mget([self.__key(key, "counter") for key in keys])) if keys else tuple()
+
+    def delete(self, key: str, _type: str = "string"):
+        """
+        删除键值
+        :param key:
+        :param _type:
+        :return:
+        """
+        return self.redis.delete(self.__key(key, _type))
+
+
 async def _redis():
     redis = Redis()
     try:
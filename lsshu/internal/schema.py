@@ -1,9 +1,17 @@
-from typing import Optional, Union
+import threading
+from typing import Optional, Union, Type, List
 
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from pydantic.utils import GetterDict
 
 from config import SCHEMAS_SUCCESS_CODE, SCHEMAS_SUCCESS_STATUS, SCHEMAS_SUCCESS_MESSAGE, SCHEMAS_ERROR_CODE, SCHEMAS_ERROR_STATUS, SCHEMAS_ERROR_MESSAGE
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class Schemas(BaseModel):
     """状态返回"""
@@ -26,13 +34,21 @@ class SchemasPaginate(BaseModel):
     items: Optional[list] = None  # 当前页的数据列表
     pages: Optional[int] = None  # 总页数
     total: Optional[int] = None  # 总条数
+    total_exact: Optional[bool] = None  # 总条数是否精确 False 为按表统计信息估算
     limit: Optional[int] = None  # 页条数
+    has_more: Optional[bool] = None  # 是否还有下一页
+    next_cursor: Optional[str] = None  # 下一页游标
 
 
 class ModelScreenParams(BaseModel):
     """获取列表默认参数"""
     page: Optional[int] = 1
     limit: Optional[int] = 25
+    with_total: Optional[bool] = True  # 是否统计总条数 无限滚动时可关闭
+    cursor: Optional[str] = None  # 游标分页 '' 为第一页 之后传 next_cursor
+    estimate_total: Optional[bool] = False  # 无筛选时 总条数按表统计信息估算
+    fields: Optional[list] = None  # 只返回的字段 ["id", "name"]
+    stream: Optional[bool] = False  # 流式返回全部数据(不分页) NDJSON 每行一条
     where: Optional[Union[dict, list]] = []
     join: Optional[Union[dict, list]] = []
     order: Optional[list] = []
@@ -43,3 +59,268 @@ class ModelScreenParamsForAll(BaseModel):
     where: Optional[Union[dict, list]] = []
     join: Optional[Union[dict, list]] = []
     order: Optional[list] = []
+
+
+class ModelGetterDict(GetterDict):
+    """
+    orm_mode 读取模型 未加载(load_only/defer)的字段 raiseload 的关联 视为未设置 不触发懒加载
+    """
+
+    def get(self, key, default=None):
+        from sqlalchemy import inspect
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm import ColumnProperty, RelationshipProperty
+        state = inspect(self._obj, raiseerr=False)
+        if state is not None and key in state.unloaded:
+            prop = state.mapper.attrs.get(key)
+            if isinstance(prop, ColumnProperty):
+                return default
+            if isinstance(prop, RelationshipProperty):
+                try:
+                    return getattr(self._obj, key, default)
+                except InvalidRequestError:
+                    return default
+        return getattr(self._obj, key, default)
+
+
+def schemas_fields(schema: Type[BaseModel], fields: List[str] = None) -> list:
+    """
+    响应模型字段 与 请求字段 的交集, 未请求时为响应模型全部字段
+    :param schema:
+    :param fields:
+    :return:
+    """
+    return [name for name in schema.__fields__ if not fields or name in fields]
+
+
+def schemas_data(data: BaseModel, fields: List[str] = None) -> Schemas:
+    """
+    成功返回 指定 fields 时只返回已设置的字段
+    :param data:
+    :param fields:
+    :return:
+    """
+    if not fields:
+        return Schemas(data=data)
+    # dict 会被 Schemas.data 校验为空的 BaseModel 这里跳过校验
+    return Schemas.construct(data=data.dict(exclude_unset=True))
+
+
+def schemas_rows_json(rows: list, schema: Type[BaseModel], fields: List[str] = None) -> list:
+    """
+    模型实例 按响应模型 序列化为 json (预编译的取值函数 不做 pydantic 校验)
+    :param rows:
+    :param schema:
+    :param fields: 指定时只输出已设置的字段
+    :return: [json bytes]
+    """
+    extract = schemas_extractor(schema, exclude_unset=bool(fields))
+    return [schemas_dumps(extract(row)) for row in rows]
+
+
+def schemas_ndjson(chunks, schema: Type[BaseModel], fields: List[str] = None):
+    """
+    NDJSON 流式响应 每行一条 按批输出
+    :param chunks: 分批的模型实例 CRUD.chunks()
+    :param schema: 响应模型
+    :param fields:
+    :return:
+    """
+    from fastapi.responses import StreamingResponse
+
+    def content():
+        for rows in chunks:
+            yield b"\n".join(schemas_rows_json(rows, schema, fields)) + b"\n"
+
+    return StreamingResponse(content(), media_type="application/x-ndjson")
+
+
+def schemas_stream(sections: dict, schema: Type[BaseModel]):
+    """
+    流式 json 响应 结构与 Schemas(data=schema(**data)) 相同, 列表按批输出
+    :param sections: {字段: 分批的模型实例 CRUD.chunks()}
+    :param schema: data 的模型 字段类型为 List[响应模型]
+    :return:
+    """
+    from fastapi.responses import StreamingResponse
+
+    def content():
+        yield b"{"
+        for i, (key, value) in enumerate(Schemas().dict().items()):
+            yield (b"," if i else b"") + schemas_dumps(key) + b":"
+            if key != "data":
+                yield schemas_dumps(value)
+                continue
+            yield b"{"
+            for j, (name, chunks) in enumerate(sections.items()):
+                yield (b"," if j else b"") + schemas_dumps(name) + b":["
+                first = True
+                for rows in chunks:
+                    if rows:
+                        yield (b"" if first else b",") + b",".join(schemas_rows_json(rows, schema.__fields__[name].type_))
+                        first = False
+                yield b"]"
+            yield b"}"
+        yield b"}"
+
+    return StreamingResponse(content(), media_type="application/json")
+
+
+# 取值缺失 (字典中没有 / 未加载的字段 / raiseload 的关联)
+_MISSING = object()
+
+# 按 (响应模型, exclude_unset) 预编译的取值函数 只登记构建完成的
+_EXTRACTORS: dict = {}
+# 构建中的取值函数 自引用的模型(树)可以取到; 只在 _EXTRACTORS_LOCK 内访问
+_EXTRACTORS_BUILDING: dict = {}
+_EXTRACTORS_LOCK = threading.RLock()
+
+
+def _json_default(value):
+    """
+    json 编码 非原生类型 与 pydantic json 一致
+    :param value:
+    :return:
+    """
+    from decimal import Decimal
+    from enum import Enum
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def schemas_dumps(content) -> bytes:
+    """
+    json 编码为 bytes 已安装 orjson 时使用 orjson
+    :param content:
+    :return:
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    import json
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def _attribute(obj, name: str):
+    """
+    模型实例取值 与 ModelGetterDict 一致: 未加载(load_only/defer)的字段 raiseload 的关联 视为缺失, 已过期的字段刷新
+    :param obj:
+    :param name:
+    :return:
+    """
+    values = obj.__dict__
+    if name in values:
+        return values[name]
+    state = values.get("_sa_instance_state", None)
+    if state is None:
+        return getattr(obj, name, _MISSING)
+    from sqlalchemy.exc import InvalidRequestError
+    from sqlalchemy.orm import ColumnProperty
+    prop = state.mapper.attrs.get(name)
+    if prop is None or name in state.expired_attributes:
+        return getattr(obj, name, _MISSING)
+    if isinstance(prop, ColumnProperty):
+        return _MISSING
+    try:
+        return getattr(obj, name)
+    except InvalidRequestError:
+        return _MISSING
+
+
+def _field_converter(field, exclude_unset: bool):
+    """
+    字段值的转换 嵌套模型使用其取值函数, 基础类型类型不一致时转换, 其它原样交给 json 编码
+    :param field: ModelField
+    :param exclude_unset:
+    :return:
+    """
+    from pydantic.fields import SHAPE_SINGLETON, SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_SET, SHAPE_TUPLE_ELLIPSIS
+    type_ = field.type_
+    if isinstance(type_, type) and issubclass(type_, BaseModel):
+        nested = schemas_extractor(type_, exclude_unset)
+        if field.shape == SHAPE_SINGLETON:
+            return nested
+        if field.shape in (SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_SET, SHAPE_TUPLE_ELLIPSIS):
+            return lambda value: [nested(v) for v in value]
+        return None
+    if field.shape == SHAPE_SINGLETON and type_ in (str, int, float, bool):
+        return lambda value: value if type(value) is type_ else type_(value)
+    return None
+
+
+def schemas_extractor(schema: Type[BaseModel], exclude_unset: bool = False):
+    """
+    响应模型的取值函数 预编译后缓存; 输入为 字典 / 模型实例 / BaseModel, 输出可直接 json 编码的 dict,
+    不做 pydantic 校验 (数据来自自己的模型, 类型已确定)
+    :param schema: 响应模型
+    :param exclude_unset: True 缺失的字段不输出(同 dict(exclude_unset=True)) False 使用默认值
+    :return: extract(obj) -> dict
+    """
+    key = (schema, exclude_unset)
+    extractor = _EXTRACTORS.get(key, None)
+    if extractor is not None:
+        return extractor
+    with _EXTRACTORS_LOCK:
+        extractor = _EXTRACTORS.get(key, None) or _EXTRACTORS_BUILDING.get(key, None)
+        if extractor is not None:
+            return extractor
+        outermost = not _EXTRACTORS_BUILDING
+        fields = []
+
+        def extract(obj):
+            data = {}
+            mapping = isinstance(obj, dict)
+            for name, field, convert in fields:
+                value = obj.get(name, _MISSING) if mapping else _attribute(obj, name)
+                if value is _MISSING:
+                    if exclude_unset:
+                        continue
+                    value = field.get_default()
+                elif value is not None and convert is not None:
+                    value = convert(value)
+                data[field.alias] = value
+            return data
+
+        _EXTRACTORS_BUILDING[key] = extract
+        try:
+            fields.extend((name, field, _field_converter(field, exclude_unset)) for name, field in schema.__fields__.items())
+            if outermost:
+                # 嵌套的取值函数 与最外层一起登记, 其它线程取到时 fields 都已完整
+                _EXTRACTORS.update(_EXTRACTORS_BUILDING)
+        finally:
+            if outermost:
+                _EXTRACTORS_BUILDING.clear()
+    return extract
+
+
+class SchemasJSONResponse(JSONResponse):
+    """json 响应 orjson 编码 (未安装时 json)"""
+
+    def render(self, content) -> bytes:
+        return schemas_dumps(content)
+
+
+def schemas_response(data, schema: Type[BaseModel] = None, fields: List[str] = None, **kwargs) -> SchemasJSONResponse:
+    """
+    成功返回 快速路径: 不经过 Schemas 校验 与 jsonable_encoder, 按响应模型直接从 模型实例/字典 取值编码
+    结构与 schemas_data(schema(**data), fields) 相同
+    :param data: 模型实例 / 字典 (如 CRUD.paginate() 的结果)
+    :param schema: 响应模型 None 时 data 原样编码
+    :param fields: 指定时只返回已设置的字段
+    :param kwargs: 覆盖 code/status/message
+    :return:
+    """
+    if schema is not None and data is not None:
+        data = schemas_extractor(schema, exclude_unset=bool(fields))(data)
+    envelope = {"code": SCHEMAS_SUCCESS_CODE, "status": SCHEMAS_SUCCESS_STATUS, "message": SCHEMAS_SUCCESS_MESSAGE, **kwargs, "data": data}
+    return SchemasJSONResponse(envelope)
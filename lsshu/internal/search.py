@@ -0,0 +1,180 @@
+from typing import Union
+
+from sqlalchemy import and_, or_, text, column, table, select, literal_column
+from sqlalchemy.engine import Connection
+
+try:
+    from config import DB_SEARCH_TOKENIZE
+except ImportError:
+    DB_SEARCH_TOKENIZE = None
+
+# where 中的全文搜索操作符 ('name', 'match', '关键词') / (['name','content'], 'search', '关键词')
+SEARCH_OPERATORS: tuple = ("match", "search")
+
+# 已确认存在全文索引的 (数据库链接, 表)
+_SEARCH_INDEXES: dict = {}
+
+
+def searchable_columns(model) -> tuple:
+    """
+    模型声明的可搜索字段 __searchable__ = ("name", "content")
+    :param model:
+    :return:
+    """
+    return tuple(getattr(model, "__searchable__", None) or ())
+
+
+def search_table_name(model) -> str:
+    """
+    sqlite FTS5 影子表名
+    :param model:
+    :return:
+    """
+    return "%s_fts" % model.__tablename__
+
+
+def search_tokenize() -> str:
+    """
+    sqlite FTS5 分词器 未配置时 支持 trigram (>=3.34, 中文子串匹配) 则使用 trigram 否则 unicode61
+    :return:
+    """
+    if DB_SEARCH_TOKENIZE:
+        return DB_SEARCH_TOKENIZE
+    import sqlite3
+    return "trigram" if sqlite3.sqlite_version_info >= (3, 34) else "unicode61"
+
+
+def search_ddl(model, dialect: str) -> list:
+    """
+    全文索引 DDL sqlite: FTS5 外部内容表 + 同步触发器 (Core 写入也同步); mysql: FULLTEXT ngram
+    :param model:
+    :param dialect:
+    :return: [语句]
+    """
+    columns = searchable_columns(model)
+    tablename, pk = model.__tablename__, model.__mapper__.primary_key[0].name
+    if dialect == "sqlite":
+        fts = search_table_name(model)
+        names = ", ".join('"%s"' % name for name in columns)
+        new = ", ".join('new."%s"' % name for name in columns)
+        old = ", ".join('old."%s"' % name for name in columns)
+        delete = 'INSERT INTO "{fts}"("{fts}", rowid, {names}) VALUES (\'delete\', old."{pk}", {old});'.format(fts=fts, names=names, pk=pk, old=old)
+        insert = 'INSERT INTO "{fts}"(rowid, {names}) VALUES (new."{pk}", {new});'.format(fts=fts, names=names, pk=pk, new=new)
+        return [
+            'CREATE VIRTUAL TABLE IF NOT EXISTS "{fts}" USING fts5({names}, content=\'{table}\', content_rowid=\'{pk}\', tokenize=\'{tokenize}\')'.format(
+                fts=fts, names=names, table=tablename, pk=pk, tokenize=search_tokenize()),
+            'CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{table}" BEGIN {insert} END'.format(fts=fts, table=tablename, insert=insert),
+            'CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{table}" BEGIN {delete} END'.format(fts=fts, table=tablename, delete=delete),
+            'CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE OF {names} ON "{table}" BEGIN {delete} {insert} END'.format(
+                fts=fts, names=names, table=tablename, delete=delete, insert=insert),
+        ]
+    if dialect == "mysql":
+        return ["ALTER TABLE `%s` ADD FULLTEXT INDEX `ft_%s` (%s) WITH PARSER ngram" % (tablename, tablename, ", ".join("`%s`" % name for name in columns))]
+    return []
+
+
+def search_index_exists(bind, model) -> bool:
+    """
+    是否已建立全文索引 结果按 (数据库链接, 表) 缓存
+    :param bind: Engine / Connection
+    :param model:
+    :return:
+    """
+    key = (str(bind.engine.url), model.__tablename__)
+    if key not in _SEARCH_INDEXES:
+        dialect = bind.dialect.name
+        if dialect == "sqlite":
+            sql, params = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name", {"name": search_table_name(model)}
+        elif dialect == "mysql":
+            sql, params = ("SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+                           "AND INDEX_NAME = :name AND INDEX_TYPE = 'FULLTEXT' LIMIT 1"), {"table": model.__tablename__, "name": "ft_%s" % model.__tablename__}
+        else:
+            return False
+        with bind.engine.connect() as connection:
+            _SEARCH_INDEXES[key] = bool(connection.execute(text(sql), params).scalar())
+    return _SEARCH_INDEXES[key]
+
+
+def create_search_index(bind, model, rebuild: bool = True) -> bool:
+    """
+    建立全文索引 (已有数据的表 需要调用一次 sqlite 会重建影子表内容)
+    :param bind: Engine / Connection
+    :param model:
+    :param rebuild:
+    :return: 是否已建立
+    """
+    dialect = bind.dialect.name
+    if not searchable_columns(model) or dialect not in ("sqlite", "mysql"):
+        return False
+    _SEARCH_INDEXES.pop((str(bind.engine.url), model.__tablename__), None)
+    if dialect == "mysql" and search_index_exists(bind, model):
+        return True
+
+    def execute(connection):
+        for ddl in search_ddl(model, dialect):
+            connection.execute(text(ddl))
+        if dialect == "sqlite" and rebuild:
+            fts = search_table_name(model)
+            connection.execute(text('INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')'.format(fts=fts)))
+
+    if isinstance(bind, Connection):  # create_all 建表事件中 使用同一连接
+        execute(bind)
+    else:
+        with bind.begin() as connection:
+            execute(connection)
+    _SEARCH_INDEXES[(str(bind.engine.url), model.__tablename__)] = True
+    return True
+
+
+def search_terms(value: Union[str, list, tuple, None]) -> list:
+    """
+    搜索词 按空白拆分 所有词都需要匹配
+    :param value:
+    :return:
+    """
+    if value is None:
+        return []
+    if type(value) in [list, tuple]:
+        value = " ".join(str(v) for v in value)
+    return [term for term in str(value).split() if term]
+
+
+def search_filter(db, model, key: Union[str, tuple], value):
+    """
+    全文搜索条件 sqlite: FTS5 MATCH (限定到所查字段); mysql: MATCH ... AGAINST (所查字段为全部可搜索字段时);
+    字段未声明为可搜索 / 未建立全文索引 / 其它数据库 回落为 ilike '%词%'
+    :param db: Session / AsyncSession
+    :param model:
+    :param key: 字段 或 多字段元组
+    :param value: 搜索词
+    :return:
+    """
+    names = key if type(key) is tuple else (key,)
+    terms = search_terms(value)
+    if not terms:
+        return None
+    bind = getattr(db, "sync_session", db).get_bind()
+    columns = searchable_columns(model)
+    like = terms
+    clauses = []
+    if set(names) <= set(columns) and bind.dialect.name in ("sqlite", "mysql") and search_index_exists(bind, model):
+        if bind.dialect.name == "sqlite":
+            # trigram 分词 少于 3 个字符的词无法匹配 仍用 like
+            short = search_tokenize() == "trigram"
+            match = [term for term in terms if not short or len(term) >= 3]
+            like = [term for term in terms if term not in match]
+            if match:
+                fts = search_table_name(model)
+                query = " AND ".join('"%s"' % term.replace('"', '""') for term in match)
+                query = "{%s} : (%s)" % (" ".join(names), query) if set(names) != set(columns) else query
+                clauses.append(getattr(model, model.__mapper__.primary_key[0].key).in_(
+                    select(literal_column("rowid")).select_from(table(fts)).where(column(fts).op("MATCH")(query))))
+        elif set(names) == set(columns):
+            # FULLTEXT 索引建在全部可搜索字段上 MATCH 只能用同一组字段; 只搜部分字段时 用 like 保持与 sqlite 相同语义
+            from sqlalchemy.dialects.mysql import match
+            query = " ".join('+"%s"' % term.replace('"', '') for term in terms)
+            clauses.append(match(*[getattr(model, name) for name in columns], against=query).in_boolean_mode())
+            like = []
+    for term in like:
+        clauses.append(or_(*[getattr(model, name).ilike("%" + term + "%") for name in names]))
+    return and_(*clauses)
@@ -5,3 +5,6 @@ from lsshu.internal.crud import BaseCRUD
 class CRUD(BaseCRUD):
     """表操作"""
     params_model = Models
+    params_fields_depends = {
+        "preview_path": ["path"]
+    }
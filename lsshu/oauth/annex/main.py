@@ -1,11 +1,12 @@
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Security, UploadFile, File
 from sqlalchemy.orm import Session
 
 from lsshu.internal.db import dbs
 from lsshu.internal.depends import model_screen_params, model_post_screen_params, auth_user
-from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError
+from lsshu.internal.export import export_response
+from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError, schemas_fields, schemas_ndjson, schemas_response
 from lsshu.oauth.user.schema import SchemasOAuthScopes
 
 from lsshu.oauth.annex.crud import CRUD
@@ -25,8 +26,10 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUD.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUD.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasResponse, params.fields)), SchemasResponse, params.fields)
+    db_model_list = await CRUD.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasResponse, params.fields))
+    return schemas_response(db_model_list, SchemasPaginateItem, params.fields)
 
 
 @router.post('/{}.post'.format(name), name="get {}".format(name))
@@ -38,8 +41,30 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUD.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUD.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasResponse, params.fields)), SchemasResponse, params.fields)
+    db_model_list = await CRUD.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasResponse, params.fields))
+    return schemas_response(db_model_list, SchemasPaginateItem, params.fields)
+
+
+@router.get('/{}.download'.format(name), name="download {}".format(name))
+async def download_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params),
+                          auth: SchemasOAuthScopes = Security(auth_user, scopes=scopes + ["%s.download" % name])):
+    """
+    导出附件 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUD, db=db, params=params, schema=SchemasResponse, filename=name, fmt=fmt)
+
+
+@router.post('/{}.download.post'.format(name), name="download {}".format(name))
+async def download_post_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_post_screen_params),
+                               auth: SchemasOAuthScopes = Security(auth_user, scopes=scopes + ["%s.download" % name])):
+    """
+    导出附件 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUD, db=db, params=params, schema=SchemasResponse, filename=name, fmt=fmt)
 
 
 @router.get('/{}.params'.format(name), name="get {}".format(name))
@@ -62,10 +87,10 @@ async def get_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthScope
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    return Schemas(data=SchemasResponse(**db_model.to_dict()))
+    return schemas_response(db_model.to_dict(), SchemasResponse)
 
 
 @router.post('/{}'.format(name), name="get {}".format(name))
@@ -84,7 +109,7 @@ async def store_model(file: UploadFile = File(...), db: Session = Depends(dbs),
     md5 = md5_bytes(content)
     size = len(content)
 
-    db_model = CRUD.first(db=db, where=("md5", md5))
+    db_model = await CRUD.threaded.first(db=db, where=("md5", md5))
     if not db_model:
         path = os.path.join(UPLOAD_DIR, os.path.split(file.content_type)[0], "{}{}".format(md5, os.path.splitext(file.filename)[-1]))
         bool_res = write_file(path, content)
@@ -95,9 +120,9 @@ async def store_model(file: UploadFile = File(...), db: Session = Depends(dbs),
                 width, height = img.size
             except:
                 width, height = (0, 0)
-            db_model = CRUD.store(db=db,
+            db_model = await CRUD.threaded.store(db=db,
                                   item=SchemasStoreUpdate(filename=file.filename, content_type=file.content_type, md5=md5, path=path, size=size, width=width, height=height))
-    return Schemas(data=SchemasResponse(**db_model.to_dict()))
+    return schemas_response(db_model.to_dict(), SchemasResponse)
 
 
 @router.put("/{}/{{pk}}".format(name), name="update {}".format(name))
@@ -110,11 +135,11 @@ async def update_put_model(pk: int, item: SchemasStoreUpdate, db: Session = Depe
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUD.update(db=db, pk=pk, item=item)
-    return Schemas(data=SchemasResponse(**bool_model.to_dict()))
+    bool_model = await CRUD.threaded.update(db=db, pk=pk, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasResponse)
 
 
 @router.patch("/{}/{{pk}}".format(name), name="update {}".format(name))
@@ -127,11 +152,11 @@ async def update_patch_model(pk: int, item: SchemasStoreUpdate, db: Session = De
     :param auth:
     :return:
     """
-    db_model = CRUD.first(db=db, pk=pk)
+    db_model = await CRUD.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUD.update(db=db, pk=pk, item=item, exclude_unset=True)
-    return Schemas(data=SchemasResponse(**bool_model.to_dict()))
+    bool_model = await CRUD.threaded.update(db=db, pk=pk, item=item, exclude_unset=True)
+    return schemas_response(bool_model.to_dict(), SchemasResponse)
 
 
 @router.delete("/{}/{{pk}}".format(name), name="delete {}".format(name))
@@ -142,7 +167,7 @@ async def delete_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthSc
     :param auth:
     :return:
     """
-    bool_model = CRUD.delete(db=db, pk=pk)
+    bool_model = await CRUD.threaded.delete(db=db, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -154,5 +179,5 @@ async def delete_models(pks: List[int], db: Session = Depends(dbs), auth: Schema
     :param auth:
     :return:
     """
-    bool_model = CRUD.delete(db=db, pks=pks)
+    bool_model = await CRUD.threaded.delete(db=db, pks=pks)
     return Schemas(data=bool_model)
@@ -3,7 +3,7 @@ from typing import Optional, List
 
 from pydantic import BaseModel
 
-from lsshu.internal.schema import SchemasPaginate
+from lsshu.internal.schema import SchemasPaginate, ModelGetterDict
 
 
 class SchemasResponse(BaseModel):
@@ -15,6 +15,7 @@ class SchemasResponse(BaseModel):
 
     class Config:
         orm_mode = True
+        getter_dict = ModelGetterDict
 
 
 class SchemasStoreUpdate(BaseModel):
@@ -0,0 +1,67 @@
+from typing import Optional
+
+from fastapi import APIRouter, Security, HTTPException, status
+
+from config import OAUTH_ADMIN_USERS
+from lsshu.internal.advisor import INDEX_ADVISOR
+from lsshu.internal.db import Engine
+from lsshu.internal.depends import auth_user
+from lsshu.internal.executor import DB_EXECUTOR
+from lsshu.internal.profiler import ROUTE_STATS, SLOW_QUERY_LOG
+from lsshu.internal.schema import Schemas
+from lsshu.oauth.user.schema import SchemasOAuthScopes
+
+router = APIRouter(tags=['Internal'])
+
+
+@router.get("/internal.sql.stats", name="get internal.sql.stats")
+async def get_sql_stats(auth: SchemasOAuthScopes = Security(auth_user)):
+    """
+    按路由的 SQL 统计 仅超级管理员
+    """
+    if auth.user.username not in OAUTH_ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return Schemas.construct(data=ROUTE_STATS.stats())  # dict 跳过校验 见 schemas_data
+
+
+@router.get("/internal.db.executor", name="get internal.db.executor")
+async def get_db_executor(auth: SchemasOAuthScopes = Security(auth_user)):
+    """
+    数据库线程池 与 连接池 状态 仅超级管理员
+    """
+    if auth.user.username not in OAUTH_ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return Schemas.construct(data=DB_EXECUTOR.stats())
+
+
+@router.get("/internal.sql.slow", name="get internal.sql.slow")
+async def get_sql_slow(limit: Optional[int] = 50, auth: SchemasOAuthScopes = Security(auth_user)):
+    """
+    最近的慢查询 含执行计划 仅超级管理员
+    - **limit**: 条数
+    """
+    if auth.user.username not in OAUTH_ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return Schemas(data=SLOW_QUERY_LOG.items(limit=limit))
+
+
+@router.get("/internal.index.advice", name="get internal.index.advice")
+async def get_index_advice(min_uses: Optional[int] = 1, auth: SchemasOAuthScopes = Security(auth_user)):
+    """
+    按实际查询形状的 复合索引建议 需开启 DB_INDEX_ADVISOR 仅超级管理员
+    - **min_uses**: 最少使用次数
+    """
+    if auth.user.username not in OAUTH_ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return Schemas.construct(data={"advice": INDEX_ADVISOR.advice(Engine, min_uses=min_uses), "shapes": INDEX_ADVISOR.shapes()})
+
+
+@router.post("/internal.index.advice", name="post internal.index.advice")
+def create_index_advice(min_uses: Optional[int] = 1, auth: SchemasOAuthScopes = Security(auth_user)):
+    """
+    按建议在线建立索引 仅超级管理员
+    - **min_uses**: 最少使用次数
+    """
+    if auth.user.username not in OAUTH_ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return Schemas(data=INDEX_ADVISOR.create(Engine, min_uses=min_uses))
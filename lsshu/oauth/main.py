@@ -4,6 +4,7 @@ from lsshu.oauth.user.main import router as router_user
 from lsshu.oauth.role.main import router as router_role
 from lsshu.oauth.permission.main import router as router_permission
 from lsshu.oauth.annex.main import router as router_annex
+from lsshu.oauth.internal.main import router as router_internal
 
 from config import OAUTH_OAUTH_ROUTER
 
@@ -13,3 +14,4 @@ router.include_router(router_user)
 router.include_router(router_role)
 router.include_router(router_permission)
 router.include_router(router_annex)
+router.include_router(router_internal)
@@ -52,7 +52,7 @@ class ModelOAuthUsers(_ModelOAuthUsers):
 class ModelOAuthRoles(_ModelOAuthRoles):
     """角色"""
     __tablename__ = role_table_name
-    permissions = relationship('ModelOAuthPermissions', backref='roles', lazy="joined", secondary=Table(
+    permissions = relationship('ModelOAuthPermissions', backref='roles', secondary=Table(
         "%s_role_has_permissions" % _table_name,
         Model.metadata,
         Column('per_id', Integer, ForeignKey("%s.id" % permission_table_name), primary_key=True, comment="权限"),
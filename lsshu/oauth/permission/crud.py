@@ -1,7 +1,21 @@
-from lsshu.internal.crud import CRUDTree
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from lsshu.internal.crud import CRUDTree, hybridmethod
 from lsshu.oauth.model import ModelOAuthPermissions
+from lsshu.oauth.permission.schema import SchemasOAuthPermissionStoreUpdate
 
 
 class CRUDOAuthPermission(CRUDTree):
     """权限表操作"""
     params_model = ModelOAuthPermissions
+    params_result_cache_ttl = 300  # 开启 DB_RESULT_CACHE 时生效
+
+    @hybridmethod
+    def upsert_many(self, db: Session, items: List[SchemasOAuthPermissionStoreUpdate], **kwargs):
+        # 原生 upsert 不触发 scope 的 set 事件 path 在这里生成
+        for item in items:
+            if item.scope:
+                item.path = "/%s" % item.scope.replace('.', '/').lower()
+        return super().upsert_many(db=db, items=items, **kwargs)
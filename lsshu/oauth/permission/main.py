@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Security
 from sqlalchemy.orm import Session
@@ -6,7 +6,8 @@ from sqlalchemy.orm import Session
 from config import OAUTH_DEFAULT_TAGS
 from lsshu.internal.db import dbs
 from lsshu.internal.depends import model_screen_params, model_post_screen_params, auth_user
-from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError
+from lsshu.internal.export import export_response
+from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError, schemas_fields, schemas_ndjson, schemas_response
 from lsshu.oauth.model import permission_name
 from lsshu.oauth.permission.crud import CRUDOAuthPermission
 from lsshu.oauth.permission.schema import SchemasOAuthPermissionPaginateItem, SchemasOAuthPermissionTreeStatusResponse, SchemasOAuthPermissionResponse, \
@@ -27,8 +28,10 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUDOAuthPermission.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasOAuthPermissionPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthPermission.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthPermissionResponse, params.fields)), SchemasOAuthPermissionResponse, params.fields)
+    db_model_list = await CRUDOAuthPermission.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthPermissionResponse, params.fields))
+    return schemas_response(db_model_list, SchemasOAuthPermissionPaginateItem, params.fields)
 
 
 @router.post('/{}.post'.format(permission_name), name="post {}".format(permission_name))
@@ -40,8 +43,30 @@ async def post_models(db: Session = Depends(dbs), params: ModelScreenParams = De
     :param auth:
     :return:
     """
-    db_model_list = CRUDOAuthPermission.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasOAuthPermissionPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthPermission.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthPermissionResponse, params.fields)), SchemasOAuthPermissionResponse, params.fields)
+    db_model_list = await CRUDOAuthPermission.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthPermissionResponse, params.fields))
+    return schemas_response(db_model_list, SchemasOAuthPermissionPaginateItem, params.fields)
+
+
+@router.get('/{}.download'.format(permission_name), name="download {}".format(permission_name))
+async def download_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params),
+                          auth: SchemasOAuthScopes = Security(auth_user, scopes=permission_scopes + ["%s.download" % permission_name])):
+    """
+    导出权限 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthPermission, db=db, params=params, schema=SchemasOAuthPermissionResponse, filename=permission_name, fmt=fmt)
+
+
+@router.post('/{}.download.post'.format(permission_name), name="download {}".format(permission_name))
+async def download_post_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_post_screen_params),
+                               auth: SchemasOAuthScopes = Security(auth_user, scopes=permission_scopes + ["%s.download" % permission_name])):
+    """
+    导出权限 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthPermission, db=db, params=params, schema=SchemasOAuthPermissionResponse, filename=permission_name, fmt=fmt)
 
 
 @router.get('/{}.params'.format(permission_name), name="get {}".format(permission_name))
@@ -65,7 +90,7 @@ async def tree_models(db: Session = Depends(dbs), auth: SchemasOAuthScopes = Sec
     def json_fields(node):
         return node.to_dict()
 
-    db_model_list = CRUDOAuthPermission.get_tree(db=db, json=True, json_fields=json_fields)
+    db_model_list = await CRUDOAuthPermission.threaded.get_tree(db=db, json=True, json_fields=json_fields)
     return SchemasOAuthPermissionTreeStatusResponse(data=db_model_list)
 
 
@@ -80,7 +105,7 @@ async def tree_models(db: Session = Depends(dbs), auth: SchemasOAuthScopes = Sec
     def json_fields(node):
         return node.to_dict()
 
-    db_model_list = CRUDOAuthPermission.get_tree(db=db, json=True, json_fields=json_fields)
+    db_model_list = await CRUDOAuthPermission.threaded.get_tree(db=db, json=True, json_fields=json_fields)
 
     def _response(model: dict):
         children = model.get('children', None)
@@ -107,7 +132,7 @@ async def menus_permission_models(db: Session = Depends(dbs), auth: SchemasOAuth
         return SchemasOAuthPermissionMenu(**node.to_dict()).dict()
         # return node.to_dict()
 
-    db_model_list = CRUDOAuthPermission.get_tree(db=db, json=True, json_fields=json_fields, query=query_fun)
+    db_model_list = await CRUDOAuthPermission.threaded.get_tree(db=db, json=True, json_fields=json_fields, query=query_fun)
     return Schemas(data=db_model_list)
 
 
@@ -126,7 +151,7 @@ async def menus_permission_models(db: Session = Depends(dbs), auth: SchemasOAuth
         return SchemasOAuthPermissionMenu(**node.to_dict()).dict()
         # return node.to_dict()
 
-    db_model_list = CRUDOAuthPermission.get_tree(db=db, json=True, json_fields=json_fields, query=query_fun)
+    db_model_list = await CRUDOAuthPermission.threaded.get_tree(db=db, json=True, json_fields=json_fields, query=query_fun)
     return Schemas(data=db_model_list)
 
 
@@ -138,10 +163,10 @@ async def get_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthScope
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthPermission.first(db=db, pk=pk)
+    db_model = await CRUDOAuthPermission.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    return Schemas(data=SchemasOAuthPermissionResponse(**db_model.to_dict()))
+    return schemas_response(db_model.to_dict(), SchemasOAuthPermissionResponse)
 
 
 @router.post('/{}'.format(permission_name), name="get {}".format(permission_name))
@@ -153,11 +178,11 @@ async def store_model(item: SchemasOAuthPermissionStoreUpdate, db: Session = Dep
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthPermission.first(db=db, where=("name", item.name))
+    db_model = await CRUDOAuthPermission.threaded.first(db=db, where=("name", item.name))
     if db_model is not None:
         return SchemasError(message="Data Already Registered")
-    bool_model = CRUDOAuthPermission.store(db=db, item=item)
-    return Schemas(data=SchemasOAuthPermissionResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthPermission.threaded.store(db=db, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthPermissionResponse)
 
 
 @router.put("/{}/{{pk}}".format(permission_name), name="update {}".format(permission_name))
@@ -170,11 +195,11 @@ async def update_put_model(pk: int, item: SchemasOAuthPermissionStoreUpdate, db:
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthPermission.first(db=db, pk=pk)
+    db_model = await CRUDOAuthPermission.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthPermission.update(db=db, pk=pk, item=item)
-    return Schemas(data=SchemasOAuthPermissionResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthPermission.threaded.update(db=db, pk=pk, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthPermissionResponse)
 
 
 @router.patch("/{}/{{pk}}".format(permission_name), name="update {}".format(permission_name))
@@ -187,11 +212,11 @@ async def update_patch_model(pk: int, item: SchemasOAuthPermissionStoreUpdate, d
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthPermission.first(db=db, pk=pk)
+    db_model = await CRUDOAuthPermission.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthPermission.update(db=db, pk=pk, item=item, exclude_unset=True)
-    return Schemas(data=SchemasOAuthPermissionResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthPermission.threaded.update(db=db, pk=pk, item=item, exclude_unset=True)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthPermissionResponse)
 
 
 @router.patch("/{}/{{pk}}/move_inside".format(permission_name), name="update {}".format(permission_name))
@@ -205,7 +230,7 @@ async def move_inside_permission_model(pk: int, inside_id: int, db: Session = De
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthPermission.move_inside(db=db, inside_id=inside_id, pk=pk)
+    bool_model = await CRUDOAuthPermission.threaded.move_inside(db=db, inside_id=inside_id, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -220,7 +245,7 @@ async def move_after_permission_model(pk: int, after_id: int, db: Session = Depe
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthPermission.move_after(db=db, after_id=after_id, pk=pk)
+    bool_model = await CRUDOAuthPermission.threaded.move_after(db=db, after_id=after_id, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -232,7 +257,7 @@ async def delete_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthSc
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthPermission.delete(db=db, pk=pk)
+    bool_model = await CRUDOAuthPermission.threaded.delete(db=db, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -245,5 +270,5 @@ async def delete_models(pks: List[int], db: Session = Depends(dbs),
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthPermission.delete(db=db, pks=pks)
+    bool_model = await CRUDOAuthPermission.threaded.delete(db=db, pks=pks)
     return Schemas(data=bool_model)
@@ -3,7 +3,7 @@ from typing import Optional, Union, List
 
 from pydantic import BaseModel
 
-from lsshu.internal.schema import SchemasPaginate, Schemas
+from lsshu.internal.schema import SchemasPaginate, Schemas, ModelGetterDict
 
 
 class SchemasOAuthPermissionResponse(BaseModel):
@@ -21,6 +21,7 @@ class SchemasOAuthPermissionResponse(BaseModel):
 
     class Config:
         orm_mode = True
+        getter_dict = ModelGetterDict
 
 
 class SchemasOAuthPermissionThinResponse(BaseModel):
@@ -1,29 +1,59 @@
+from typing import List, Tuple
+
 from sqlalchemy.orm import Session
 
-from lsshu.internal.crud import CRUDTree
+from lsshu.internal.crud import BaseCRUD, CRUDTree, hybridmethod
 from lsshu.oauth.model import ModelOAuthRoles, ModelOAuthPermissions
 from lsshu.oauth.role.schema import SchemasOAuthRoleStoreUpdate
 
 
+def _fill_scopes(db: Session, items: list):
+    """
+    按 items 的 permissions 填充 scopes 一次查询所有权限
+    :param db:
+    :param items:
+    :return:
+    """
+    ids = {pk for item in items if item.permissions for pk in item.permissions}
+    if ids:
+        scopes = {relation.id: relation.scope for relation in BaseCRUD.all(db=db, model=ModelOAuthPermissions, where=("id", 'in_', list(ids)))}
+        for item in items:
+            if item.permissions:
+                item.scopes = " ".join([scopes[pk] for pk in item.permissions if pk in scopes])
+
+
 class CRUDOAuthRole(CRUDTree):
     """用户表操作"""
     params_model = ModelOAuthRoles
     params_relationship = {
         "permissions": ModelOAuthPermissions
     }
+    params_load = {
+        "permissions": "selectin"
+    }
+    params_result_cache_ttl = 300  # 开启 DB_RESULT_CACHE 时生效
+
+    @hybridmethod
+    def store(self, db: Session, item: SchemasOAuthRoleStoreUpdate, **kwargs):
+        _fill_scopes(db, [item])
+        return super().store(db=db, item=item, **kwargs)
+
+    @hybridmethod
+    def store_many(self, db: Session, items: List[SchemasOAuthRoleStoreUpdate], **kwargs):
+        _fill_scopes(db, items)
+        return super().store_many(db=db, items=items, **kwargs)
+
+    @hybridmethod
+    def update_many(self, db: Session, items: List[Tuple[int, SchemasOAuthRoleStoreUpdate]], **kwargs):
+        _fill_scopes(db, [item for _, item in items])
+        return super().update_many(db=db, items=items, **kwargs)
+
+    @hybridmethod
+    def upsert_many(self, db: Session, items: List[SchemasOAuthRoleStoreUpdate], **kwargs):
+        _fill_scopes(db, items)
+        return super().upsert_many(db=db, items=items, **kwargs)
 
-    @classmethod
-    def store(cls, db: Session, item: SchemasOAuthRoleStoreUpdate, **kwargs):
-        if item.permissions:
-            from lsshu.internal.crud import BaseCRUD
-            _relation = BaseCRUD.all(db=db, model=ModelOAuthPermissions, where=("id", 'in_', item.permissions))
-            item.scopes = " ".join([relation.scope for relation in _relation])
-        return super(CRUDOAuthRole, cls).store(db=db, item=item, **kwargs)
-
-    @classmethod
-    def update(cls, db: Session, pk: int, item: SchemasOAuthRoleStoreUpdate, **kwargs):
-        if item.permissions:
-            from lsshu.internal.crud import BaseCRUD
-            _relation = BaseCRUD.all(db=db, model=ModelOAuthPermissions, where=("id", 'in_', item.permissions))
-            item.scopes = " ".join([relation.scope for relation in _relation])
-        return super(CRUDOAuthRole, cls).update(db=db, pk=pk, item=item, **kwargs)
+    @hybridmethod
+    def update(self, db: Session, pk: int, item: SchemasOAuthRoleStoreUpdate, **kwargs):
+        _fill_scopes(db, [item])
+        return super().update(db=db, pk=pk, item=item, **kwargs)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Security
 from sqlalchemy.orm import Session
@@ -6,7 +6,8 @@ from sqlalchemy.orm import Session
 from config import OAUTH_DEFAULT_TAGS
 from lsshu.internal.db import dbs
 from lsshu.internal.depends import model_screen_params, model_post_screen_params, auth_user
-from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError
+from lsshu.internal.export import export_response
+from lsshu.internal.schema import ModelScreenParams, Schemas, SchemasError, schemas_fields, schemas_ndjson, schemas_response
 from lsshu.oauth.model import role_name
 from lsshu.oauth.permission.crud import CRUDOAuthPermission
 from lsshu.oauth.role.crud import CRUDOAuthRole
@@ -27,8 +28,10 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     :param auth:
     :return:
     """
-    db_model_list = CRUDOAuthRole.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasOAuthRolePaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthRole.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthRoleResponse, params.fields)), SchemasOAuthRoleResponse, params.fields)
+    db_model_list = await CRUDOAuthRole.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthRoleResponse, params.fields))
+    return schemas_response(db_model_list, SchemasOAuthRolePaginateItem, params.fields)
 
 
 @router.post('/{}.post'.format(role_name), name="post {}".format(role_name))
@@ -40,8 +43,30 @@ async def post_models(db: Session = Depends(dbs), params: ModelScreenParams = De
     :param auth:
     :return:
     """
-    db_model_list = CRUDOAuthRole.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasOAuthRolePaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthRole.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthRoleResponse, params.fields)), SchemasOAuthRoleResponse, params.fields)
+    db_model_list = await CRUDOAuthRole.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthRoleResponse, params.fields))
+    return schemas_response(db_model_list, SchemasOAuthRolePaginateItem, params.fields)
+
+
+@router.get('/{}.download'.format(role_name), name="download {}".format(role_name))
+async def download_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params),
+                          auth: SchemasOAuthScopes = Security(auth_user, scopes=role_scopes + ["%s.download" % role_name])):
+    """
+    导出用户角色 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthRole, db=db, params=params, schema=SchemasOAuthRoleResponse, filename=role_name, fmt=fmt)
+
+
+@router.post('/{}.download.post'.format(role_name), name="download {}".format(role_name))
+async def download_post_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_post_screen_params),
+                               auth: SchemasOAuthScopes = Security(auth_user, scopes=role_scopes + ["%s.download" % role_name])):
+    """
+    导出用户角色 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthRole, db=db, params=params, schema=SchemasOAuthRoleResponse, filename=role_name, fmt=fmt)
 
 
 @router.get('/{}.params'.format(role_name), name="get {}".format(role_name))
@@ -56,7 +81,7 @@ async def params_models(db: Session = Depends(dbs), auth: SchemasOAuthScopes = S
         return node.to_dict()
 
     data = {
-        "permissions": CRUDOAuthPermission.get_tree(db=db, json=True, json_fields=json_fields)
+        "permissions": await CRUDOAuthPermission.threaded.get_tree(db=db, json=True, json_fields=json_fields)
     }
     return Schemas(data=SchemasParams(**data))
 
@@ -69,10 +94,10 @@ async def get_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthScope
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthRole.first(db=db, pk=pk)
+    db_model = await CRUDOAuthRole.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    return Schemas(data=SchemasOAuthRoleResponse(**db_model))
+    return schemas_response(db_model.to_dict(), SchemasOAuthRoleResponse)
 
 
 @router.post('/{}'.format(role_name), name="get {}".format(role_name))
@@ -84,11 +109,11 @@ async def store_model(item: SchemasOAuthRoleStoreUpdate, db: Session = Depends(d
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthRole.first(db=db, where=("name", item.name))
+    db_model = await CRUDOAuthRole.threaded.first(db=db, where=("name", item.name))
     if db_model is not None:
         return SchemasError(message="Data Already Registered")
-    bool_model = CRUDOAuthRole.store(db=db, item=item)
-    return Schemas(data=SchemasOAuthRoleResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthRole.threaded.store(db=db, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthRoleResponse)
 
 
 @router.put("/{}/{{pk}}".format(role_name), name="update {}".format(role_name))
@@ -101,11 +126,11 @@ async def update_put_model(pk: int, item: SchemasOAuthRoleStoreUpdate, db: Sessi
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthRole.first(db=db, pk=pk)
+    db_model = await CRUDOAuthRole.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthRole.update(db=db, pk=pk, item=item)
-    return Schemas(data=SchemasOAuthRoleResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthRole.threaded.update(db=db, pk=pk, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthRoleResponse)
 
 
 @router.patch("/{}/{{pk}}".format(role_name), name="update {}".format(role_name))
@@ -118,11 +143,11 @@ async def update_patch_model(pk: int, item: SchemasOAuthRoleStoreUpdate, db: Ses
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthRole.first(db=db, pk=pk)
+    db_model = await CRUDOAuthRole.threaded.first(db=db, pk=pk)
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthRole.update(db=db, pk=pk, item=item, exclude_unset=True)
-    return Schemas(data=SchemasOAuthRoleResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthRole.threaded.update(db=db, pk=pk, item=item, exclude_unset=True)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthRoleResponse)
 
 
 @router.delete("/{}/{{pk}}".format(role_name), name="delete {}".format(role_name))
@@ -133,7 +158,7 @@ async def delete_model(pk: int, db: Session = Depends(dbs), auth: SchemasOAuthSc
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthRole.delete(db=db, pk=pk)
+    bool_model = await CRUDOAuthRole.threaded.delete(db=db, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -145,5 +170,5 @@ async def delete_models(pks: List[int], db: Session = Depends(dbs), auth: Schema
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthRole.delete(db=db, pks=pks)
+    bool_model = await CRUDOAuthRole.threaded.delete(db=db, pks=pks)
     return Schemas(data=bool_model)
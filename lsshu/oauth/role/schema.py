@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import Optional, List
 from pydantic import BaseModel
 
-from lsshu.internal.schema import SchemasPaginate
+from lsshu.internal.schema import SchemasPaginate, ModelGetterDict
 from lsshu.oauth.permission.schema import SchemasOAuthPermissionThinResponse
 
 
@@ -16,6 +16,7 @@ class SchemasOAuthRoleResponse(BaseModel):
 
     class Config:
         orm_mode = True
+        getter_dict = ModelGetterDict
 
 
 class SchemasOAuthRolePaginateItem(SchemasPaginate):
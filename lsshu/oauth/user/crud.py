@@ -1,11 +1,30 @@
+from typing import List, Tuple
+
 from sqlalchemy.orm import Session
 
-from lsshu.internal.crud import CRUDTree
-from lsshu.internal.helpers import token_get_password_hash
+from lsshu.internal.crud import CRUDTree, hybridmethod
+from lsshu.internal.helpers import token_get_password_hashes
 from lsshu.oauth.model import ModelOAuthUsers, ModelOAuthPermissions, ModelOAuthRoles
 from lsshu.oauth.user.schema import SchemasOAuthUserStoreUpdate
 
 
+def _hash_passwords(items: list, clear_empty: bool = True):
+    """
+    加密 items 中的密码 全部一起提交到进程池 并行加密
+    :param items:
+    :param clear_empty: 空密码删除 不更新
+    :return:
+    """
+    hashing = [item for item in items if getattr(item, "password", None)]
+    if hashing:
+        for item, password in zip(hashing, token_get_password_hashes([item.password for item in hashing])):
+            item.password = password
+    if clear_empty:
+        for item in items:
+            if hasattr(item, "password") and not item.password:
+                delattr(item, "password")
+
+
 class CRUDOAuthUser(CRUDTree):
     """用户表操作"""
     params_model = ModelOAuthUsers
@@ -13,25 +32,49 @@ class CRUDOAuthUser(CRUDTree):
         "permissions": ModelOAuthPermissions,
         "roles": ModelOAuthRoles
     }
+    params_load = {
+        "permissions": "selectin",
+        "roles": "selectin"
+    }
 
-    @classmethod
-    def store(cls, db: Session, item: SchemasOAuthUserStoreUpdate, **kwargs):
-        if hasattr(item, "password") and item.password:
-            item.password = token_get_password_hash(item.password)
-        return super(CRUDOAuthUser, cls).store(db=db, item=item, **kwargs)
-
-    @classmethod
-    def update(cls, db: Session, pk: int, item: SchemasOAuthUserStoreUpdate, **kwargs):
-        if hasattr(item, "password") and item.password:
-            item.password = token_get_password_hash(item.password)
-        else:
-            if hasattr(item, "password"):
-                delattr(item, "password")
+    @hybridmethod
+    def store(self, db: Session, item: SchemasOAuthUserStoreUpdate, **kwargs):
+        _hash_passwords([item], clear_empty=False)
+        return super().store(db=db, item=item, **kwargs)
+
+    @hybridmethod
+    def store_many(self, db: Session, items: List[SchemasOAuthUserStoreUpdate], **kwargs):
+        _hash_passwords(items, clear_empty=False)
+        return super().store_many(db=db, items=items, **kwargs)
+
+    @hybridmethod
+    def update_many(self, db: Session, items: List[Tuple[int, SchemasOAuthUserStoreUpdate]], **kwargs):
+        _hash_passwords([item for _, item in items])
+        return super().update_many(db=db, items=items, **kwargs)
+
+    @hybridmethod
+    def upsert_many(self, db: Session, items: List[SchemasOAuthUserStoreUpdate], **kwargs):
+        _hash_passwords(items)
+        return super().upsert_many(db=db, items=items, **kwargs)
+
+    @hybridmethod
+    def update(self, db: Session, pk: int, item: SchemasOAuthUserStoreUpdate, **kwargs):
+        _hash_passwords([item])
+        return super().update(db=db, pk=pk, item=item, **kwargs)
 
-        return super(CRUDOAuthUser, cls).update(db=db, pk=pk, item=item, **kwargs)
+    @hybridmethod
+    def update_password(self, db: Session, pk: int, password_hash: str):
+        """
+        更新为已加密的密码 不再加密 (登录时 bcrypt cost 变更 重新加密)
+        :param db:
+        :param pk:
+        :param password_hash:
+        :return:
+        """
+        return super().update_many(db=db, items=[(pk, SchemasOAuthUserStoreUpdate.construct(password=password_hash))])
 
-    @classmethod
-    def all(cls, **kwargs):
+    @hybridmethod
+    def all(self, **kwargs):
         kwargs.update({
             "order": [("sort", "asc")]
         })
@@ -8,8 +8,10 @@ from config import OAUTH_DEFAULT_TAGS, OAUTH_ACCESS_TOKEN_EXPIRE_MINUTES, OAUTH_
     OAUTH_TOKEN_URI, OAUTH_SCOPES_URI, OAUTH_ME_URI
 from lsshu.internal.db import dbs
 from lsshu.internal.depends import model_screen_params, model_post_screen_params, auth_user
-from lsshu.internal.helpers import token_access_token, token_verify_password
-from lsshu.internal.schema import Schemas, SchemasError, ModelScreenParams
+from lsshu.internal.executor import run_db
+from lsshu.internal.export import export_response
+from lsshu.internal.helpers import token_access_token, token_verify_password_and_update
+from lsshu.internal.schema import Schemas, SchemasError, ModelScreenParams, schemas_fields, schemas_ndjson, schemas_stream, schemas_response
 from lsshu.oauth.model import user_name
 from lsshu.oauth.permission.crud import CRUDOAuthPermission
 from lsshu.oauth.role.crud import CRUDOAuthRole
@@ -33,8 +35,12 @@ def authenticate_user(db: Session, username: str, password: str):
     from lsshu.oauth.user.crud import CRUDOAuthUser
     user = CRUDOAuthUser.first(db=db, where=("username", username))
 
-    if not user or not token_verify_password(plain_password=password, hashed_password=user.password):
+    verified, new_hash = token_verify_password_and_update(plain_password=password, hashed_password=user.password) if user else (False, None)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect username or password")
+    if new_hash:
+        # bcrypt cost 已变更 登录时重新加密
+        CRUDOAuthUser.update_password(db=db, pk=user.id, password_hash=new_hash)
     return user
 
 
@@ -102,7 +108,8 @@ async def login_for_access_token(db: Session = Depends(dbs), form_data: _OAuth2P
     获取登录授权:
     - **form_data**: 登录数据
     """
-    access_token = token_authenticate_access_token(
+    access_token = await run_db(
+        token_authenticate_access_token,
         db=db,
         username=form_data.username,
         password=form_data.password,
@@ -111,7 +118,6 @@ async def login_for_access_token(db: Session = Depends(dbs), form_data: _OAuth2P
     return SchemasLoginResponse(data=SchemasLogin(access_token=access_token, token_type="bearer"))
 
 
-
 @router.get(OAUTH_SCOPES_URI)
 async def get_scopes(auth: SchemasOAuthScopes = Security(auth_user)):
     """
@@ -133,8 +139,8 @@ async def patch_me(item: SchemasOAuthUserStoreUpdate, db: Session = Depends(dbs)
     """
     更新登录授权用户的信息:
     """
-    bool_model = CRUDOAuthUser.update(db=db, pk=auth.user.id, item=item)
-    return Schemas(data=SchemasOAuthUserResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthUser.threaded.update(db=db, pk=auth.user.id, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthUserResponse)
 
 
 @router.get('/{}'.format(user_name), name="get {}".format(user_name))
@@ -147,8 +153,10 @@ async def get_models(db: Session = Depends(dbs), params: ModelScreenParams = Dep
     - **:param auth**:
     - **:return**:
     """
-    db_model_list = CRUDOAuthUser.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthUser.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthUserResponse, params.fields)), SchemasOAuthUserResponse, params.fields)
+    db_model_list = await CRUDOAuthUser.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthUserResponse, params.fields))
+    return schemas_response(db_model_list, SchemasPaginateItem, params.fields)
 
 
 @router.post('/{}.post'.format(user_name), name="post {}".format(user_name))
@@ -161,8 +169,30 @@ async def post_models(db: Session = Depends(dbs), params: ModelScreenParams = De
     - **:param auth**:
     - **:return**:
     """
-    db_model_list = CRUDOAuthUser.paginate(db=db, screen_params=params)
-    return Schemas(data=SchemasPaginateItem(**db_model_list))
+    if params.stream:
+        return schemas_ndjson(CRUDOAuthUser.chunks(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthUserResponse, params.fields)), SchemasOAuthUserResponse, params.fields)
+    db_model_list = await CRUDOAuthUser.threaded.paginate(db=db, screen_params=params, fields=schemas_fields(SchemasOAuthUserResponse, params.fields))
+    return schemas_response(db_model_list, SchemasPaginateItem, params.fields)
+
+
+@router.get('/{}.download'.format(user_name), name="download {}".format(user_name))
+async def download_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_screen_params),
+                          auth: SchemasOAuthScopes = Security(auth_user, scopes=user_scopes + ["%s.download" % user_name])):
+    """
+    导出授权用户 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthUser, db=db, params=params, schema=SchemasOAuthUserResponse, filename=user_name, fmt=fmt)
+
+
+@router.post('/{}.download.post'.format(user_name), name="download {}".format(user_name))
+async def download_post_models(fmt: Optional[str] = "xlsx", db: Session = Depends(dbs), params: ModelScreenParams = Depends(model_post_screen_params),
+                               auth: SchemasOAuthScopes = Security(auth_user, scopes=user_scopes + ["%s.download" % user_name])):
+    """
+    导出授权用户 使用当前筛选条件 不分页 流式输出
+    - **fmt**: xlsx csv
+    """
+    return export_response(CRUDOAuthUser, db=db, params=params, schema=SchemasOAuthUserResponse, filename=user_name, fmt=fmt)
 
 
 @router.get('/{}.params'.format(user_name), name="get {}".format(user_name))
@@ -173,11 +203,10 @@ async def params_models(db: Session = Depends(dbs), auth: SchemasOAuthScopes = S
     :return:
     """
     data = {
-        "roles": CRUDOAuthRole.all(db=db),
-        "permissions": CRUDOAuthPermission.all(db=db)
+        "roles": CRUDOAuthRole.chunks(db=db),
+        "permissions": CRUDOAuthPermission.chunks(db=db)
     }
-
-    return Schemas(data=SchemasParams(**data))
+    return schemas_stream(data, SchemasParams)
 
 
 @router.get('/{}/{{pk}}'.format(user_name), name="get {}".format(user_name))
@@ -189,10 +218,10 @@ async def get_model(pk: int, db: Session = Depends(dbs),
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthUser.first(db=db, where=(CRUDOAuthUser.params_pk, pk))
+    db_model = await CRUDOAuthUser.threaded.first(db=db, where=(CRUDOAuthUser.params_pk, pk))
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    return Schemas(data=SchemasOAuthUserResponse(**db_model.to_dict()))
+    return schemas_response(db_model.to_dict(), SchemasOAuthUserResponse)
 
 
 @router.post('/{}'.format(user_name), name="get {}".format(user_name))
@@ -203,11 +232,11 @@ async def store_model(item: SchemasOAuthUserStoreUpdate, db: Session = Depends(d
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthUser.first(db=db, where=("username", item.username))
+    db_model = await CRUDOAuthUser.threaded.first(db=db, where=("username", item.username))
     if db_model is not None:
         return SchemasError(message="Data Already Registered")
-    bool_model = CRUDOAuthUser.store(db=db, item=item)
-    return Schemas(data=SchemasOAuthUserResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthUser.threaded.store(db=db, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthUserResponse)
 
 
 @router.put("/{}/{{pk}}".format(user_name), name="update {}".format(user_name))
@@ -220,11 +249,11 @@ async def update_put_model(pk: int, item: SchemasOAuthUserStoreUpdate, db: Sessi
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthUser.first(db=db, where=(CRUDOAuthUser.pk, pk))
+    db_model = await CRUDOAuthUser.threaded.first(db=db, where=(CRUDOAuthUser.params_pk, pk))
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthUser.update(db=db, pk=pk, item=item)
-    return Schemas(data=SchemasOAuthUserResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthUser.threaded.update(db=db, pk=pk, item=item)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthUserResponse)
 
 
 @router.patch("/{}/{{pk}}".format(user_name), name="update {}".format(user_name))
@@ -237,11 +266,11 @@ async def update_patch_model(pk: int, item: SchemasOAuthUserStoreUpdate, db: Ses
     :param auth:
     :return:
     """
-    db_model = CRUDOAuthUser.first(db=db, where=(CRUDOAuthUser.pk, pk))
+    db_model = await CRUDOAuthUser.threaded.first(db=db, where=(CRUDOAuthUser.params_pk, pk))
     if db_model is None:
         return SchemasError(message="Data Not Found")
-    bool_model = CRUDOAuthUser.update(db=db, pk=pk, item=item, exclude_unset=True)
-    return Schemas(data=SchemasOAuthUserResponse(**bool_model.to_dict()))
+    bool_model = await CRUDOAuthUser.threaded.update(db=db, pk=pk, item=item, exclude_unset=True)
+    return schemas_response(bool_model.to_dict(), SchemasOAuthUserResponse)
 
 
 @router.delete("/{}/{{pk}}".format(user_name), name="delete {}".format(user_name))
@@ -253,7 +282,7 @@ async def delete_model(pk: int, db: Session = Depends(dbs),
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthUser.delete(db=db, pk=pk)
+    bool_model = await CRUDOAuthUser.threaded.delete(db=db, pk=pk)
     return Schemas(data=bool_model)
 
 
@@ -266,5 +295,5 @@ async def delete_models(pks: List[int], db: Session = Depends(dbs),
     :param auth:
     :return:
     """
-    bool_model = CRUDOAuthUser.delete(db=db, pks=pks)
+    bool_model = await CRUDOAuthUser.threaded.delete(db=db, pks=pks)
     return Schemas(data=bool_model)
@@ -3,7 +3,7 @@ from typing import Optional, List
 
 from pydantic import BaseModel
 
-from lsshu.internal.schema import Schemas, SchemasPaginate
+from lsshu.internal.schema import Schemas, SchemasPaginate, ModelGetterDict
 from lsshu.oauth.permission.schema import SchemasOAuthPermissionResponse
 from lsshu.oauth.role.schema import SchemasOAuthRoleResponse
 
@@ -35,6 +35,7 @@ class SchemasOAuthUserResponse(BaseModel):
 
     class Config:
         orm_mode = True
+        getter_dict = ModelGetterDict
 
 
 class SchemasPaginateItem(SchemasPaginate):
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from lsshu.internal.profiler import SQLProfilerMiddleware
 from lsshu.oauth.main import router as router_oauth
 
 app = FastAPI(
@@ -14,6 +15,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(SQLProfilerMiddleware)  # 请求 SQL 统计 Server-Timing
 app.include_router(router_oauth, prefix="/api")
 if __name__ == '__main__':
     import uvicorn
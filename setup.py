@@ -34,11 +34,14 @@ setup(name="lsshu-cms",
           "SQLAlchemy==1.4.46",
           "Pillow",
           "pymysql",
+          "aiosqlite",
+          "aiomysql",
           "sqlalchemy-mptt",
           "user-agents",
           "requests",
           "openpyxl",
           "aioredis",
+          "redis",
           "filetype",
           "pycryptodome"
       ]
@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from lsshu.internal.crud import COUNT_CACHE
+from lsshu.oauth.model import Model, ModelOAuthUsers, ModelOAuthPermissions
+from lsshu.oauth.user.crud import CRUDOAuthUser
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Model.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    permissions = [ModelOAuthPermissions(name="p%s" % i, scope="test.p%s" % i, path="/") for i in range(3)]
+    session.add_all([ModelOAuthUsers(username="u%s" % i, password="-", permissions=permissions) for i in range(5)])
+    session.commit()
+    COUNT_CACHE.clear()
+    yield session
+    session.close()
+    engine.dispose()
+    COUNT_CACHE.clear()
+
+
+@pytest.mark.parametrize("limit", [0, None, 2, 5, 100])
+@pytest.mark.parametrize("load", [{"permissions": "joined"}, {"permissions": "selectin"}])
+def test_paginate_total_matches_count(db, limit, load):
+    data = CRUDOAuthUser.paginate(db=db, limit=limit, load=load)
+    assert data["total"] == CRUDOAuthUser.count(db=db) == 5
+    assert len({item.id for item in data["items"]}) == len(data["items"])
+